@@ -6,6 +6,10 @@
 # code which call itself
 # Useful for code with tree like structures
 
+# The demo calls sit under if __name__ == '__main__': so the functions can be imported
+#   - importlib.import_module('1_Recursion_and_Trees') runs nothing but the defs and dicts
+#   - trees.py has the same routines taking the tree as an argument, for real use
+
 
 ## -----Initial example-----: Recusively generating kmers
 
@@ -15,12 +19,13 @@
 
 bases = ['A', 'T', 'C', 'G']
 
-result = []
-for base1 in bases:
-    for base2 in bases:
-        for base3 in bases:
-            result.append(base1 + base2 + base3)
-print(result)
+if __name__ == '__main__':
+    result = []
+    for base1 in bases:
+        for base2 in bases:
+            for base3 in bases:
+                result.append(base1 + base2 + base3)
+    print(result)
 
 # ---Problem: A function capable of searching for any k length would be tough with this method
 # Here: One possible solution
@@ -48,7 +53,8 @@ def generate_kmers(length):
 
 # ---Idea: Equivalent of nesting code an arbitrary amount of times
 
-generate_kmers(5)  # Success
+if __name__ == '__main__':
+    generate_kmers(5)  # Success
 
 
 # ---Another method
@@ -63,7 +69,8 @@ def generate_kmers_rec(length):
                 result.append(seq + base)
         return result
 
-generate_kmers_rec(5)
+if __name__ == '__main__':
+    generate_kmers_rec(5)
 
 # This is a recursive function because it calls upon itself!
 
@@ -86,6 +93,10 @@ generate_kmers_rec(5)
 # 3) Each funcion called for different lengths have different results = [] lists
 #    - generate_kmers_rec(3) is different from generate_kmers_rec(2)
 #    - Python can have the same names because of their scoping rules
+#
+# ---SCALING UP: both versions hold all 4^k strings in memory at once
+#    - kmers.py treats the k-mer space like range(): lazy, indexable and splittable
+#    - list(KmerSpace(5)) gives the same list as generate_kmers(5)
 
 
 # ------- Processing Tree-like data -------
@@ -145,7 +156,8 @@ def get_parent(taxon):
     third_parent = tax_dict.get(second_parent)
     return[first_parent, second_parent, third_parent]
 
-get_parent("Pongo abelii")
+if __name__ == '__main__':
+    get_parent("Pongo abelii")
 
 # PROBLEM: Requires us to know the maximum numbers of ancestors in advance
 
@@ -157,7 +169,8 @@ def get_ancestors(taxon):
         taxon = tax_dict.get(taxon)
     return result
 
-get_ancestors("Pongo abelii")
+if __name__ == '__main__':
+    get_ancestors("Pongo abelii")
 
 # NEW ADVANCED RECURSIVE METHOD
 
@@ -169,28 +182,30 @@ def get_ancestors_rec(taxon):
         parent_ancestor = get_ancestors_rec(parent)
         return [parent] + parent_ancestor
 
-get_ancestors_rec("Pongo abelii")
+if __name__ == '__main__':
+    get_ancestors_rec("Pongo abelii")
 
 # PROBLEM: This ran too many times without an ends
 #   - Adding in print statements to troubleshoot
 
-def get_ancestors_rec(taxon):
-    print('Getting the ancestor for ' + taxon)
-    if taxon == 'Primates':
-        print('taxon is primates, returning an empty list')
-        return []
-    else:
-        print('taxon is not primates, looking up the parent')
-        parent = tax_dict.get(taxon)
-        print('The parent is ' + parent)
-        print('looking up ancestors for ' + parent)
-        parent_ancestor = get_ancestors_rec(parent)
-        print('parent ancestors are ' + str(parent_ancestor))
-        result = [parent] + parent_ancestor
-        print('About to return the result: ' + str(result))
-        return result
-
-get_ancestors_rec("Galago allenii")
+if __name__ == '__main__':
+    def get_ancestors_rec(taxon):
+        print('Getting the ancestor for ' + taxon)
+        if taxon == 'Primates':
+            print('taxon is primates, returning an empty list')
+            return []
+        else:
+            print('taxon is not primates, looking up the parent')
+            parent = tax_dict.get(taxon)
+            print('The parent is ' + parent)
+            print('looking up ancestors for ' + parent)
+            parent_ancestor = get_ancestors_rec(parent)
+            print('parent ancestors are ' + str(parent_ancestor))
+            result = [parent] + parent_ancestor
+            print('About to return the result: ' + str(result))
+            return result
+
+    get_ancestors_rec("Galago allenii")
 
 # This worked, the issue was I didn't have primates capitalized
 #   - Thus it wasn't showing up as being on the dictionary
@@ -200,27 +215,38 @@ get_ancestors_rec("Galago allenii")
 
 # CONCEPT: Adding indents to recursive functions allow indication to cycles
 
-def get_ancestors_rec(taxon, depth):
-    spacer = ' ' * depth
-    print(spacer + 'Getting the ancestor for ' + taxon)
-    if taxon == 'Primates':
-        print(spacer + 'taxon is primates, returning an empty list')
-        return []
-    else:
-        print(spacer + 'taxon is not primates, looking up the parent')
-        parent = tax_dict.get(taxon)
-        print(spacer + 'The parent is ' + parent)
-        print(spacer + 'looking up ancestors for ' + parent)
-        parent_ancestor = get_ancestors_rec(parent, depth + 4)
-        print(spacer + 'parent ancestors are ' + str(parent_ancestor))
-        result = [parent] + parent_ancestor
-        print(spacer + 'About to return the result: ' + str(result))
-        return result
-
-get_ancestors_rec("Galago allenii", 0)
+if __name__ == '__main__':
+    def get_ancestors_rec(taxon, depth):
+        spacer = ' ' * depth
+        print(spacer + 'Getting the ancestor for ' + taxon)
+        if taxon == 'Primates':
+            print(spacer + 'taxon is primates, returning an empty list')
+            return []
+        else:
+            print(spacer + 'taxon is not primates, looking up the parent')
+            parent = tax_dict.get(taxon)
+            print(spacer + 'The parent is ' + parent)
+            print(spacer + 'looking up ancestors for ' + parent)
+            parent_ancestor = get_ancestors_rec(parent, depth + 4)
+            print(spacer + 'parent ancestors are ' + str(parent_ancestor))
+            result = [parent] + parent_ancestor
+            print(spacer + 'About to return the result: ' + str(result))
+            return result
+
+    get_ancestors_rec("Galago allenii", 0)
 
 # Looks much clearer
 
+# SCALING UP: the prints run on every call and have to be deleted again to switch them off
+#   - tracing.Tracer watches the plain function from outside and costs nothing when it is off
+#   - with Tracer(get_ancestors_rec) as tracer: get_ancestors_rec('Galago allenii')
+#     then tracer.print_tree() shows the same indented story, with results and times
+#   - tracer.print_summary() gives calls and time per function, tracer.write_folded() a flame graph
+
+# SCALING UP: every call walks all the way to the root again, and deep lineages hit the recursion limit
+#   - ancestor_cache.py remembers paths (sharing the part above each parent) with a size limit
+#   - AncestorCache(tax_dict).get_ancestors(taxon) gives the same list, .cache_info() shows hits and misses
+
 
 # ---Parent to child trees
 
@@ -230,11 +256,13 @@ get_ancestors_rec("Galago allenii", 0)
 
 # SOLUTION: key is parent taxon, value is list of children
 
-tax_dict = {
+# (a new name, so it does not replace the child -> parent tax_dict the functions above use)
+strepsirrhini_dict = {
     'Strepsirrhini' : ['Lorisdae', 'Lemuriformes', 'Lorisformes']
 }
 
-print(tax_dict)
+if __name__ == '__main__':
+    print(strepsirrhini_dict)
 
 # Using this method we can clean up our previous dictionary
 
@@ -265,7 +293,8 @@ def get_children(taxon):
 
     return result
 
-get_children('Strepsirrhini')
+if __name__ == '__main__':
+    get_children('Strepsirrhini')
 
 
 # RECURSIVE SOLUTION
@@ -277,10 +306,18 @@ def get_children_rec(taxon):
         result.extend(get_children_rec(child))
     return result
 
-get_children_rec('Strepsirrhini')
+if __name__ == '__main__':
+    get_children_rec('Strepsirrhini')
 
 # Much simpler for parent to child relationship
 
+# SCALING UP: both dicts hash a full taxon name at every step
+#   - taxonomy.py swaps names for integer ids and keeps the tree in arrays
+#   - Taxonomy.from_parent_to_children(new_tax_dict) (or from_child_to_parent(tax_dict))
+#   - .parent_to_children() / .child_to_parent() behave like the dicts, so the functions above run on them
+#   - subtree_index.py answers "is X under Y" with two comparisons and keeps working as taxa are added
+#   - ncbi_taxonomy.load_ncbi_taxonomy('nodes.dmp', 'names.dmp') loads the real NCBI tree (cached after the first run)
+
 
 
 #-------------- EXERCISES --------------
@@ -314,18 +351,25 @@ get_children_rec('Strepsirrhini')
 
 def last_common_ancestor_iter(tax_dict, ancestor1, ancestor2):
 
-# 2: Initializaing the variable answer
+    # 2: Remember every ancestor of the first taxon (itself included)
+    #   - stepping both taxa up together only meets when they are the same depth below the root
+    lineage = [ancestor1]
+    while ancestor1 in tax_dict:
+        ancestor1 = tax_dict.get(ancestor1)
+        lineage.append(ancestor1)
+
+    # 3: Walk up from the second taxon until we reach one of them
+    while ancestor2 is not None and ancestor2 not in lineage:
+        ancestor2 = tax_dict.get(ancestor2)
+    return ancestor2
 
-ancestor1 = ""
-ancestor2 = ""
-while ancestor1 != ancestor2:
-    ancestor1 = tax_dict.get(ancestor1)
-    ancestor2 = tax_dict.get(ancestor2)
-print(ancestor1, ancestor2)
+if __name__ == '__main__':
+    print(last_common_ancestor_iter(tax_dict, 'Pan troglodytes', 'Tarsius tarsier'))
 
 
 # --- Recursive solution
 
+# (first attempt, it never finishes: see the SOLUTION below)
 def last_common_ancestor_rec(tax_dict, ancestor1, ancestor2):
     older_generation_left = tax_dict.get(ancestor1)
     older_generation_right = tax_dict.get(ancestor2)
@@ -360,8 +404,9 @@ def get_ancestors(taxon):
         taxon = tax_dict.get(taxon)
     return result
 
-get_ancestors("Pan troglodytes")
-get_ancestors("Tarsius tarsier")
+if __name__ == '__main__':
+    get_ancestors("Pan troglodytes")
+    get_ancestors("Tarsius tarsier")
 
 def get_lca(taxon1, taxon2):  # lca = last common ancestor
     taxon1_ancestors = [taxon1] + get_ancestors(taxon1)
@@ -369,16 +414,18 @@ def get_lca(taxon1, taxon2):  # lca = last common ancestor
         if taxon in taxon1_ancestors:
             return taxon
 
-get_lca("Pan troglodytes", "Tarsius tarsier")
-get_lca("Pan troglodytes", "Pongo abelii")
-get_lca("Pan troglodytes", "Strepsirrhini")
+if __name__ == '__main__':
+    get_lca("Pan troglodytes", "Tarsius tarsier")
+    get_lca("Pan troglodytes", "Pongo abelii")
+    get_lca("Pan troglodytes", "Strepsirrhini")
 
 
 # NUANCES
 #   - Input taxa don't have the same number of parents
 #   - Need to make sure the list of ancestors considered for a taxon includes the taxon itself (see below)
 
-get_lca("Haplorrhini", "Pan troglodytes")
+if __name__ == '__main__':
+    get_lca("Haplorhini", "Pan troglodytes")  # spelt as in tax_dict, an unknown taxon never reaches 'Primates'
 
 
 # NEXT STEP
@@ -393,7 +440,8 @@ def get_lca_list(taxa):
         taxon1 = lca
     return taxon1
 
-print(get_lca_list(['Pan troglodytes', 'Tarsius tarsier', 'Pongo abelii']))
+if __name__ == '__main__':
+    print(get_lca_list(['Pan troglodytes', 'Tarsius tarsier', 'Pongo abelii']))
 
 
 # Add print statements to see what is happening through different steps
@@ -410,7 +458,10 @@ def get_lca_list_visual(taxa):
         taxon1 = lca # because we need taxon1 to be set in the 'while' loop
     return taxon1
 
-print(get_lca_list_visual(['Pan troglodytes', 'Tarsius tarsier', 'Pongo abelii']))
+if __name__ == '__main__':
+    print(get_lca_list_visual(['Pan troglodytes', 'Tarsius tarsier', 'Pongo abelii']))
+
+# SCALING UP: Tracer(get_lca_list, get_lca) shows every LCA step the same way, without the prints
 
 
 
@@ -425,7 +476,6 @@ def get_lca_rec_pop(taxa):
         lca_rest = get_lca_rec(taxa)
         return get_lca(taxon1, lca_rest)
 
-print(get_lca_rec_pop(['Pan troglodytes', 'Tarsius tarsier', 'Pongo abelii']))
 
 
 # PROBLEM: This ran too many times without an ends
@@ -442,10 +492,23 @@ def get_lca_rec(taxa):
         lca_rest = get_lca_rec(rest)
         return get_lca(taxon1, lca_rest)
 
+if __name__ == '__main__':
+    print(get_lca_rec_pop(['Pan troglodytes', 'Tarsius tarsier', 'Pongo abelii']))
+    print(get_lca_rec(['Pan troglodytes', 'Tarsius tarsier', 'Pongo abelii']))
+
 # This worked with 'slicing'
 # Creates a new list each time rather than modifying the original list
 
 
+# SCALING UP: get_lca rebuilds both ancestor lists on every call
+#   - lca.py indexes the tree once (binary lifting), then each query is a few array lookups
+#   - LcaIndex.from_child_to_parent(tax_dict).lca_list(taxa) gives the same answer as get_lca_list
+#   - lca_ids / lca_groups answer whole arrays of queries at once
+#   - classify.py runs that over a stream of (read_id, [taxa]) records, in batches and on a process pool
+#   - python benchmarks.py run results.json times every version above (and the scaled-up ones)
+#     on synthetic trees of growing size; benchmarks.py compare old.json new.json flags regressions
+
+
 
 
 
@@ -1,15 +1,21 @@
 # ---------- TUPLES ---------- #
 
+# The demo code sits under if __name__ == '__main__': so importing this file runs nothing
+
 # parentheses instead of square brackets
 # immutable, cannot be changed
 # cannot append or remove to a tuple
 # cannot reverse or sort
 
 t = (4, 5, 6)
-for e in t:
-    print(e+1)
+if __name__ == '__main__':
+    for e in t:
+        print(e+1)
 
-t[1] = 9  # doesn't work -> immutable
+    try:
+        t[1] = 9  # doesn't work -> immutable
+    except TypeError as error:
+        print(error)
 
 # due to immuntablity, tuples can be used as keys in a dictionary
 
@@ -33,20 +39,24 @@ t2 = ('ttaggttta', 'XYZ456', 2)
 
 # OPTION 1: make a list and check is the item has already been added to the list
 
-processed_numbers = []
-for acc in acc_list:
-    if acc not in processed_numbers:
-        acc_numbers.append(acc)
+acc_list = ['ABC123', 'XYZ456', 'ABC123', 'PQR789', 'XYZ456']
+
+if __name__ == '__main__':
+    processed_numbers = []
+    for acc in acc_list:
+        if acc not in processed_numbers:
+            processed_numbers.append(acc)
 
 # bad method as it takes a long time with a long list
 
 
 # OPTION 2: use a dictionary
 
-processed_numbers = {}
-for acc in acc_list:
-    if acc not in processed_numbers:
-        processed_numbers[acc] = 1
+if __name__ == '__main__':
+    processed_numbers = {}
+    for acc in acc_list:
+        if acc not in processed_numbers:
+            processed_numbers[acc] = 1
 
 # Better method because it is much faster to look up a value in a dictionary
 # Bad method as it takes up a lot of memory storing all the '1' values that we don't need later
@@ -54,18 +64,25 @@ for acc in acc_list:
 
 # OPTION 3: use a set
 
-processed_numbers = set()
-for acc in acc_list:
-    if not acc in processed_numbers:
-        processed_numbers.add(acc)
+if __name__ == '__main__':
+    processed_numbers = set()
+    for acc in acc_list:
+        if not acc in processed_numbers:
+            processed_numbers.add(acc)
 
 # Best method because it doesn't take up a lot of memory
 # Bad method as it takes a long time with a long list
 
+# SCALING UP: all three options keep every accession string in memory
+#   - dedup.py keeps 8-byte fingerprints instead and streams accessions from a file
+#   - deduplicate('accessions.txt') is exact and writes sorted runs to disk when RAM fills up
+#   - deduplicate('accessions.txt', 'approximate', capacity=10**9) uses a Bloom filter instead
+#   - both return (unique accessions, deduplicator), deduplicator.stats has memory and speed
+
 
 # Can create a non empty set using curly brackets
 
-set = {4, 7, 6, 12}
+my_set = {4, 7, 6, 12}  # (not called set, that would hide set() itself)
 
 # Different from a dictionary as it's individual elements not value pairs
 
@@ -81,30 +98,43 @@ set = {4, 7, 6, 12}
 
 # EXAMPLE 1: lists of file objects
 
-[open('one.txt'), open('two.txt')]
+if __name__ == '__main__':
+    try:
+        files = [open('one.txt'), open('two.txt')]
+    except FileNotFoundError as error:  # there is no one.txt / two.txt here
+        print(error)
+
+# SCALING UP: thousands of open files run out of file descriptors, and these are never closed
+#   - multi_reader.MultiFileReader(paths, max_open=64) keeps at most 64 open, closing the oldest
+#   - iterating over it gives (file number, record) for every file, read ahead on a background thread
+#   - fmt='fasta' gives (header, sequence) records, .stats counts descriptors and throughput
 
 
 # EXAMPLE 2: lists of regular expressions'
 
-import re
-[re.search(r'[^ATGC]', 'ACTRGGT'), re.search(r'[^ATGC]', 'ACTYGGT')]
+if __name__ == '__main__':
+    import re
+    print([re.search(r'[^ATGC]', 'ACTRGGT'), re.search(r'[^ATGC]', 'ACTYGGT')])
+
+# SCALING UP: one re.search and one match object per sequence is slow for millions of reads
+#   - base_check.check_sequences(['ACTRGGT', 'ACTYGGT']) checks them all in one pass
+#   - .valid, .first_invalid, every invalid position and counts of each IUPAC code per sequence
+#   - check_bases(buffer, offsets) works on sequences already packed into one buffer
 
 
 # Main Point: lists of lists
 
-[[1,2,3], [4,5,6], [7,8,9]]
+lol = [[1,2,3], [4,5,6], [7,8,9]]
 
 # more readble
 
-[[1,2,3],
- [4,5,6],
- [7.8.9]]
-
-lol = [[1,2,3], [4,5,6], [7,8,9]]
-print(lol[1])
+lol = [[1,2,3],
+       [4,5,6],
+       [7,8,9]]
 
-lol = [[1,2,3], [4,5,6], [7,8,9]]
-print(lol[1][2]) # prints 6
+if __name__ == '__main__':
+    print(lol[1])
+    print(lol[1][2]) # prints 6
 
 # Can store alignments this way
 
@@ -113,20 +143,28 @@ aln = [['A', 'T', '-', 'G', 'T'],
        ['A', 'C', 'G', 'T', 'T']]
 
 seq = aln[2]
-print(seq)
+if __name__ == '__main__':
+    print(seq)
 
 # can get one column of each
 
 first_character = []
 for pos1 in aln:
     first_character.append(pos1[0])
-print(first_character)
+if __name__ == '__main__':
+    print(first_character)
 
 # This worked
 # could have been written more cleanly as
 
 first_character = [pos[0] for pos in aln]
 
+# SCALING UP: every base here is a separate string, every column a Python loop
+#   - alignment.py keeps the whole alignment in one 2-D array of bytes
+#   - Alignment.from_rows(aln).column(0) is first_character, without copying anything
+#   - .consensus(), .gap_fraction(), .base_frequencies(), .conservation() do every column at once
+#   - Alignment.from_fasta('big.fa', 'big.aln') writes it to disk and memory-maps it
+
 
 # ---------- lists of dictionaries and lists of tuples ---------- #
 
@@ -152,14 +190,21 @@ enzymes = {
     'BisI'  : r'GC[ATCG]GC'
 }
 
+# SCALING UP: one re.finditer per enzyme (and per strand) is one pass over the genome each
+#   - restriction_sites.SiteScanner(enzymes) compiles all of them (IUPAC codes too) into one matcher
+#   - .scan_file('genome.fa') finds every site of every enzyme on both strands in one streamed pass
+#   - hits come back as arrays (record, enzyme, position, strand), .to_list() makes tuples of them
+
 one_record = records[0]
-print(one_record)
+if __name__ == '__main__':
+    print(one_record)
 
 # use of label type keys leads to very readable processing of dicts
 
-for record in records:
-    print('accession number : ' + record['accession'])
-    print('genetic code: ' + str(record['genetic_code']))
+if __name__ == '__main__':
+    for record in records:
+        print('accession number : ' + record['accession'])
+        print('genetic code: ' + str(record['genetic_code']))
 
 
 # Example: Storing this information as tuples instead
@@ -174,19 +219,27 @@ records = [
 # relies on the order of the tuple to identify them
 # Arguably more readable as well
 
-for record in records:
-    print('accession number: ' + record[1])
-    print('genetic code: ' + str(record[2]))
+if __name__ == '__main__':
+    for record in records:
+        print('accession number: ' + record[1])
+        print('genetic code: ' + str(record[2]))
 
 # A common technique is to assign all elements of a tuple to temporary variables
 
-for record in records:
-    (this_sequence, this_accesion, this_code) = record
-    print('accession number: ' + this_accesion)
-    print('genetic code: ' + str(this_code))
+if __name__ == '__main__':
+    for record in records:
+        (this_sequence, this_accesion, this_code) = record
+        print('accession number: ' + this_accesion)
+        print('genetic code: ' + str(this_code))
 
 # This techniques is known as 'unpacking the tuple' and leads to readable code for when number of elements are small
 
+# SCALING UP: tuples are light but lose the field names, dicts keep them but are heavy
+#   - sequence_record.SequenceRecord has named fields and __slots__ (no dict per record)
+#   - record.accession works, and so does (this_sequence, this_accesion, this_code) = record
+#   - records_from_fasta('seqs.fa') and records_from_csv('seqs.csv') build them in bulk
+#   - python sequence_record.py compares dict, tuple and SequenceRecord on a million records
+
 
 
 # ---------- Dicts of sets ---------- #
@@ -206,29 +259,48 @@ gene_sets = {
 
 # Question: is gene 3 overexpressed in response to arsenic?
 
-3 in gene_sets['arsenic']
+if __name__ == '__main__':
+    3 in gene_sets['arsenic']
 
 
 # checking which case gene 5 is overexpressed
 
-for metal, genes in gene_sets.items():
-    if 5 in genes:
-        print(metal)
+if __name__ == '__main__':
+    for metal, genes in gene_sets.items():
+        if 5 in genes:
+            print(metal)
 
 # or can use list comprehension
 
-print([metal for metal, gene_list in gene_sets.items() if 5 in gene_list])
+if __name__ == '__main__':
+    print([metal for metal, gene_list in gene_sets.items() if 5 in gene_list])
+
+# SCALING UP: both versions look through every set for every gene asked about
+#   - gene_sets.InvertedIndex keeps gene -> conditions, the other way round
+#   - GeneSets(gene_sets).conditions_of(5) is one dict lookup, however many conditions there are
+#   - .batch_conditions_of([5, 6, 7]) answers many genes in one call
 
 # SETS have submethods
 #   - "issubset" will tell us hether one set is a subset of another
 
+set_one = gene_sets['lead']
+set_two = gene_sets['arsenic']
 set_one.issubset(set_two)
 
 
-for condition1, set1 in gene_sets.items():
-    for condition2, set2 in gene_sets.items():
-        if set1.issubset(set2) and condition1 != condition2:
-            print(condition1 + ' is a subset of ' + condition2)
+if __name__ == '__main__':
+    for condition1, set1 in gene_sets.items():
+        for condition2, set2 in gene_sets.items():
+            if set1.issubset(set2) and condition1 != condition2:
+                print(condition1 + ' is a subset of ' + condition2)
+
+# SCALING UP: this compares every pair of sets element by element
+#   - gene_sets.py stores every condition as a row of bits, one bit per gene
+#   - GeneSets(gene_sets)['lead'] still gives the set, .union/.intersection/.difference work on bits
+#   - .subset_matrix(), .jaccard_matrix(), .intersection_sizes() answer all pairs at once
+#   - the loop also prints relations that follow from others (A in B, B in C, so A in C)
+#     gene_lattice.subset_lattice(gene_sets) keeps only the direct ones, as a dict like new_tax_dict
+#     that walk_down() (a get_children for DAGs) can walk
 
 
 
@@ -257,13 +329,24 @@ records = {
 # We can use the .get() method
 
 my_record = records.get('XYZ456')
-print(my_record)
+if __name__ == '__main__':
+    print(my_record)
 
 # Can combine with tuple unpacking
 
 (my_sequence, my_code) = records.get('XYZ456')
-print(my_sequence, my_code)
-print(my_sequence)
+if __name__ == '__main__':
+    print(my_sequence, my_code)
+    print(my_sequence)
+
+# SCALING UP: all three forms of records keep several Python objects per record
+#   - record_table.py stores each field as one array (sequences, accessions, genetic codes)
+#   - RecordTable.from_dict(records).get('XYZ456') gives the same (sequence, code) tuple
+#   - table[table.genetic_code == 2] filters every record at once
+#   - about 36 bytes per record here, against about 300 for the list of dicts
+#   - too many records for RAM: accession_store.build_store('refs.store', records) writes them to
+#     one file, streamed in; AccessionStore('refs.store').get('XYZ456') memory-maps it, so opening
+#     is instant and processes share it; .get_many(accessions) looks up a whole batch
 
 
 # ---------- Dictionaries of lists ---------- #
@@ -282,7 +365,14 @@ for start in range(len(dna) - k+1):
     current_count = kmer2count.get(kmer,0)
     kmer2count[kmer] = current_count + 1
 
-print(kmer2count)
+if __name__ == '__main__':
+    print(kmer2count)
+
+# SCALING UP: a string slice and a dict lookup at every position is far too slow for a genome
+#   - kmer_count.py does the same counting on 2-bit codes, a whole chunk at a time
+#   - count_kmers(dna, 4).to_dict() gives the same dict (keys in upper case)
+#   - count_kmers_file('genome.fa', 21, canonical=True) streams a FASTA file
+#   - kmer_count_parallel.count_kmers_parallel(['a.fa', 'b.fa'], 21) spreads it over all cores
 
 
 # New method
@@ -298,15 +388,25 @@ for start in range(len(dna) - k + 1):
     list_of_positions = kmer2list.get(kmer, [])
     list_of_positions.append(start)
     kmer2list[kmer] = list_of_positions
-print(kmer2list)
+if __name__ == '__main__':
+    print(kmer2list)
 
 # Now we can use dict comprehension to get the counts
 
 counts = {kmer: len(start) for kmer, start in kmer2list.items()}
-print(counts)
+if __name__ == '__main__':
+    print(counts)
 
 # HOW IT WORKS
 # len(start) counts how long the list is
 # so len([0, 6, 12]) is 3
 # and 'aatt': 3 goes into a new dictionary called counts
 
+# SCALING UP: every position here is a separate Python int inside a growing list
+#   - kmer_index.py stores the same thing as three flat arrays that can be saved to disk
+#   - KmerIndex.build(dna, 4).to_dict() gives kmer2list, .counts() gives counts
+#   - KmerIndex.load(path) memory-maps a saved index, so it opens instantly
+#   - to compare many genomes, full k-mer dicts are too big: sketch.Sketches.from_files(paths)
+#     keeps 1000 hashes per genome (MinHash), .distance_matrix() gives all-vs-all Mash distances
+#     on a process pool, .save(path) / Sketches.load(path) keep the sketches for next time
+
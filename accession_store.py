@@ -0,0 +1,346 @@
+#----------------- Records on disk, looked up by accession ------------------------#
+
+# records = {'ABC123': ('actgctagt', 1), ...} and records.get('XYZ456') need every record in RAM
+#   - hundreds of millions of accessions do not fit, and every process would need its own copy
+# Here: the records go into one immutable file that is memory-mapped (arrayfile)
+#   - records are sorted by the 64-bit fingerprint of their accession (dedup.fingerprint)
+#   - a directory indexed by the top bits of the fingerprint gives the few rows to search,
+#     so a lookup touches a couple of pages and nothing is deserialised
+#   - the accession itself is stored too, so fingerprint collisions are told apart
+#   - processes that open the same file share its pages
+# Building streams the input: records are spread over temporary bucket files by fingerprint,
+# then each bucket is sorted in memory on its own and copied into the final file
+#   - memory is about one bucket's worth of records, whatever the total
+#   - an accession seen twice keeps its last record, as when filling a dict
+
+import os
+import shutil
+import tempfile
+
+import numpy as np
+
+from arrayfile import create_arrays, load_arrays
+from dedup import fingerprint, fingerprints
+from fasta import iter_records
+
+
+KIND = 'accession_store'
+DEFAULT_BATCH_SIZE = 1 << 16
+DEFAULT_BUCKETS = 64
+MAX_DIRECTORY_BITS = 24
+
+# what the first pass writes per record
+_ENTRY = np.dtype([('fingerprint', '<u8'), ('order', '<i8'), ('sequence_start', '<i8'), ('sequence_length', '<i8'),
+                   ('accession_start', '<i8'), ('accession_length', '<i4'), ('genetic_code', 'i1')])
+
+
+def _ranges(starts, lengths):
+    # indexes of buffer[starts[i]:starts[i] + lengths[i]] for every i, concatenated
+    total = int(lengths.sum())
+    ends = np.cumsum(lengths)
+    return np.arange(total, dtype=np.int64) + np.repeat(starts - (ends - lengths), lengths)
+
+
+def _gather_accessions(blob, starts, lengths, width):
+    # fixed-width bytes array of the accessions blob[starts[i]:starts[i] + lengths[i]]
+    table = np.zeros((len(starts), max(width, 1)), dtype=np.uint8)
+    rows = np.repeat(np.arange(len(starts)), lengths)
+    columns = np.arange(len(rows)) - np.repeat(np.cumsum(lengths) - lengths, lengths)
+    table[rows, columns] = blob[_ranges(starts, lengths)]
+    return table.view('S{}'.format(max(width, 1))).ravel()
+
+
+class _Partition:
+    # first pass: sequences and accessions appended to two files, one entry per record
+    # appended to the bucket file chosen by the top bits of its fingerprint
+
+    def __init__(self, directory, n_buckets):
+        self.directory = directory
+        self.shift = np.uint64(64 - (n_buckets - 1).bit_length())
+        self.n_buckets = n_buckets
+        self.sequences = open(os.path.join(directory, 'sequences'), 'wb')
+        self.accessions = open(os.path.join(directory, 'accessions'), 'wb')
+        self.buckets = [open(self.bucket_path(b), 'wb') for b in range(n_buckets)]
+        self.count = 0
+        self.sequence_bytes = 0
+        self.accession_bytes = 0
+
+    def bucket_path(self, b):
+        return os.path.join(self.directory, 'bucket{}'.format(b))
+
+    def add_batch(self, batch):
+        # batch: (sequence, accession, genetic_code) tuples
+        sequences = [s.encode() if isinstance(s, str) else s for s, _, _ in batch]
+        accessions = [a.encode() if isinstance(a, str) else a for _, a, _ in batch]
+        entries = np.zeros(len(batch), dtype=_ENTRY)
+        entries['fingerprint'] = fingerprints(accessions)
+        entries['order'] = np.arange(self.count, self.count + len(batch))
+        entries['sequence_length'] = [len(s) for s in sequences]
+        entries['sequence_start'] = self.sequence_bytes + np.cumsum(entries['sequence_length']) - entries['sequence_length']
+        entries['accession_length'] = [len(a) for a in accessions]
+        entries['accession_start'] = self.accession_bytes + np.cumsum(entries['accession_length']) - entries['accession_length']
+        entries['genetic_code'] = [code for _, _, code in batch]
+        self.sequences.write(b''.join(sequences))
+        self.accessions.write(b''.join(accessions))
+        self.count += len(batch)
+        self.sequence_bytes += int(entries['sequence_length'].sum())
+        self.accession_bytes += int(entries['accession_length'].sum())
+        bucket = (entries['fingerprint'] >> self.shift).astype(np.int64) if self.n_buckets > 1 else \
+            np.zeros(len(batch), dtype=np.int64)
+        order = np.argsort(bucket, kind='stable')
+        bounds = np.searchsorted(bucket[order], np.arange(self.n_buckets + 1))
+        for b in range(self.n_buckets):
+            if bounds[b] < bounds[b + 1]:
+                self.buckets[b].write(entries[order[bounds[b]:bounds[b + 1]]].tobytes())
+
+    def close(self):
+        for handle in [self.sequences, self.accessions] + self.buckets:
+            handle.close()
+
+
+def _sorted_bucket(path, accession_blob):
+    # the entries of one bucket sorted by fingerprint, the last record of each accession only
+    entries = np.fromfile(path, dtype=_ENTRY)
+    width = int(entries['accession_length'].max()) if len(entries) else 1
+    accessions = _gather_accessions(accession_blob, entries['accession_start'], entries['accession_length'], width)
+    order = np.lexsort((entries['order'], accessions, entries['fingerprint']))
+    entries, accessions = entries[order], accessions[order]
+    last = np.ones(len(entries), dtype=bool)
+    last[:-1] = (entries['fingerprint'][1:] != entries['fingerprint'][:-1]) | (accessions[1:] != accessions[:-1])
+    return entries[last]
+
+
+def build_store(path, records, batch_size=DEFAULT_BATCH_SIZE, n_buckets=DEFAULT_BUCKETS, temp_dir=None):
+    # records: an iterable of (sequence, accession, genetic_code), like the list of tuples
+    #   -> the number of records written
+    #   - temp_dir holds the temporary files (about the size of the input) while building
+    if n_buckets < 1 or n_buckets & (n_buckets - 1):
+        raise ValueError('n_buckets must be a power of two')
+    directory = tempfile.mkdtemp(dir=temp_dir)
+    try:
+        partition = _Partition(directory, n_buckets)
+        try:
+            batch = []
+            for record in records:
+                batch.append(record)
+                if len(batch) >= batch_size:
+                    partition.add_batch(batch)
+                    batch = []
+            if batch:
+                partition.add_batch(batch)
+        finally:
+            partition.close()
+
+        sequence_blob = np.memmap(os.path.join(directory, 'sequences'), dtype=np.uint8, mode='r') \
+            if partition.sequence_bytes else np.zeros(0, dtype=np.uint8)
+        accession_blob = np.memmap(os.path.join(directory, 'accessions'), dtype=np.uint8, mode='r') \
+            if partition.accession_bytes else np.zeros(0, dtype=np.uint8)
+
+        # second pass: sort and de-duplicate every bucket, to know the final sizes
+        count = sequence_bytes = 0
+        width = 1
+        for b in range(n_buckets):
+            entries = _sorted_bucket(partition.bucket_path(b), accession_blob)
+            entries.tofile(partition.bucket_path(b))
+            count += len(entries)
+            sequence_bytes += int(entries['sequence_length'].sum())
+            if len(entries):
+                width = max(width, int(entries['accession_length'].max()))
+
+        # about 8 records per directory slot
+        bits = min(MAX_DIRECTORY_BITS, max(1, (count // 8).bit_length()))
+        arrays = create_arrays(path, [
+            ('fingerprints', '<u8', (count,)),
+            ('directory', '<i8', (2 ** bits + 1,)),
+            ('accessions', 'S{}'.format(width), (count,)),
+            ('offsets', '<i8', (count + 1,)),
+            ('sequences', np.uint8, (sequence_bytes,)),
+            ('genetic_code', np.int8, (count,)),
+        ], {'kind': KIND, 'directory_bits': bits})
+
+        # third pass: copy the buckets in order, they are already sorted among themselves
+        row = position = 0
+        slot_counts = np.zeros(2 ** bits, dtype=np.int64)
+        for b in range(n_buckets):
+            entries = np.fromfile(partition.bucket_path(b), dtype=_ENTRY)
+            end = row + len(entries)
+            arrays['fingerprints'][row:end] = entries['fingerprint']
+            arrays['accessions'][row:end] = _gather_accessions(
+                accession_blob, entries['accession_start'], entries['accession_length'], width)
+            lengths = entries['sequence_length']
+            arrays['offsets'][row + 1:end + 1] = position + np.cumsum(lengths)
+            arrays['sequences'][position:position + int(lengths.sum())] = \
+                sequence_blob[_ranges(entries['sequence_start'], lengths)]
+            arrays['genetic_code'][row:end] = entries['genetic_code']
+            slot_counts += np.bincount((entries['fingerprint'] >> np.uint64(64 - bits)).astype(np.int64),
+                                       minlength=2 ** bits)
+            row = end
+            position += int(lengths.sum())
+        arrays['directory'][1:] = np.cumsum(slot_counts)
+        arrays['directory'].flush()  # all the arrays share one memory map
+        del arrays, sequence_blob, accession_blob
+        return count
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+
+class AccessionStore:
+
+    def __init__(self, path, mmap=True):
+        arrays, meta = load_arrays(path, mmap)
+        if meta.get('kind') != KIND:
+            raise ValueError(str(path) + ' is not an accession store')
+        # plain ndarray views of the same pages: slicing an np.memmap is slower for single lookups
+        arrays = {name: array.view(np.ndarray) for name, array in arrays.items()}
+        self.path = path
+        self.fingerprints = arrays['fingerprints']
+        self.directory = arrays['directory']
+        self.accessions = arrays['accessions']
+        self.offsets = arrays['offsets']
+        self.sequences = arrays['sequences']
+        self.genetic_code = arrays['genetic_code']
+        self._shift = 64 - meta['directory_bits']
+
+    # ---Building
+
+    @classmethod
+    def build(cls, path, records, **kwargs):
+        # (sequence, accession, genetic_code) records -> a new store at path, opened
+        build_store(path, records, **kwargs)
+        return cls(path)
+
+    @classmethod
+    def build_from_dict(cls, path, records, **kwargs):
+        # {accession: (sequence, genetic_code)}, like the dict of tuples
+        return cls.build(path, ((sequence, accession, code) for accession, (sequence, code) in records.items()), **kwargs)
+
+    @classmethod
+    def build_from_fasta(cls, path, source, genetic_code=1, **kwargs):
+        # one record per FASTA record, the accession is the header up to the first space
+        return cls.build(path, ((sequence, (header.split() or [''])[0], genetic_code)
+                                for header, sequence in iter_records(source)), **kwargs)
+
+    # ---Lookups by accession
+
+    def __len__(self):
+        return len(self.genetic_code)
+
+    def row(self, accession):
+        # row number of one accession, -1 if it is not in the store
+        key = accession.encode() if isinstance(accession, str) else accession
+        value = fingerprint(key)
+        slot = value >> self._shift
+        low, high = int(self.directory[slot]), int(self.directory[slot + 1])
+        row = low + int(np.searchsorted(self.fingerprints[low:high], np.uint64(value)))
+        while row < high and int(self.fingerprints[row]) == value:
+            if self.accessions[row] == key:
+                return row
+            row += 1
+        return -1
+
+    def rows(self, accessions):
+        # row number of every accession, -1 where it is not in the store
+        if isinstance(accessions, np.ndarray) and accessions.dtype.kind == 'S':
+            keys = accessions
+        else:
+            keys = np.array([a.encode() if isinstance(a, str) else a for a in accessions], dtype=bytes)
+        prints = fingerprints(keys)
+        slots = (prints >> np.uint64(self._shift)).astype(np.int64)
+        low, high = self.directory[slots], self.directory[slots + 1]
+        # binary search inside every slot at once: low ends on the first fingerprint >= the key's
+        active = np.flatnonzero(low < high)
+        while len(active):
+            middle = (low[active] + high[active]) // 2
+            less = self.fingerprints[middle] < prints[active]
+            low[active] = np.where(less, middle + 1, low[active])
+            high[active] = np.where(less, high[active], middle)
+            active = active[low[active] < high[active]]
+        # then step over rows with the same fingerprint until the accession matches (collisions are rare)
+        found = np.full(len(keys), -1, dtype=np.int64)
+        row = low
+        active = np.flatnonzero(row < len(self.fingerprints))
+        while len(active):
+            same = self.fingerprints[row[active]] == prints[active]
+            active = active[same]
+            match = self.accessions[row[active]] == keys[active]
+            found[active[match]] = row[active[match]]
+            active = active[~match]
+            row[active] += 1
+            active = active[row[active] < len(self.fingerprints)]
+        return found
+
+    def sequence(self, row):
+        return self.sequences[self.offsets[row]:self.offsets[row + 1]].tobytes().decode()
+
+    def get(self, accession, default=None):
+        # (sequence, genetic_code), like records.get() on the dict of tuples
+        row = self.row(accession)
+        if row < 0:
+            return default
+        return self.sequence(row), int(self.genetic_code[row])
+
+    def get_many(self, accessions, default=None):
+        # [records.get(accession, default) for accession in accessions], looked up as one batch
+        rows = self.rows(accessions)
+        codes = np.zeros(len(rows), dtype=np.int8)
+        codes[rows >= 0] = self.genetic_code[rows[rows >= 0]]
+        return [(self.sequence(row), code) if row >= 0 else default for row, code in zip(rows.tolist(), codes.tolist())]
+
+    def __getitem__(self, accession):
+        row = self.row(accession)
+        if row < 0:
+            raise KeyError(accession)
+        return self.sequence(row), int(self.genetic_code[row])
+
+    def __contains__(self, accession):
+        return self.row(accession) >= 0
+
+    def __iter__(self):
+        # the accessions, in fingerprint order
+        for accession in self.accessions:
+            yield accession.decode()
+
+
+if __name__ == '__main__':
+    import sys
+    import time
+
+    directory = tempfile.mkdtemp()
+    records = {
+        'ABC123': ('actgctagt', 1),
+        'XYZ456': ('ttaggttta', 2),
+        'PQR789': ('atgctactg', 3)
+    }
+    store = AccessionStore.build_from_dict(os.path.join(directory, 'small.store'), records)
+    print(store.get('XYZ456'), store.get('nope'), store.get_many(['PQR789', 'nope', 'ABC123']))
+
+    # A few million records streamed from a generator
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 2_000_000
+    rng = np.random.default_rng(0)
+    bases = np.frombuffer(b'acgt', dtype=np.uint8)[rng.integers(0, 4, 50 * 1000)].tobytes().decode()
+
+    def stream():
+        for i in range(n):
+            start = (i * 7919) % (len(bases) - 50)
+            yield bases[start:start + 20 + i % 31], 'ACC%09d' % i, i % 25 + 1
+
+    path = os.path.join(directory, 'big.store')
+    start = time.perf_counter()
+    count = build_store(path, stream())
+    elapsed = time.perf_counter() - start
+    print('built {} records in {:.1f}s ({:.0f} records/s), {:.0f} bytes/record on disk'.format(
+        count, elapsed, count / elapsed, os.path.getsize(path) / count))
+
+    start = time.perf_counter()
+    store = AccessionStore(path)
+    print('opened in {:.2f} ms'.format((time.perf_counter() - start) * 1e3))
+    queries = ['ACC%09d' % i for i in rng.integers(0, 2 * n, 100_000).tolist()]  # half of them missing
+    start = time.perf_counter()
+    singles = [store.get(query) for query in queries[:20_000]]
+    print('get: {:.1f} us each'.format((time.perf_counter() - start) / 20_000 * 1e6))
+    start = time.perf_counter()
+    batch = store.get_many(queries)
+    print('get_many: {:.2f} us each'.format((time.perf_counter() - start) / len(queries) * 1e6))
+    assert batch[:20_000] == singles
+    print(sum(record is not None for record in batch), 'of', len(queries), 'found')
+    shutil.rmtree(directory)
@@ -0,0 +1,277 @@
+#----------------- Alignments as 2-D arrays ------------------------#
+
+# aln as a list of lists keeps every base as its own Python string
+#   - [pos[0] for pos in aln] is a Python loop for every column
+#   - 10k sequences x 100k columns would be a billion string references
+# Here: the alignment is one 2-D uint8 array, one row per sequence, one byte per base
+#   - aln[i] (a row) and aln.column(j) are views into that array, nothing is copied
+#   - consensus, gap fraction, base frequencies and conservation work on blocks of
+#     columns at once
+#   - big FASTA/PHYLIP alignments can be written straight into a file on disk
+#     and memory-mapped, so they never have to fit in RAM
+
+import os
+
+import numpy as np
+
+from arrayfile import create_arrays, load_arrays, save_arrays
+from fasta import iter_records, open_source
+
+
+SYMBOLS = 'ACGT-'
+GAP = 4  # index of '-' in SYMBOLS
+OTHER = 5  # N, IUPAC codes, anything else
+_BLOCK_BYTES = 1 << 24  # how much of the matrix a column operation looks at in one go
+
+# byte -> symbol index, upper and lower case, '.' counts as a gap
+SYMBOL_LUT = np.full(256, OTHER, dtype=np.uint8)
+for _i, _symbol in enumerate(SYMBOLS):
+    SYMBOL_LUT[ord(_symbol)] = _i
+    SYMBOL_LUT[ord(_symbol.lower())] = _i
+SYMBOL_LUT[ord('.')] = GAP
+
+
+def _iter_fasta(handle):
+    # (name, sequence bytes) for every record, the name is the header up to the first space
+    for header, sequence in iter_records(handle):
+        yield (header.split() or [''])[0], sequence
+
+
+def _rewind(source, handle, should_close):
+    # a second pass over the same input: reopen a path, seek back in a file object
+    if should_close:
+        handle.close()
+        return open_source(source)
+    if not handle.seekable():
+        raise ValueError('writing an alignment to disk reads the input twice, it must be a path or seekable')
+    handle.seek(0)
+    return handle, False
+
+
+class Alignment:
+
+    def __init__(self, matrix, names=None):
+        # matrix: 2-D uint8 array of ASCII bases, one row per sequence
+        self.matrix = matrix
+        self.names = list(names) if names is not None else ['seq' + str(i + 1) for i in range(len(matrix))]
+        if len(self.names) != len(matrix):
+            raise ValueError('need exactly one name per row')
+
+    # ---Building
+
+    @classmethod
+    def from_rows(cls, rows, names=None):
+        # list of lists of characters (like aln), or list of strings
+        rows = [''.join(row) if not isinstance(row, (str, bytes)) else row for row in rows]
+        rows = [row.encode() if isinstance(row, str) else row for row in rows]
+        if len(set(map(len, rows))) > 1:
+            raise ValueError('all rows of an alignment must have the same length')
+        width = len(rows[0]) if rows else 0
+        matrix = np.frombuffer(b''.join(rows), dtype=np.uint8).reshape(len(rows), width).copy()
+        return cls(matrix, names)
+
+    @classmethod
+    def from_fasta(cls, source, path=None):
+        # Aligned FASTA -> Alignment
+        #   - path=None builds the matrix in memory
+        #   - with a path, a first pass finds the shape, then rows are written one at a time
+        #     into a memory-mapped file at path, which load() can open again later
+        handle, should_close = open_source(source)
+        try:
+            if path is None:
+                names, rows = [], []
+                for name, sequence in _iter_fasta(handle):
+                    names.append(name)
+                    rows.append(sequence)
+                return cls.from_rows(rows, names)
+
+            names = []
+            width = None
+            for name, sequence in _iter_fasta(handle):
+                if width is not None and len(sequence) != width:
+                    raise ValueError('sequence ' + name + ' has a different length from the first one')
+                names.append(name)
+                width = len(sequence)
+            handle, should_close = _rewind(source, handle, should_close)
+            matrix = _create(path, names, width or 0)
+            for i, (name, sequence) in enumerate(_iter_fasta(handle)):
+                matrix[i] = np.frombuffer(sequence, dtype=np.uint8)
+            matrix.flush()
+        finally:
+            if should_close:
+                handle.close()
+        return cls.load(path)
+
+    @classmethod
+    def from_phylip(cls, source, path=None):
+        # Relaxed PHYLIP, sequential (one line per sequence) or interleaved
+        #   - first line: number of sequences and number of columns
+        #   - the first block has 'name sequence...' lines, later blocks only sequence
+        #   - the shape is known from the first line, so with a path the rows go
+        #     straight into a memory-mapped file in a single pass
+        handle, should_close = open_source(source)
+        try:
+            lines = (line.strip() for line in handle)
+            lines = (line for line in lines if line)
+            n_rows, width = map(int, next(lines).split()[:2])
+            names = []
+            first_block = []
+            for _ in range(n_rows):
+                fields = next(lines).split()
+                names.append(fields[0].decode())
+                first_block.append(b''.join(fields[1:]))
+            matrix = np.zeros((n_rows, width), dtype=np.uint8) if path is None else _create(path, names, width)
+            filled = np.zeros(n_rows, dtype=np.int64)
+            for i, piece in enumerate(first_block):
+                matrix[i, :len(piece)] = np.frombuffer(piece, dtype=np.uint8)
+                filled[i] = len(piece)
+            i = 0
+            for line in lines:
+                piece = b''.join(line.split())
+                matrix[i, filled[i]:filled[i] + len(piece)] = np.frombuffer(piece, dtype=np.uint8)
+                filled[i] += len(piece)
+                i = (i + 1) % n_rows
+            if np.any(filled != width):
+                raise ValueError('PHYLIP rows do not match the {} columns in the header'.format(width))
+        finally:
+            if should_close:
+                handle.close()
+        if path is None:
+            return cls(matrix, names)
+        matrix.flush()
+        return cls.load(path)
+
+    # ---Saving and loading
+
+    def save(self, path):
+        save_arrays(path, {'matrix': self.matrix, 'names': _name_blob(self.names)}, {'kind': 'alignment'})
+
+    @classmethod
+    def load(cls, path, mmap=True):
+        # memory-mapped by default, rows and columns are read from disk as they are used
+        arrays, meta = load_arrays(path, mmap)
+        if meta.get('kind') != 'alignment':
+            raise ValueError(str(path) + ' is not a saved alignment')
+        matrix = arrays['matrix']
+        text = arrays['names'].tobytes().decode()
+        return cls(matrix, text.split('\n') if len(matrix) else [])
+
+    # ---Rows and columns (views, not copies)
+
+    def __len__(self):
+        return self.matrix.shape[0]
+
+    @property
+    def width(self):
+        return self.matrix.shape[1]
+
+    def __getitem__(self, index):
+        # aln[i] is row i, aln[i, j] / aln[:, j] / aln[:, start:stop] index the matrix
+        return self.matrix[index]
+
+    def row(self, i):
+        return self.matrix[i]
+
+    def column(self, j):
+        return self.matrix[:, j]
+
+    def columns(self, start, stop):
+        return self.matrix[:, start:stop]
+
+    def sequence(self, i):
+        return self.matrix[i].tobytes().decode()
+
+    # ---Column statistics
+
+    def _blocks(self):
+        # (start, stop) column ranges of about _BLOCK_BYTES each
+        step = max(1, _BLOCK_BYTES // max(1, len(self)))
+        for start in range(0, self.width, step):
+            yield start, min(start + step, self.width)
+
+    def symbol_counts(self):
+        # (width, 6) array: how many A, C, G, T, gaps and other characters each column has
+        counts = np.zeros((self.width, len(SYMBOLS) + 1), dtype=np.int64)
+        for start, stop in self._blocks():
+            codes = SYMBOL_LUT[self.matrix[:, start:stop]].astype(np.int64)
+            # one bincount for the whole block: slot = column * 6 + symbol
+            slots = codes + (np.arange(stop - start) * (len(SYMBOLS) + 1))
+            counts[start:stop] = np.bincount(slots.ravel(), minlength=(stop - start) * (len(SYMBOLS) + 1)).reshape(-1, len(SYMBOLS) + 1)
+        return counts
+
+    def gap_fraction(self, counts=None):
+        counts = self.symbol_counts() if counts is None else counts
+        return counts[:, GAP] / max(1, len(self))
+
+    def base_frequencies(self, counts=None):
+        # (width, 4) frequencies of A, C, G, T among the bases in each column (gaps and N left out)
+        counts = self.symbol_counts() if counts is None else counts
+        bases = counts[:, :GAP]
+        totals = bases.sum(axis=1, keepdims=True)
+        return bases / np.maximum(totals, 1)
+
+    def consensus(self, counts=None):
+        # most common base of each column, '-' where a column has no bases at all
+        counts = self.symbol_counts() if counts is None else counts
+        best = counts[:, :GAP].argmax(axis=1)
+        best[counts[:, :GAP].sum(axis=1) == 0] = GAP
+        return np.frombuffer(SYMBOLS.encode(), dtype=np.uint8)[best].tobytes().decode()
+
+    def conservation(self, counts=None):
+        # 1 - entropy / 2 bits of the base frequencies, scaled down by the gap fraction
+        #   - 1.0 for a column of one base and no gaps, 0.0 for an even mix (or all gaps)
+        counts = self.symbol_counts() if counts is None else counts
+        frequencies = self.base_frequencies(counts)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            entropy = -np.where(frequencies > 0, frequencies * np.log2(frequencies), 0).sum(axis=1)
+        has_bases = counts[:, :GAP].sum(axis=1) > 0
+        return np.where(has_bases, 1 - entropy / 2, 0) * (1 - self.gap_fraction(counts))
+
+
+def _name_blob(names):
+    # one blob of text, one name per line
+    return np.frombuffer('\n'.join(names).encode(), dtype=np.uint8)
+
+
+def _create(path, names, width):
+    # an empty alignment file of the right shape, returns the writable matrix
+    blob = _name_blob(names)
+    arrays = create_arrays(path, [('matrix', np.uint8, (len(names), width)), ('names', np.uint8, blob.shape)],
+                           {'kind': 'alignment'})
+    arrays['names'][:] = blob
+    return arrays['matrix']
+
+
+if __name__ == '__main__':
+    import sys
+    import tempfile
+    import time
+
+    # The lesson's example
+    aln = Alignment.from_rows([['A', 'T', '-', 'G', 'T'],
+                               ['G', 'C', 'T', 'A', 'C'],
+                               ['A', 'C', 'G', 'T', 'T']])
+    print(aln.sequence(2), aln.column(0).tobytes().decode(), aln.consensus())
+    print(aln.gap_fraction(), aln.conservation())
+
+    # A big random alignment, written as FASTA then loaded through a memory-mapped file
+    n_rows = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+    width = int(sys.argv[2]) if len(sys.argv) > 2 else 20_000
+    rng = np.random.default_rng(0)
+    directory = tempfile.mkdtemp()
+    fasta_path = os.path.join(directory, 'aln.fa')
+    reference = rng.integers(0, 4, width)
+    with open(fasta_path, 'wb') as handle:
+        for i in range(n_rows):
+            row = np.where(rng.random(width) < 0.1, rng.integers(0, 5, width), reference)
+            handle.write(b'>seq%d\n' % i + np.frombuffer(b'ACGT-', dtype=np.uint8)[row].tobytes() + b'\n')
+
+    start = time.perf_counter()
+    big = Alignment.from_fasta(fasta_path, os.path.join(directory, 'aln.bin'))
+    print('loaded {} x {} in {:.2f}s'.format(len(big), big.width, time.perf_counter() - start))
+    start = time.perf_counter()
+    counts = big.symbol_counts()
+    consensus = big.consensus(counts)
+    print('column statistics in {:.2f}s, consensus matches reference: {}'.format(
+        time.perf_counter() - start,
+        consensus == np.frombuffer(b'ACGT', dtype=np.uint8)[reference].tobytes().decode()))
@@ -0,0 +1,133 @@
+#----------------- Cached ancestor paths ------------------------#
+
+# get_ancestors / get_ancestors_rec walk all the way to the root for every query
+#   - read classification asks about the same few thousand taxa over and over
+#   - the recursive version also hits Python's recursion limit on deep lineages
+# Here: the path to the root is remembered per taxon
+#   - a path is a chain of (taxon, path of the parent) cells, so all the taxa under
+#     one parent share the rest of the path instead of copying it
+#   - the number of remembered taxa is bounded, least recently used goes first
+#   - everything is a loop, so any depth works
+
+from collections import OrderedDict, namedtuple
+
+
+CacheInfo = namedtuple('CacheInfo', ['hits', 'misses', 'evictions', 'maxsize', 'currsize'])
+
+
+class AncestorPath:
+    # taxon, then the path of its parent (None at the root)
+    __slots__ = ('taxon', 'parent', 'length')
+
+    def __init__(self, taxon, parent):
+        self.taxon = taxon
+        self.parent = parent
+        self.length = 1 if parent is None else parent.length + 1
+
+    def __iter__(self):
+        path = self
+        while path is not None:
+            yield path.taxon
+            path = path.parent
+
+    def __len__(self):
+        return self.length
+
+    def __repr__(self):
+        return 'AncestorPath(' + repr(list(self)) + ')'
+
+
+class AncestorCache:
+
+    def __init__(self, tax_dict, maxsize=100_000):
+        # tax_dict: child -> parent mapping (a dict, or Taxonomy.child_to_parent())
+        #   - a taxon without a parent, or that is its own parent, is a root
+        self.tax_dict = tax_dict
+        self.maxsize = maxsize
+        self._paths = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def path(self, taxon):
+        paths = self._paths
+        path = paths.get(taxon)
+        if path is not None:
+            paths.move_to_end(taxon)
+            self.hits += 1
+            return path
+        self.misses += 1
+
+        # walk up until a remembered taxon (or the root) turns up
+        missing = []
+        current = taxon
+        limit = len(self.tax_dict) + 1
+        while path is None:
+            missing.append(current)
+            if len(missing) > limit:
+                raise ValueError('the parent links above ' + repr(taxon) + ' contain a cycle')
+            parent = self.tax_dict.get(current)
+            if parent is None or parent == current:
+                break
+            current = parent
+            path = paths.get(current)
+            if path is not None:
+                paths.move_to_end(current)
+
+        # then build the missing paths top-down, each on top of its parent's
+        for current in reversed(missing):
+            path = AncestorPath(current, path)
+            self._remember(current, path)
+        return path
+
+    def _remember(self, taxon, path):
+        self._paths[taxon] = path
+        if len(self._paths) > self.maxsize:
+            self._paths.popitem(last=False)
+            self.evictions += 1
+
+    def get_ancestors(self, taxon):
+        # same as get_ancestors: [taxon, parent, ..., root]
+        return list(self.path(taxon))
+
+    def get_parents(self, taxon):
+        # same as the recursive version: everything above the taxon
+        return list(self.path(taxon))[1:]
+
+    def cache_info(self):
+        return CacheInfo(self.hits, self.misses, self.evictions, self.maxsize, len(self._paths))
+
+    def cache_clear(self):
+        self._paths.clear()
+        self.hits = self.misses = self.evictions = 0
+
+
+if __name__ == '__main__':
+
+    tax_dict = {
+        'Pongo abelii': 'Hominidae',
+        'Pan troglodytes': 'Hominidae',
+        'Hominidae': 'Simiiformes',
+        'Simiiformes': 'Haplorhini',
+        'Tarsius tarsier': 'Tarsiiformes',
+        'Tarsiiformes': 'Haplorhini',
+        'Haplorhini': 'Primates',
+        'Loris tardigradus': 'Lorisidae',
+        'Lorisidae': 'Strepsirrhini',
+        'Allocebus trichotis': 'Lemuriformes',
+        'Lemuriformes': 'Strepsirrhini',
+        'Strepsirrhini': 'Primates',
+        'Galago allenii': 'Lorisiformes',
+        'Galago moholi': 'Lorisiformes',
+        'Lorisiformes': 'Strepsirrhini'
+    }
+
+    cache = AncestorCache(tax_dict, maxsize=8)
+    print(cache.get_ancestors('Pongo abelii'))
+    print(cache.get_ancestors('Pan troglodytes'))  # reuses the Hominidae path
+    print(cache.get_ancestors('Pongo abelii'))
+    print(cache.cache_info())
+
+    # a lineage 100000 levels deep, far past the recursion limit
+    deep = {i: i - 1 for i in range(1, 100_000)}
+    print(len(AncestorCache(deep).get_ancestors(99_999)))
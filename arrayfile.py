@@ -0,0 +1,89 @@
+#----------------- Arrays on disk ------------------------#
+
+# A handful of named NumPy arrays in one file, plus a small JSON header
+#   - every array starts on a 64-byte boundary
+#   - loading memory-maps the file, so nothing is read until it is touched
+#     and processes that open the same file share the pages
+
+import json
+
+import numpy as np
+
+
+MAGIC = b'ADVBIOA1'
+ALIGNMENT = 64
+
+
+def _aligned(offset):
+    return (offset + ALIGNMENT - 1) // ALIGNMENT * ALIGNMENT
+
+
+def _layout(specs, meta):
+    # specs: (name, dtype, shape) -> (header bytes, entries, start of the data, total size)
+    entries = []
+    offset = 0
+    for name, dtype, shape in specs:
+        dtype = np.dtype(dtype)
+        entries.append({'name': name, 'dtype': dtype.str, 'shape': list(shape), 'offset': offset})
+        offset = _aligned(offset + int(np.prod(shape, dtype=np.int64)) * dtype.itemsize)
+    header = json.dumps({'meta': meta or {}, 'arrays': entries}).encode()
+    data_start = _aligned(len(MAGIC) + 8 + len(header))
+    return header, entries, data_start, data_start + offset
+
+
+def _write_header(handle, header):
+    handle.write(MAGIC)
+    handle.write(len(header).to_bytes(8, 'little'))
+    handle.write(header)
+
+
+def save_arrays(path, arrays, meta=None):
+    arrays = {name: np.ascontiguousarray(array) for name, array in arrays.items()}
+    header, entries, data_start, end = _layout(
+        [(name, array.dtype, array.shape) for name, array in arrays.items()], meta)
+    with open(path, 'wb') as handle:
+        _write_header(handle, header)
+        for entry, array in zip(entries, arrays.values()):
+            handle.seek(data_start + entry['offset'])
+            handle.write(array.tobytes())
+        # make sure the file covers the padding after the last array
+        handle.truncate(end)
+
+
+def create_arrays(path, specs, meta=None):
+    # Like save_arrays, but for arrays too big to build in memory first
+    #   - specs: (name, dtype, shape) triples
+    #   - returns a dict of writable memory-mapped arrays (zeros) to fill in place
+    header, entries, data_start, end = _layout(specs, meta)
+    with open(path, 'wb') as handle:
+        _write_header(handle, header)
+        handle.truncate(end)
+    buffer = np.memmap(path, dtype=np.uint8, mode='r+')
+    return _views(buffer, entries, data_start)
+
+
+def _views(buffer, entries, data_start):
+    arrays = {}
+    for entry in entries:
+        dtype = np.dtype(entry['dtype'])
+        shape = tuple(entry['shape'])
+        start = data_start + entry['offset']
+        nbytes = int(np.prod(shape, dtype=np.int64)) * dtype.itemsize
+        arrays[entry['name']] = buffer[start:start + nbytes].view(dtype).reshape(shape)
+    return arrays
+
+
+def load_arrays(path, mmap=True):
+    # Returns (dict of arrays, meta)
+    #   - mmap=False reads everything into memory instead
+    with open(path, 'rb') as handle:
+        if handle.read(len(MAGIC)) != MAGIC:
+            raise ValueError(str(path) + ' is not an array file')
+        header_length = int.from_bytes(handle.read(8), 'little')
+        header = json.loads(handle.read(header_length))
+    data_start = _aligned(len(MAGIC) + 8 + header_length)
+    if mmap:
+        buffer = np.memmap(path, dtype=np.uint8, mode='r')
+    else:
+        buffer = np.fromfile(path, dtype=np.uint8)
+    return _views(buffer, header['arrays'], data_start), header['meta']
@@ -0,0 +1,446 @@
+#----------------- Benchmarks for the lesson routines ------------------------#
+
+# The lessons have iterative and recursive versions side by side
+#   - generate_kmers / generate_kmers_rec
+#   - get_ancestors / get_ancestors_rec, get_children / get_children_rec
+#   - get_lca_list / get_lca_rec / get_lca_rec_pop
+# Here: each one is timed (best of a few runs) and its peak memory measured
+# (tracemalloc, on a separate run) across growing inputs
+#   - inputs are synthetic and seeded, so two runs see exactly the same data:
+#     taxonomies with a given node count, depth and fan-out, random DNA, accession lists
+#   - the lesson functions are taken from 1_Recursion_and_Trees.py itself (only the
+#     def blocks are compiled, not the demo code around them), with print silenced
+#   - the scaled-up modules (ancestor_cache, lca, kmer_count, dedup) run on the same inputs
+#   - a recursive version that runs out of stack is recorded as an error, not a crash
+# Results are saved as JSON; compare() lines two runs up and flags what got slower or bigger
+#
+#   python benchmarks.py run results.json [--quick]
+#   python benchmarks.py compare old.json new.json [threshold]
+#   python benchmarks.py startup      (import time of the library modules against their budget)
+
+import ast
+import json
+import os
+import platform
+import py_compile
+import random
+import subprocess
+import sys
+import time
+import tracemalloc
+
+import numpy as np
+
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+LESSON_FILE = os.path.join(HERE, '1_Recursion_and_Trees.py')
+LESSON_FUNCTIONS = ('generate_kmers', 'generate_kmers_rec',
+                    'get_ancestors', 'get_ancestors_rec', 'get_children', 'get_children_rec',
+                    'get_lca', 'get_lca_list', 'get_lca_rec', 'get_lca_rec_pop')
+ROOT = 'Primates'  # the lesson functions stop at this name
+
+
+# ---------- Synthetic data ---------- #
+
+def synthetic_taxonomy(n_nodes, depth, fanout, seed=0):
+    # a random tree rooted at 'Primates' -> (tax_dict child -> parent, new_tax_dict parent -> children)
+    #   - exactly n_nodes taxa, the deepest exactly depth levels below the root
+    #   - no taxon has more than fanout children
+    if n_nodes < depth + 1:
+        raise ValueError('a tree {} levels deep needs at least {} nodes'.format(depth, depth + 1))
+    if fanout < 1:
+        raise ValueError('fanout must be at least 1')
+    rng = random.Random(seed)
+    names = [ROOT] + ['taxon{}'.format(i) for i in range(1, n_nodes)]
+    level = [0] * n_nodes
+    tax_dict = {}
+    new_tax_dict = {}
+
+    def attach(child, parent):
+        tax_dict[names[child]] = names[parent]
+        new_tax_dict.setdefault(names[parent], []).append(names[child])
+        level[child] = level[parent] + 1
+
+    # a spine first, so the tree is as deep as asked
+    for node in range(1, depth + 1):
+        attach(node, node - 1)
+    # the rest hang off random nodes that still have room (not too deep, not too many children)
+    open_nodes = [node for node in range(depth + 1) if level[node] < depth and
+                  len(new_tax_dict.get(names[node], [])) < fanout]
+    for node in range(depth + 1, n_nodes):
+        if not open_nodes:
+            raise ValueError('{} nodes do not fit in depth {} with fan-out {}'.format(n_nodes, depth, fanout))
+        i = rng.randrange(len(open_nodes))
+        parent = open_nodes[i]
+        attach(node, parent)
+        if len(new_tax_dict[names[parent]]) >= fanout:
+            open_nodes[i] = open_nodes[-1]
+            open_nodes.pop()
+        if level[node] < depth:
+            open_nodes.append(node)
+    return tax_dict, new_tax_dict
+
+
+def random_dna(length, seed=0):
+    rng = np.random.default_rng(seed)
+    return np.frombuffer(b'ACGT', dtype=np.uint8)[rng.integers(0, 4, length)].tobytes().decode()
+
+
+def random_accessions(n, duplicate_fraction=0.2, seed=0):
+    # accessions like 'ABC123456', about duplicate_fraction of them repeats of earlier ones
+    rng = np.random.default_rng(seed)
+    n_distinct = max(1, int(round(n * (1 - duplicate_fraction))))
+    letters = rng.integers(ord('A'), ord('Z') + 1, (n_distinct, 3), dtype=np.uint8)
+    digits = rng.integers(ord('0'), ord('9') + 1, (n_distinct, 6), dtype=np.uint8)
+    distinct = np.hstack((letters, digits)).view('S9').ravel()
+    picks = np.concatenate((np.arange(n_distinct), rng.integers(0, n_distinct, n - n_distinct)))
+    rng.shuffle(picks)
+    return [accession.decode() for accession in distinct[picks].tolist()]
+
+
+# ---------- The lesson functions ---------- #
+
+def load_lesson_functions(path=LESSON_FILE):
+    # the lesson functions, without running the script they sit in
+    #   - the first definition of each name is used (later ones are the print-debugging versions)
+    #   - they read the globals tax_dict / new_tax_dict: set those in the returned namespace
+    with open(path) as handle:
+        source = handle.read()
+    # the script may not parse as a whole (unfinished exercises), so take the defs one by one
+    lines = source.splitlines(keepends=True)
+    chosen = {}
+    for start, line in enumerate(lines):
+        if not line.startswith('def '):
+            continue
+        name = line[4:].split('(')[0].strip()
+        if name not in LESSON_FUNCTIONS or name in chosen:
+            continue
+        end = start + 1
+        while end < len(lines) and (not lines[end].strip() or lines[end][0] in ' \t#'):
+            end += 1
+        try:
+            chosen[name] = ast.parse(''.join(lines[start:end])).body[0]
+        except SyntaxError:
+            continue
+    namespace = {'print': lambda *args, **kwargs: None, 'tax_dict': {}, 'new_tax_dict': {}}
+    module = ast.Module(body=[chosen[name] for name in LESSON_FUNCTIONS if name in chosen], type_ignores=[])
+    exec(compile(module, path, 'exec'), namespace)
+    return namespace
+
+
+# ---------- Measuring ---------- #
+
+def measure(run, repeat=3):
+    # run: a function of no arguments -> {'seconds': best time, 'peak_bytes': ..., 'error': ...}
+    result = {'seconds': None, 'peak_bytes': None, 'error': None}
+    try:
+        times = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            run()
+            times.append(time.perf_counter() - start)
+        result['seconds'] = min(times)
+        tracemalloc.start()
+        try:
+            run()
+            result['peak_bytes'] = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+    except (RecursionError, MemoryError) as error:
+        result['error'] = type(error).__name__
+    return result
+
+
+def _sample(items, n, seed):
+    rng = random.Random(seed)
+    return [rng.choice(items) for _ in range(n)]
+
+
+def _taxonomy_cases(lesson, seed):
+    # routine -> (size name, prepare(size) -> function of no arguments)
+    from ancestor_cache import AncestorCache
+    from lca import LcaIndex
+
+    def ancestor_input(depth):
+        # a tree about as bushy as it is deep, queries on random taxa
+        tax_dict, new_tax_dict = synthetic_taxonomy(20 * depth, depth, 4, seed)
+        lesson['tax_dict'], lesson['new_tax_dict'] = tax_dict, new_tax_dict
+        return tax_dict, _sample(list(tax_dict), 200, seed)
+
+    def ancestors(depth):
+        _, queries = ancestor_input(depth)
+        get_ancestors = lesson['get_ancestors']
+        return lambda: [get_ancestors(taxon) for taxon in queries]
+
+    def ancestors_rec(depth):
+        _, queries = ancestor_input(depth)
+        get_ancestors_rec = lesson['get_ancestors_rec']
+        return lambda: [get_ancestors_rec(taxon) for taxon in queries]
+
+    def ancestors_cached(depth):
+        tax_dict, queries = ancestor_input(depth)
+
+        def run():
+            # a fresh cache every run, so the first walks to the root are counted too
+            cache = AncestorCache(tax_dict)
+            return [cache.get_ancestors(taxon) for taxon in queries]
+        return run
+
+    def children_input(n_nodes):
+        tax_dict, new_tax_dict = synthetic_taxonomy(n_nodes, 20, 8, seed)
+        lesson['tax_dict'], lesson['new_tax_dict'] = tax_dict, new_tax_dict
+
+    def children(n_nodes):
+        children_input(n_nodes)
+        return lambda: lesson['get_children'](ROOT)
+
+    def children_rec(n_nodes):
+        children_input(n_nodes)
+        return lambda: lesson['get_children_rec'](ROOT)
+
+    def lca_input(n_taxa):
+        tax_dict, new_tax_dict = synthetic_taxonomy(10_000, 30, 6, seed)
+        lesson['tax_dict'], lesson['new_tax_dict'] = tax_dict, new_tax_dict
+        return tax_dict, _sample(list(tax_dict), n_taxa, seed)
+
+    def lca_list(n_taxa):
+        _, taxa = lca_input(n_taxa)
+        return lambda: lesson['get_lca_list'](list(taxa))  # it pops, so each run gets a copy
+
+    def lca_rec(n_taxa):
+        _, taxa = lca_input(n_taxa)
+        return lambda: lesson['get_lca_rec'](list(taxa))
+
+    def lca_rec_pop(n_taxa):
+        _, taxa = lca_input(n_taxa)
+        return lambda: lesson['get_lca_rec_pop'](list(taxa))
+
+    def lca_index(n_taxa):
+        tax_dict, taxa = lca_input(n_taxa)
+        # building the index is part of the cost
+        return lambda: LcaIndex.from_child_to_parent(tax_dict).lca_list(taxa)
+
+    return {
+        'get_ancestors': ('depth', ancestors),
+        'get_ancestors_rec': ('depth', ancestors_rec),
+        'AncestorCache.get_ancestors': ('depth', ancestors_cached),
+        'get_children': ('nodes', children),
+        'get_children_rec': ('nodes', children_rec),
+        'get_lca_list': ('taxa', lca_list),
+        'get_lca_rec': ('taxa', lca_rec),
+        'get_lca_rec_pop': ('taxa', lca_rec_pop),
+        'LcaIndex.lca_list': ('taxa', lca_index),
+    }
+
+
+def _sequence_cases(lesson, seed):
+    from dedup import deduplicate
+    from kmer_count import count_kmers
+
+    def kmers(k):
+        return lambda: lesson['generate_kmers'](k)
+
+    def kmers_rec(k):
+        return lambda: lesson['generate_kmers_rec'](k)
+
+    def kmer_dict(length):
+        # the kmer2count loop from 2_complex_data_structures.py
+        dna = random_dna(length, seed)
+
+        def run(k=8):
+            kmer2count = {}
+            for start in range(len(dna) - k + 1):
+                kmer = dna[start:start + k]
+                kmer2count[kmer] = kmer2count.get(kmer, 0) + 1
+            return kmer2count
+        return run
+
+    def kmer_array(length):
+        dna = random_dna(length, seed)
+        return lambda: count_kmers(dna, 8)
+
+    def dedup_set(n):
+        accessions = random_accessions(n, seed=seed)
+
+        def run():
+            processed_numbers = set()
+            unique = []
+            for acc in accessions:
+                if acc not in processed_numbers:
+                    processed_numbers.add(acc)
+                    unique.append(acc)
+            return unique
+        return run
+
+    def dedup_exact(n):
+        accessions = random_accessions(n, seed=seed)
+
+        def run():
+            unique, deduplicator = deduplicate(accessions)
+            with deduplicator:
+                return list(unique)
+        return run
+
+    return {
+        'generate_kmers': ('k', kmers),
+        'generate_kmers_rec': ('k', kmers_rec),
+        'kmer2count loop': ('bases', kmer_dict),
+        'count_kmers': ('bases', kmer_array),
+        'set dedup': ('accessions', dedup_set),
+        'dedup exact': ('accessions', dedup_exact),
+    }
+
+
+# sizes per size name; 'quick' is for a check that takes seconds, not minutes
+SIZES = {
+    'full': {'k': [4, 6, 8, 9], 'depth': [10, 100, 500, 2000], 'nodes': [1_000, 10_000, 100_000],
+             'taxa': [10, 100, 1000], 'bases': [10_000, 100_000, 1_000_000],
+             'accessions': [10_000, 100_000, 1_000_000]},
+    'quick': {'k': [4, 6], 'depth': [10, 100], 'nodes': [1_000, 10_000], 'taxa': [10, 100],
+              'bases': [10_000, 100_000], 'accessions': [10_000, 100_000]},
+}
+
+
+def run_suite(sizes='full', repeat=3, seed=0, routines=None, lesson_file=LESSON_FILE, verbose=False):
+    # every routine at every size -> {'meta': {...}, 'results': [{routine, size_name, size, seconds, ...}]}
+    #   - routines: only these names (None = all)
+    if isinstance(sizes, str):
+        sizes = SIZES[sizes]
+    lesson = load_lesson_functions(lesson_file)
+    cases = dict(_taxonomy_cases(lesson, seed))
+    cases.update(_sequence_cases(lesson, seed))
+    results = []
+    for routine, (size_name, prepare) in cases.items():
+        if routines is not None and routine not in routines:
+            continue
+        if routine.startswith(('get_', 'generate_')) and routine not in lesson:
+            continue  # not in this copy of the lessons
+        for size in sizes[size_name]:
+            result = {'routine': routine, 'size_name': size_name, 'size': size}
+            result.update(measure(prepare(size), repeat))
+            results.append(result)
+            if verbose:
+                print(_format_result(result))
+    meta = {'python': platform.python_version(), 'numpy': np.__version__, 'platform': platform.platform(),
+            'machine': platform.machine(), 'date': time.strftime('%Y-%m-%d %H:%M:%S'),
+            'seed': seed, 'repeat': repeat, 'sizes': sizes}
+    return {'meta': meta, 'results': results}
+
+
+def _format_result(result):
+    if result['error']:
+        return '{:<28} {:>11} {:>9}  {}'.format(result['routine'], result['size_name'], result['size'], result['error'])
+    return '{:<28} {:>11} {:>9}  {:>10.4f}s {:>12,} bytes'.format(
+        result['routine'], result['size_name'], result['size'], result['seconds'], result['peak_bytes'])
+
+
+# ---------- Import time ---------- #
+
+# milliseconds each module may take to import into a fresh interpreter
+IMPORT_BUDGETS_MS = {'trees': 5.0, '1_Recursion_and_Trees': 5.0, '2_complex_data_structures': 5.0}
+HEAVY_MODULES = ('numpy',)  # should not be imported by the modules above
+
+
+def import_time(module, runs=5):
+    # best import time of module in a fresh interpreter (python -X importtime), in milliseconds
+    #   -> (milliseconds, heavy modules it pulled in)
+    code = 'import sys; __import__({!r}); print(*[m for m in {!r} if m in sys.modules])'
+    # timed with the byte code already cached, as after the first import anywhere
+    path = os.path.join(HERE, module + '.py')
+    if os.path.exists(path):
+        py_compile.compile(path)
+    best = None
+    for _ in range(runs):
+        process = subprocess.run([sys.executable, '-X', 'importtime', '-c', code.format(module, HEAVY_MODULES)],
+                                 capture_output=True, text=True, cwd=HERE, check=True)
+        for line in process.stderr.splitlines():
+            # import time: self [us] | cumulative | imported package
+            fields = line.split('|')
+            if len(fields) == 3 and fields[2].strip() == module:
+                microseconds = int(fields[1])
+                best = microseconds if best is None else min(best, microseconds)
+    return best / 1e3, process.stdout.split()
+
+
+def check_startup(budgets=None, runs=5):
+    # [(module, milliseconds, budget, heavy modules imported, within budget)]
+    budgets = IMPORT_BUDGETS_MS if budgets is None else budgets
+    rows = []
+    for module, budget in budgets.items():
+        milliseconds, heavy = import_time(module, runs)
+        rows.append((module, milliseconds, budget, heavy, milliseconds <= budget and not heavy))
+    return rows
+
+
+# ---------- Saving and comparing runs ---------- #
+
+def save_results(results, path):
+    with open(path, 'w') as handle:
+        json.dump(results, handle, indent=1)
+
+
+def load_results(path):
+    with open(path) as handle:
+        return json.load(handle)
+
+
+def compare(old, new, threshold=0.25, min_seconds=1e-3):
+    # line up two runs by (routine, size) -> list of rows, regressions flagged
+    #   - a regression is time or peak memory up by more than threshold (0.25 = 25%),
+    #     or a routine that used to finish and now fails
+    #   - times under min_seconds are too noisy to flag
+    before = {(r['routine'], r['size']): r for r in old['results']}
+    rows = []
+    for result in new['results']:
+        previous = before.get((result['routine'], result['size']))
+        if previous is None:
+            continue
+        row = {'routine': result['routine'], 'size': result['size'], 'time_ratio': None, 'memory_ratio': None,
+               'error': result['error'], 'regression': []}
+        if result['error']:
+            if not previous['error']:
+                row['regression'].append('fails')
+        elif not previous['error']:
+            row['time_ratio'] = result['seconds'] / previous['seconds'] if previous['seconds'] else None
+            row['memory_ratio'] = result['peak_bytes'] / previous['peak_bytes'] if previous['peak_bytes'] else None
+            if row['time_ratio'] and row['time_ratio'] > 1 + threshold and \
+                    max(result['seconds'], previous['seconds']) >= min_seconds:
+                row['regression'].append('time')
+            if row['memory_ratio'] and row['memory_ratio'] > 1 + threshold:
+                row['regression'].append('memory')
+        rows.append(row)
+    return rows
+
+
+def print_comparison(rows):
+    for row in rows:
+        ratios = '{:>7} {:>7}'.format(*('{:.2f}x'.format(r) if r else '-' for r in (row['time_ratio'], row['memory_ratio'])))
+        flag = ('REGRESSION: ' + ', '.join(row['regression'])) if row['regression'] else (row['error'] or '')
+        print('{:<28} {:>9}  {}  {}'.format(row['routine'], row['size'], ratios, flag))
+
+
+if __name__ == '__main__':
+    usage = ('python benchmarks.py run results.json [--quick]\n'
+             'python benchmarks.py compare old.json new.json [threshold]\n'
+             'python benchmarks.py startup')
+    if sys.argv[1:2] == ['startup']:
+        rows = check_startup()
+        for module, milliseconds, budget, heavy, ok in rows:
+            print('{:<28} {:>7.2f} ms (budget {:.1f} ms) {}{}'.format(
+                module, milliseconds, budget, 'imports ' + ', '.join(heavy) + ' ' if heavy else '',
+                'ok' if ok else 'OVER BUDGET'))
+        sys.exit(0 if all(row[-1] for row in rows) else 1)
+    if len(sys.argv) < 3 or sys.argv[1] not in ('run', 'compare'):
+        sys.exit(usage)
+    if sys.argv[1] == 'run':
+        results = run_suite('quick' if '--quick' in sys.argv else 'full', verbose=True)
+        save_results(results, sys.argv[2])
+    else:
+        if len(sys.argv) < 4:
+            sys.exit(usage)
+        threshold = float(sys.argv[4]) if len(sys.argv) > 4 else 0.25
+        rows = compare(load_results(sys.argv[2]), load_results(sys.argv[3]), threshold)
+        print('{:<28} {:>9}  {:>7} {:>7}'.format('routine', 'size', 'time', 'memory'))
+        print_comparison(rows)
+        if any(row['regression'] for row in rows):
+            sys.exit(1)
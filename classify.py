@@ -0,0 +1,155 @@
+#----------------- Classifying reads by last common ancestor ------------------------#
+
+# get_lca_list empties its input with pop() and prints at every step,
+# get_lca_rec slices a new list at every level
+#   - fine for three taxa, not for tens of millions of reads
+# Here: reads stream through in batches
+#   - a batch of (read_id, [taxa]) records becomes one flat array of taxon ids plus offsets
+#   - LcaIndex.lca_groups answers the whole batch at once, nothing is printed or copied
+#   - batches can be spread over a process pool, results come back in input order
+#     as soon as each batch is done
+#   - only a few batches per process are out at a time, so the records are read only as
+#     fast as the pool classifies them and never pile up in memory
+
+import os
+from collections import deque
+from itertools import islice
+from multiprocessing import Pool
+
+import numpy as np
+
+from fasta import open_source
+
+
+DEFAULT_BATCH_SIZE = 10_000  # reads per batch
+UNCLASSIFIED = 'unclassified'
+
+
+def iter_hits_file(source, convert=None):
+    # Reads 'read_id <TAB> taxon <TAB> taxon ...' lines as (read_id, [taxa])
+    #   - convert is applied to every taxon, e.g. int for NCBI tax ids
+    handle, should_close = open_source(source)
+    try:
+        for line in handle:
+            fields = line.rstrip(b'\r\n').decode().split('\t')
+            if not fields[0]:
+                continue
+            taxa = [taxon for taxon in fields[1:] if taxon]
+            yield fields[0], taxa if convert is None else [convert(taxon) for taxon in taxa]
+    finally:
+        if should_close:
+            handle.close()
+
+
+def write_assignments(results, handle):
+    # (read_id, lca) pairs -> 'read_id <TAB> lca' lines, reads without a known taxon are UNCLASSIFIED
+    count = 0
+    for read_id, lca in results:
+        handle.write(read_id + '\t' + (UNCLASSIFIED if lca is None else str(lca)) + '\n')
+        count += 1
+    return count
+
+
+class LcaClassifier:
+
+    def __init__(self, index):
+        # index: an LcaIndex (or Taxonomy.lca_index())
+        self.index = index
+
+    def classify_batch(self, records):
+        # [(read_id, [taxa]), ...] -> [(read_id, lca), ...]
+        #   - taxa the index does not know are ignored
+        #   - a read with no known taxa gets None
+        ids = self.index.ids
+        read_ids = []
+        flat = []
+        lengths = []
+        for read_id, taxa in records:
+            read_ids.append(read_id)
+            before = len(flat)
+            flat.extend(ids[taxon] for taxon in taxa if taxon in ids)
+            if len(flat) == before:
+                flat.append(self.index.virtual_root)
+            lengths.append(len(flat) - before)
+        if not read_ids:
+            return []
+        offsets = np.concatenate(([0], np.cumsum(lengths, dtype=np.int64)))
+        lcas = self.index.lca_groups(np.array(flat, dtype=np.int64), offsets)
+        return list(zip(read_ids, self.index.to_names(lcas)))
+
+    def classify(self, records, batch_size=DEFAULT_BATCH_SIZE):
+        # serial, one batch at a time
+        for batch in _batches(records, batch_size):
+            yield from self.classify_batch(batch)
+
+    def classify_parallel(self, records, processes=None, batch_size=DEFAULT_BATCH_SIZE, window=None):
+        # batches spread over a process pool, yielded in input order
+        #   - every worker gets the classifier once, from the pool initializer
+        #     (with fork it is inherited, otherwise it is pickled once per worker)
+        #   - at most window batches (default 2 per process) are submitted and not yet yielded
+        processes = processes or os.cpu_count() or 1
+        window = window or 2 * processes
+        pending = deque()
+        with Pool(processes, initializer=_init_worker, initargs=(self,)) as pool:
+            for batch in _batches(records, batch_size):
+                if len(pending) >= window:
+                    yield from pending.popleft().get()
+                pending.append(pool.apply_async(_classify_in_worker, (batch,)))
+            while pending:
+                yield from pending.popleft().get()
+
+
+_worker_classifier = None
+
+
+def _init_worker(classifier):
+    global _worker_classifier
+    _worker_classifier = classifier
+
+
+def _classify_in_worker(batch):
+    return _worker_classifier.classify_batch(batch)
+
+
+def _batches(records, batch_size):
+    records = iter(records)
+    while True:
+        batch = list(islice(records, batch_size))
+        if not batch:
+            return
+        yield batch
+
+
+if __name__ == '__main__':
+    import sys
+    import time
+
+    from lca import LcaIndex
+
+    # Benchmark: random taxonomy, random reads with 1-10 hits each
+    n_nodes = 200_000
+    n_reads = int(sys.argv[1]) if len(sys.argv) > 1 else 500_000
+    rng = np.random.default_rng(0)
+    parent = np.maximum(0, np.arange(n_nodes) - rng.integers(1, 5000, n_nodes))
+    names = ['taxon' + str(i) for i in range(n_nodes)]
+    classifier = LcaClassifier(LcaIndex(parent, names))
+    hits = rng.integers(0, n_nodes, 10 * n_reads).tolist()
+    counts = rng.integers(1, 11, n_reads).tolist()
+    records = []
+    start = 0
+    for read, count in enumerate(counts):
+        records.append(('read' + str(read), [names[i] for i in hits[start:start + count]]))
+        start += count
+
+    print(list(islice(classifier.classify(records[:3]), 3)))
+    start = time.perf_counter()
+    for result in classifier.classify(records):
+        pass
+    elapsed = time.perf_counter() - start
+    print('serial: {:.0f} reads/s'.format(n_reads / elapsed))
+    processes = os.cpu_count() or 1
+    start = time.perf_counter()
+    for result in classifier.classify_parallel(records, processes):
+        pass
+    elapsed = time.perf_counter() - start
+    print('{} processes: {:.0f} reads/s'.format(processes, n_reads / elapsed))
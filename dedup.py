@@ -0,0 +1,343 @@
+#----------------- Removing duplicate accessions at scale ------------------------#
+
+# OPTION 1-3 in the sets section (list, dict, set) all keep every accession string in RAM
+#   - fine for thousands, not for billions
+# Here: accessions stream through in batches and only 8-byte fingerprints are kept
+#   - exact mode: fingerprints live in sorted arrays; when memory fills up,
+#     the array is written to disk as a sorted run and searched there (memory-mapped)
+#     runs of similar size are merged (on disk too, a piece at a time), so a lookup
+#     searches a logarithmic number of runs however long the stream is
+#     64-bit fingerprints make a false "duplicate" about as likely as n^2 / 2^65
+#   - approximate mode: a Bloom filter with a chosen false-positive rate,
+#     about 1.2 bytes per accession at 1%, nothing on disk
+# Both yield the unique accessions in the order they first appear
+
+import os
+import shutil
+import tempfile
+import time
+from itertools import islice
+
+import numpy as np
+
+from fasta import open_source
+
+
+DEFAULT_BATCH_SIZE = 1 << 18
+MERGE_PIECE = 1 << 22  # fingerprints read at a time while two runs on disk are merged
+COUNT_PIECE = 1 << 20  # filter bytes popcounted at a time
+FNV_OFFSET = np.uint64(0xcbf29ce484222325)
+FNV_PRIME = np.uint64(0x100000001b3)
+_MASK64 = (1 << 64) - 1
+
+
+def iter_accessions(source):
+    # one accession per line, blank lines skipped, as bytes
+    handle, should_close = open_source(source)
+    try:
+        for line in handle:
+            line = line.strip()
+            if line:
+                yield line
+    finally:
+        if should_close:
+            handle.close()
+
+
+def _mix(values):
+    # splitmix64 finaliser, spreads every input bit over the whole word
+    values = values ^ (values >> np.uint64(30))
+    values = values * np.uint64(0xbf58476d1ce4e5b9)
+    values = values ^ (values >> np.uint64(27))
+    values = values * np.uint64(0x94d049bb133111eb)
+    return values ^ (values >> np.uint64(31))
+
+
+_BYTE_POPCOUNT = np.array([bin(byte).count('1') for byte in range(256)], dtype=np.uint8)
+
+
+def _popcount(data):
+    # number of set bits in every byte
+    if hasattr(np, 'bitwise_count'):
+        return np.bitwise_count(data)
+    return _BYTE_POPCOUNT[data]
+
+
+def fingerprints(accessions):
+    # 64-bit FNV-1a of every accession, one byte column at a time for the whole batch
+    #   - stable between runs and processes, unlike hash()
+    #   - a list of str/bytes, or a fixed-width bytes array
+    if isinstance(accessions, np.ndarray) and accessions.dtype.kind == 'S':
+        table = np.ascontiguousarray(accessions)
+    else:
+        accessions = [acc.encode() if isinstance(acc, str) else acc for acc in accessions]
+        table = np.array(accessions, dtype=bytes)
+    if not len(table):
+        return np.zeros(0, dtype=np.uint64)
+    width = table.dtype.itemsize
+    columns = table.view(np.uint8).reshape(len(table), width)
+    lengths = np.char.str_len(table)
+    result = np.full(len(table), FNV_OFFSET, dtype=np.uint64)
+    for i in range(width):
+        active = lengths > i
+        result[active] = (result[active] ^ columns[active, i]) * FNV_PRIME
+    return _mix(result)
+
+
+def fingerprint(accession):
+    # the same value as fingerprints([accession])[0], in plain Python for single lookups
+    if isinstance(accession, str):
+        accession = accession.encode()
+    value = int(FNV_OFFSET)
+    for byte in accession.rstrip(b'\0'):
+        value = ((value ^ byte) * int(FNV_PRIME)) & _MASK64
+    value ^= value >> 30
+    value = (value * 0xbf58476d1ce4e5b9) & _MASK64
+    value ^= value >> 27
+    value = (value * 0x94d049bb133111eb) & _MASK64
+    return value ^ (value >> 31)
+
+
+def _merge_sorted_files(run_a, run_b, path):
+    # two sorted (memory-mapped) runs -> one sorted run in a new .npy file
+    #   - both runs are cut at the same values, so only MERGE_PIECE of each is in RAM at a time
+    out = np.lib.format.open_memmap(path, mode='w+', dtype=np.uint64, shape=(len(run_a) + len(run_b),))
+    cuts = np.sort(np.concatenate((run_a[MERGE_PIECE::MERGE_PIECE], run_b[MERGE_PIECE::MERGE_PIECE])))
+    bounds_a = [0] + np.searchsorted(run_a, cuts).tolist() + [len(run_a)]
+    bounds_b = [0] + np.searchsorted(run_b, cuts).tolist() + [len(run_b)]
+    position = 0
+    for a0, a1, b0, b1 in zip(bounds_a[:-1], bounds_a[1:], bounds_b[:-1], bounds_b[1:]):
+        piece = np.sort(np.concatenate((run_a[a0:a1], run_b[b0:b1])), kind='stable')
+        out[position:position + len(piece)] = piece
+        position += len(piece)
+    out.flush()
+    del out
+
+
+def _first_occurrences(prints):
+    # indices of the first time each fingerprint shows up in a batch, in batch order
+    _, first = np.unique(prints, return_index=True)
+    first.sort()
+    return first
+
+
+class DedupStats:
+
+    def __init__(self, mode):
+        self.mode = mode
+        self.seen = 0
+        self.unique = 0
+        self.memory_bytes = 0
+        self.disk_bytes = 0
+        self.runs = 0
+        self.seconds = 0.0
+
+    @property
+    def duplicates(self):
+        return self.seen - self.unique
+
+    @property
+    def per_second(self):
+        return self.seen / self.seconds if self.seconds else 0.0
+
+    def __repr__(self):
+        return ('DedupStats(mode={!r}, seen={}, unique={}, duplicates={}, memory={:.1f} MB, '
+                'disk={:.1f} MB, runs={}, {:.0f} accessions/s)').format(
+            self.mode, self.seen, self.unique, self.duplicates, self.memory_bytes / 1e6,
+            self.disk_bytes / 1e6, self.runs, self.per_second)
+
+
+class _Deduplicator:
+
+    def unique(self, accessions, batch_size=DEFAULT_BATCH_SIZE):
+        # unique accessions, in the order they first appear
+        accessions = iter(accessions)
+        while True:
+            batch = list(islice(accessions, batch_size))
+            if not batch:
+                return
+            start = time.perf_counter()
+            keep = self.add_batch(batch)
+            self.stats.seconds += time.perf_counter() - start
+            for i in keep.tolist():
+                yield batch[i]
+
+    def add_batch(self, batch):
+        # indices of the accessions in batch that were not seen before
+        prints = fingerprints(batch)
+        first = _first_occurrences(prints)
+        new = first[~self._contains(prints[first])]
+        self._add(prints[new])
+        self.stats.seen += len(batch)
+        self.stats.unique += len(new)
+        return new
+
+
+class ExactDeduplicator(_Deduplicator):
+
+    def __init__(self, memory_limit=1 << 24, spill_dir=None):
+        # memory_limit: fingerprints kept in RAM before a sorted run is written to disk
+        self.memory_limit = memory_limit
+        self.stats = DedupStats('exact')
+        self._memory = []  # sorted runs in RAM, biggest first
+        self._disk = []  # sorted runs on disk, memory-mapped, biggest first
+        self._disk_paths = []
+        self._files_written = 0
+        self._own_dir = spill_dir is None
+        self._spill_dir = spill_dir
+
+    def _contains(self, prints):
+        found = np.zeros(len(prints), dtype=bool)
+        for run in self._memory + self._disk:
+            if len(run):
+                slot = np.minimum(np.searchsorted(run, prints), len(run) - 1)
+                found |= run[slot] == prints
+        return found
+
+    def _add(self, prints):
+        if not len(prints):
+            return
+        self._memory.append(np.sort(prints))
+        # size-tiered merging keeps the number of RAM runs logarithmic
+        while len(self._memory) > 1 and len(self._memory[-2]) <= 2 * len(self._memory[-1]):
+            newest = self._memory.pop()
+            self._memory[-1] = np.sort(np.concatenate((self._memory[-1], newest)), kind='stable')
+        in_memory = sum(len(run) for run in self._memory)
+        if in_memory >= self.memory_limit:
+            self._spill()
+        self.stats.memory_bytes = 8 * sum(len(run) for run in self._memory)
+
+    def _new_path(self):
+        if self._spill_dir is None:
+            self._spill_dir = tempfile.mkdtemp(prefix='dedup-')
+        self._files_written += 1
+        return os.path.join(self._spill_dir, 'run{:05d}.npy'.format(self._files_written))
+
+    def _spill(self):
+        path = self._new_path()
+        np.save(path, np.sort(np.concatenate(self._memory)))
+        self._disk.append(np.load(path, mmap_mode='r'))
+        self._disk_paths.append(path)
+        self._memory = []
+        # the same size-tiered merging as in RAM, so the runs searched by every batch
+        # stay logarithmic in the length of the stream (as in an LSM tree)
+        while len(self._disk) > 1 and len(self._disk[-2]) <= 2 * len(self._disk[-1]):
+            self._merge_last_disk_runs()
+        self.stats.runs = len(self._disk)
+        self.stats.disk_bytes = sum(run.nbytes for run in self._disk)
+
+    def _merge_last_disk_runs(self):
+        path = self._new_path()
+        _merge_sorted_files(self._disk[-2], self._disk[-1], path)
+        # the old runs are closed before their files are removed
+        del self._disk[-2:]
+        for old_path in self._disk_paths[-2:]:
+            os.remove(old_path)
+        self._disk_paths[-2:] = [path]
+        self._disk.append(np.load(path, mmap_mode='r'))
+
+    def close(self):
+        self._disk = []
+        self._disk_paths = []
+        if self._own_dir and self._spill_dir is not None:
+            shutil.rmtree(self._spill_dir, ignore_errors=True)
+            self._spill_dir = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+class BloomDeduplicator(_Deduplicator):
+
+    def __init__(self, capacity, false_positive_rate=0.01):
+        # sized for `capacity` unique accessions at the given false-positive rate
+        #   - a false positive drops a new accession as if it were a duplicate
+        self.capacity = capacity
+        self.false_positive_rate = false_positive_rate
+        self.n_bits = max(64, int(-capacity * np.log(false_positive_rate) / np.log(2) ** 2))
+        self.n_hashes = max(1, round(self.n_bits / capacity * np.log(2)))
+        self.bits = np.zeros((self.n_bits + 7) // 8, dtype=np.uint8)
+        self.stats = DedupStats('approximate')
+        self.stats.memory_bytes = self.bits.nbytes
+
+    def _positions(self, prints):
+        # k bit positions per fingerprint by double hashing: h1 + i * h2
+        h1 = prints % np.uint64(self.n_bits)
+        h2 = (_mix(prints) | np.uint64(1)) % np.uint64(self.n_bits)
+        steps = np.arange(self.n_hashes, dtype=np.uint64)
+        return (h1[:, None] + steps * h2[:, None]) % np.uint64(self.n_bits)
+
+    def _contains(self, prints):
+        positions = self._positions(prints)
+        present = (self.bits[positions >> np.uint64(3)] >> (positions & np.uint64(7)).astype(np.uint8)) & 1
+        return present.all(axis=1)
+
+    def _add(self, prints):
+        positions = self._positions(prints).ravel()
+        np.bitwise_or.at(self.bits, positions >> np.uint64(3),
+                         np.left_shift(1, (positions & np.uint64(7)).astype(np.uint8)).astype(np.uint8))
+
+    def estimated_false_positive_rate(self):
+        # from how full the filter is right now
+        #   - counted a piece at a time, the filter can be most of RAM
+        set_bits = 0
+        for start in range(0, len(self.bits), COUNT_PIECE):
+            set_bits += int(_popcount(self.bits[start:start + COUNT_PIECE]).sum(dtype=np.int64))
+        filled = set_bits / (8 * len(self.bits))
+        return float(filled ** self.n_hashes)
+
+    def close(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def deduplicate(source, mode='exact', capacity=None, false_positive_rate=0.01, memory_limit=1 << 24):
+    # Unique accessions from a file (one per line) or an iterable, as a generator
+    #   - the deduplicator is returned too, its .stats fill in as the generator runs
+    accessions = iter_accessions(source) if isinstance(source, (str, bytes, os.PathLike)) or hasattr(source, 'read') else source
+    if mode == 'exact':
+        deduplicator = ExactDeduplicator(memory_limit)
+    elif mode == 'approximate':
+        if capacity is None:
+            raise ValueError('approximate mode needs the expected number of unique accessions (capacity)')
+        deduplicator = BloomDeduplicator(capacity, false_positive_rate)
+    else:
+        raise ValueError("mode must be 'exact' or 'approximate'")
+    return _closing(deduplicator.unique(accessions), deduplicator), deduplicator
+
+
+def _closing(unique, deduplicator):
+    # the spill directory goes as soon as the generator is used up or closed
+    try:
+        yield from unique
+    finally:
+        deduplicator.close()
+
+
+if __name__ == '__main__':
+    import sys
+
+    # Same answer as the three options in the lesson
+    acc_list = ['ABC123', 'XYZ456', 'ABC123', 'PQR789', 'XYZ456']
+    unique, deduplicator = deduplicate(acc_list)
+    print(list(unique), deduplicator.stats)
+
+    # Memory and throughput, 30% duplicates
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 2_000_000
+    rng = np.random.default_rng(0)
+    numbers = rng.integers(0, int(n * 0.7), n)
+    accessions = [b'ACC%09d' % number for number in numbers.tolist()]
+    for mode, kwargs in [('exact', {'memory_limit': n // 4}), ('approximate', {'capacity': n})]:
+        unique, deduplicator = deduplicate(accessions, mode, **kwargs)
+        count = sum(1 for _ in unique)
+        print(count, deduplicator.stats)
+        deduplicator.close()
+    print('python set: {} unique'.format(len(set(accessions))))
@@ -0,0 +1,87 @@
+#----------------- Reading FASTA in chunks ------------------------#
+
+# Whole-genome files don't fit comfortably in one Python string
+#   - read them a chunk at a time instead, newlines removed
+#   - works with a path (plain or .gz) or an already open file object
+
+import gzip
+import io
+import os
+
+
+DEFAULT_CHUNK_SIZE = 1 << 22  # 4 Mb of sequence per chunk
+
+
+def open_source(source):
+    # Returns (binary handle, should_close)
+    if isinstance(source, (str, os.PathLike)):
+        path = os.fspath(source)
+        if path.endswith('.gz'):
+            return gzip.open(path, 'rb'), True
+        return open(path, 'rb'), True
+    if isinstance(source, io.TextIOBase):
+        return source.buffer, False
+    return source, False
+
+
+def iter_sequence_chunks(source, chunk_size=DEFAULT_CHUNK_SIZE):
+    # Yields (new_record, chunk) pairs
+    #   - new_record is True for the first chunk of every record
+    #   - a file without any '>' header is treated as a single record
+    #   - every record yields at least one chunk, even if it has no sequence
+    handle, should_close = open_source(source)
+    try:
+        pending = []
+        pending_size = 0
+        new_record = True
+        in_record = False
+        for line in handle:
+            if line.startswith(b'>'):
+                # records without any sequence still get their (True, b'') chunk
+                if in_record and (pending or new_record):
+                    yield new_record, b''.join(pending)
+                pending = []
+                pending_size = 0
+                new_record = True
+                in_record = True
+                continue
+            line = line.rstrip()
+            if not line:
+                continue
+            in_record = True
+            pending.append(line)
+            pending_size += len(line)
+            if pending_size >= chunk_size:
+                yield new_record, b''.join(pending)
+                pending = []
+                pending_size = 0
+                new_record = False
+        if in_record and (pending or new_record):
+            yield new_record, b''.join(pending)
+    finally:
+        if should_close:
+            handle.close()
+
+
+def iter_records(source):
+    # Yields (header, sequence) for every record, whole sequences this time
+    #   - header is the text after '>' (str), sequence is bytes without newlines
+    handle, should_close = open_source(source)
+    try:
+        header = None
+        pieces = []
+        for line in handle:
+            if line.startswith(b'>'):
+                if header is not None:
+                    yield header, b''.join(pieces)
+                header = line[1:].strip().decode()
+                pieces = []
+            else:
+                line = line.strip()
+                if line:
+                    pieces.append(line)
+        if header is not None:
+            yield header, b''.join(pieces)
+    finally:
+        if should_close:
+            handle.close()
@@ -0,0 +1,128 @@
+#----------------- Which gene sets sit inside which ------------------------#
+
+# The subset loop tests every ordered pair of conditions and prints every relation,
+# including the ones that follow from others (A in B and B in C already says A in C)
+# Here: only the direct relations are kept (the Hasse diagram / transitive reduction)
+#   - conditions are sorted by size first: a set can only sit inside a later one
+#   - for every gene there is a bitset of the conditions that contain it, so the
+#     supersets of A are the AND of those bitsets over the genes of A,
+#     no pair of sets is ever compared gene by gene
+#   - the direct supersets of A are picked smallest first; each one picked rules out
+#     everything above it
+# The result is a dict like new_tax_dict: condition -> list of its direct subsets
+#   - get_children-style walks work on it; since a set can sit in more than one
+#     other set it is a DAG, so walk_down() visits every condition only once
+#   - identical sets are chained, the one added first sits below the later ones
+
+import numpy as np
+
+from gene_sets import GeneSets
+
+
+_BLOCK_GENES = 1024  # genes transposed at a time
+
+
+def _condition_bits(bits, order):
+    # bits (conditions x gene words) -> (genes x condition words), conditions in the given order
+    n = len(order)
+    n_genes = 64 * bits.shape[1]
+    by_gene = np.zeros((n_genes, (n + 63) // 64), dtype='<u8')
+    for start in range(0, bits.shape[1], _BLOCK_GENES // 64):
+        words = bits[order, start:start + _BLOCK_GENES // 64]
+        unpacked = np.unpackbits(words.view(np.uint8), axis=1, bitorder='little')
+        packed = np.packbits(unpacked.T, axis=1, bitorder='little')
+        padded = np.zeros((packed.shape[0], by_gene.shape[1] * 8), dtype=np.uint8)
+        padded[:, :packed.shape[1]] = packed
+        by_gene[64 * start:64 * start + len(padded)] = padded.view('<u8')
+    return by_gene
+
+
+def subset_lattice(gene_sets):
+    # gene_sets: a dict of sets (like gene_sets) or a GeneSets
+    # Returns {condition: [conditions directly inside it]}
+    if not isinstance(gene_sets, GeneSets):
+        gene_sets = GeneSets(gene_sets)
+    conditions = gene_sets.conditions
+    n = len(conditions)
+    n_words = (n + 63) // 64
+    bits = gene_sets.bits[:n]
+    # smallest sets first; for equal sizes the condition added first comes first
+    order = np.lexsort((np.arange(n), gene_sets.sizes[:n]))
+    by_gene = _condition_bits(bits, order)
+
+    # up[a]: the later conditions (in size order) that contain condition a
+    up = np.zeros((n, n_words), dtype='<u8')
+    later = np.zeros(n_words, dtype='<u8')
+    everything = ~np.zeros(n_words, dtype='<u8')
+    for a in range(n - 1, -1, -1):
+        genes = np.flatnonzero(np.unpackbits(bits[order[a]].view(np.uint8), bitorder='little'))
+        supersets = np.bitwise_and.reduce(by_gene[genes], axis=0) if len(genes) else everything
+        up[a] = supersets & later
+        later[a // 64] |= np.uint64(1) << np.uint64(a % 64)
+
+    # the direct supersets of a are the smallest of up[a], then whatever they do not already cover
+    lattice = {condition: [] for condition in conditions}
+    for a in range(n):
+        remaining = up[a].copy()
+        while True:
+            nonzero = np.flatnonzero(remaining)
+            if not len(nonzero):
+                break
+            word = nonzero[0]
+            value = int(remaining[word])
+            c = 64 * int(word) + (value & -value).bit_length() - 1
+            lattice[conditions[order[c]]].append(conditions[order[a]])
+            remaining &= ~up[c]
+            remaining[word] &= ~(np.uint64(1) << np.uint64(c % 64))
+    return lattice
+
+
+def lattice_roots(lattice):
+    # conditions that are not inside any other (the tops of the DAG)
+    inside = {child for children in lattice.values() for child in children}
+    return [condition for condition in lattice if condition not in inside]
+
+
+def walk_down(lattice, condition):
+    # like get_children: the condition and every set inside it, each listed once
+    result = []
+    seen = {condition}
+    stack = [condition]
+    while len(stack) != 0:
+        current = stack.pop()
+        result.append(current)
+        for child in lattice.get(current, []):
+            if child not in seen:
+                seen.add(child)
+                stack.append(child)
+    return result
+
+
+if __name__ == '__main__':
+    import sys
+    import time
+
+    gene_sets = {
+        'arsenic': {1, 2, 3, 4, 5, 6, 8, 12},
+        'lead': {2, 4, 6, 12},
+        'mercury': {7, 6, 4, 10, 8},
+        'nickel': {2, 3, 4, 5, 1}
+    }
+    lattice = subset_lattice(gene_sets)
+    print(lattice, lattice_roots(lattice), walk_down(lattice, 'arsenic'))
+
+    # 10k nested gene sets: random unions of smaller ones, so there is a lot to find
+    n_sets = int(sys.argv[1]) if len(sys.argv) > 1 else 10_000
+    rng = np.random.default_rng(0)
+    sets = []
+    for i in range(n_sets):
+        if i < n_sets // 4 or rng.random() < 0.3:
+            genes = set(rng.choice(20_000, rng.integers(5, 50), replace=False).tolist())
+        else:
+            genes = set().union(*(sets[j] for j in rng.integers(0, i, rng.integers(1, 4))))
+        sets.append(genes)
+    big = GeneSets(dict(enumerate(sets)))
+    start = time.perf_counter()
+    lattice = subset_lattice(big)
+    print('{} sets, {} direct subset links in {:.2f}s'.format(
+        n_sets, sum(map(len, lattice.values())), time.perf_counter() - start))
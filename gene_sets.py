@@ -0,0 +1,276 @@
+#----------------- Gene sets as bitsets ------------------------#
+
+# gene_sets is a dict of Python sets
+#   - the subset loop compares every pair of sets element by element
+#   - with 20k genes and thousands of conditions that takes hours
+# Here: every gene gets a bit position, every condition is one row of 64-bit words
+#   - bit g of row c is set when gene g is in condition c
+#   - union, intersection and difference of two sets are bitwise |, & and &~ on their rows
+#   - for all pairs at once, |A & B| is counted for a block of rows against every row,
+#     and union, difference, subset and Jaccard all follow from |A & B|, |A| and |B|
+# 20k genes take 2.5 kB per condition, so plain (uncompressed) bitsets are small enough
+# The reverse question (which conditions is gene 5 in?) goes through an inverted index
+#   - gene -> set of conditions, kept up to date on every add and discard
+#   - a lookup costs the size of its answer, however many conditions there are
+
+from collections.abc import Mapping
+
+import numpy as np
+
+
+_BLOCK_BYTES = 1 << 24  # temporary memory for one block of pairwise ANDs
+
+
+def _popcount(words):
+    # number of set bits in every uint64 word
+    if hasattr(np, 'bitwise_count'):
+        return np.bitwise_count(words)
+    counts = np.unpackbits(words.view(np.uint8), axis=-1).reshape(words.shape + (64,))
+    return counts.sum(axis=-1, dtype=np.uint8)
+
+
+class InvertedIndex:
+    # gene -> conditions it appears in, the other way round from gene_sets
+
+    def __init__(self, gene_sets=None):
+        self._conditions = {}
+        for condition, genes in (gene_sets or {}).items():
+            self.add_condition(condition, genes)
+
+    def add(self, condition, gene):
+        self._conditions.setdefault(gene, set()).add(condition)
+
+    def discard(self, condition, gene):
+        conditions = self._conditions.get(gene)
+        if conditions is not None:
+            conditions.discard(condition)
+            if not conditions:
+                del self._conditions[gene]
+
+    def add_condition(self, condition, genes):
+        for gene in genes:
+            self.add(condition, gene)
+
+    def remove_condition(self, condition, genes):
+        for gene in genes:
+            self.discard(condition, gene)
+
+    def conditions_of(self, gene):
+        # same as [metal for metal, genes in gene_sets.items() if gene in genes], as a set
+        return set(self._conditions.get(gene, ()))
+
+    def batch(self, genes):
+        # one set of conditions per gene, for many genes in one call
+        lookup = self._conditions.get
+        return [set(lookup(gene, ())) for gene in genes]
+
+    def counts(self, genes):
+        # how many conditions every gene is in
+        lookup = self._conditions.get
+        return np.array([len(lookup(gene, ())) for gene in genes], dtype=np.int64)
+
+    def __contains__(self, gene):
+        return gene in self._conditions
+
+    def __len__(self):
+        return len(self._conditions)
+
+
+class GeneSets(Mapping):
+    # Works like the dict of sets: gene_sets['lead'] is the set of genes for lead
+
+    def __init__(self, gene_sets=None):
+        self.conditions = []
+        self.condition_ids = {}
+        self.genes = []
+        self.gene_ids = {}
+        self.bits = np.zeros((4, 1), dtype='<u8')
+        self.sizes = np.zeros(4, dtype=np.int64)
+        self.index = InvertedIndex()
+        for condition, genes in (gene_sets or {}).items():
+            self.add_condition(condition, genes)
+
+    # ---Building and updating
+
+    def _gene_id(self, gene):
+        gene_id = self.gene_ids.get(gene)
+        if gene_id is None:
+            gene_id = self.gene_ids[gene] = len(self.genes)
+            self.genes.append(gene)
+            if gene_id >= 64 * self.bits.shape[1]:
+                self._grow(self.bits.shape[0], 2 * self.bits.shape[1])
+        return gene_id
+
+    def _grow(self, rows, words):
+        bits = np.zeros((rows, words), dtype='<u8')
+        bits[:self.bits.shape[0], :self.bits.shape[1]] = self.bits
+        self.bits = bits
+        sizes = np.zeros(rows, dtype=np.int64)
+        sizes[:len(self.sizes)] = self.sizes
+        self.sizes = sizes
+
+    def add_condition(self, condition, genes=()):
+        # a new condition, or more genes for an existing one
+        row = self.condition_ids.get(condition)
+        if row is None:
+            row = self.condition_ids[condition] = len(self.conditions)
+            self.conditions.append(condition)
+            if row >= self.bits.shape[0]:
+                self._grow(2 * self.bits.shape[0], self.bits.shape[1])
+        genes = list(genes)
+        self.index.add_condition(condition, genes)
+        gene_ids = np.array([self._gene_id(gene) for gene in genes], dtype=np.uint64)
+        if len(gene_ids):
+            np.bitwise_or.at(self.bits[row], gene_ids >> np.uint64(6), np.uint64(1) << (gene_ids & np.uint64(63)))
+            self.sizes[row] = int(_popcount(self.bits[row]).sum())
+        return row
+
+    def add(self, condition, gene):
+        row = self.condition_ids[condition]
+        gene_id = self._gene_id(gene)
+        word, bit = divmod(gene_id, 64)
+        mask = np.uint64(1) << np.uint64(bit)
+        if not self.bits[row, word] & mask:
+            self.bits[row, word] |= mask
+            self.sizes[row] += 1
+            self.index.add(condition, gene)
+
+    def discard(self, condition, gene):
+        row = self.condition_ids[condition]
+        gene_id = self.gene_ids.get(gene)
+        if gene_id is None:
+            return
+        word, bit = divmod(gene_id, 64)
+        mask = np.uint64(1) << np.uint64(bit)
+        if self.bits[row, word] & mask:
+            self.bits[row, word] &= ~mask
+            self.sizes[row] -= 1
+            self.index.discard(condition, gene)
+
+    # ---Mapping interface, like the dict of sets
+
+    def __getitem__(self, condition):
+        return self._to_genes(self.row(condition))
+
+    def __iter__(self):
+        return iter(self.conditions)
+
+    def __len__(self):
+        return len(self.conditions)
+
+    def row(self, condition):
+        # the bitset of one condition (a view)
+        return self.bits[self.condition_ids[condition]]
+
+    def contains(self, condition, gene):
+        # same as gene in gene_sets[condition]
+        gene_id = self.gene_ids.get(gene)
+        if gene_id is None:
+            return False
+        return bool(self.row(condition)[gene_id // 64] >> np.uint64(gene_id % 64) & np.uint64(1))
+
+    def conditions_of(self, gene):
+        # every condition the gene is in, from the inverted index
+        return self.index.conditions_of(gene)
+
+    def batch_conditions_of(self, genes):
+        return self.index.batch(genes)
+
+    def _to_genes(self, words):
+        gene_ids = np.flatnonzero(np.unpackbits(words.view(np.uint8), bitorder='little'))
+        return {self.genes[i] for i in gene_ids.tolist()}
+
+    # ---Algebra on two sets
+
+    def union(self, a, b):
+        return self._to_genes(self.row(a) | self.row(b))
+
+    def intersection(self, a, b):
+        return self._to_genes(self.row(a) & self.row(b))
+
+    def difference(self, a, b):
+        return self._to_genes(self.row(a) & ~self.row(b))
+
+    def issubset(self, a, b):
+        return not np.any(self.row(a) & ~self.row(b))
+
+    # ---All pairs at once, as matrices (rows and columns in the order of self.conditions)
+
+    def intersection_sizes(self):
+        # [i, j] = |condition i & condition j|
+        n = len(self.conditions)
+        bits = self.bits[:n]
+        sizes = np.zeros((n, n), dtype=np.int64)
+        step = max(1, _BLOCK_BYTES // max(1, bits.nbytes))
+        for start in range(0, n, step):
+            # the matrix is symmetric: each block only goes right of the diagonal, then is mirrored
+            stop = min(start + step, n)
+            block = bits[start:stop, None, :] & bits[None, start:, :]
+            sizes[start:stop, start:] = _popcount(block).sum(axis=2, dtype=np.int64)
+            sizes[start:, start:stop] = sizes[start:stop, start:].T
+        return sizes
+
+    def union_sizes(self, intersection=None):
+        intersection = self.intersection_sizes() if intersection is None else intersection
+        sizes = self.sizes[:len(self.conditions)]
+        return sizes[:, None] + sizes[None, :] - intersection
+
+    def difference_sizes(self, intersection=None):
+        # [i, j] = |condition i - condition j|
+        intersection = self.intersection_sizes() if intersection is None else intersection
+        return self.sizes[:len(self.conditions), None] - intersection
+
+    def subset_matrix(self, intersection=None):
+        # [i, j] is True when condition i is a subset of condition j (including i == j)
+        intersection = self.intersection_sizes() if intersection is None else intersection
+        return intersection == self.sizes[:len(self.conditions), None]
+
+    def jaccard_matrix(self, intersection=None):
+        # |A & B| / |A | B|, 0 where both sets are empty
+        intersection = self.intersection_sizes() if intersection is None else intersection
+        union = self.union_sizes(intersection)
+        return np.where(union > 0, intersection / np.maximum(union, 1), 0.0)
+
+
+if __name__ == '__main__':
+    import sys
+    import time
+
+    gene_sets = GeneSets({
+        'arsenic': {1, 2, 3, 4, 5, 6, 8, 12},
+        'lead': {2, 4, 6, 12},
+        'mercury': {7, 6, 4, 10, 8},
+        'nickel': {2, 3, 4, 5, 1}
+    })
+    print(3 in gene_sets['arsenic'], gene_sets.contains('arsenic', 3))
+    subset = gene_sets.subset_matrix()
+    for i, condition1 in enumerate(gene_sets.conditions):
+        for j, condition2 in enumerate(gene_sets.conditions):
+            if subset[i, j] and i != j:
+                print(condition1 + ' is a subset of ' + condition2)
+    print(gene_sets.jaccard_matrix().round(2))
+    print(gene_sets.conditions_of(5), gene_sets.batch_conditions_of([4, 7, 99]))
+
+    # 20k genes, a few thousand conditions
+    n_conditions = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    rng = np.random.default_rng(0)
+    big = GeneSets()
+    for c in range(n_conditions):
+        big.add_condition(c, rng.choice(20_000, rng.integers(10, 2000), replace=False).tolist())
+    start = time.perf_counter()
+    intersection = big.intersection_sizes()
+    subset = big.subset_matrix(intersection)
+    jaccard = big.jaccard_matrix(intersection)
+    print('{} x {} pairs in {:.2f}s'.format(n_conditions, n_conditions, time.perf_counter() - start))
+
+    # reverse lookups: the index against scanning every set
+    queries = rng.integers(0, 20_000, 5000).tolist()
+    start = time.perf_counter()
+    answers = big.batch_conditions_of(queries)
+    indexed = time.perf_counter() - start
+    plain = {condition: big[condition] for condition in big}
+    start = time.perf_counter()
+    scanned = [{c for c, genes in plain.items() if gene in genes} for gene in queries[:500]]
+    scanning = (time.perf_counter() - start) * len(queries) / 500
+    assert scanned == answers[:500]
+    print('{} reverse lookups: {:.3f}s indexed, ~{:.1f}s scanning'.format(len(queries), indexed, scanning))
@@ -0,0 +1,411 @@
+#----------------- Streaming k-mer counting ------------------------#
+
+# The kmer2count loop makes a string slice and a dict lookup at every position
+# Here: the same counts, but
+#   - bases are turned into 2-bit codes with a lookup table (N and friends are skipped)
+#   - every window of k bases becomes one integer, computed for a whole chunk at once
+#   - counts live in a flat array (small k) or in sorted code/count arrays (large k)
+#     so memory depends on the number of distinct k-mers, not on Python objects
+# Speed comes from keeping the arrays small enough for the CPU cache
+#   - bases are encoded by bytes.translate, in C
+#   - k-mer codes are computed _BLOCK bases at a time, in the narrowest integers that hold them
+#   - dense: each block of codes is counted straight away into 32-bit counters
+#   - sparse: new codes are sorted and merged into the table in bulk, once at least as many
+#     are waiting as the table holds, so the merges cost a constant amount per k-mer read
+#   - big merges are cut into pieces that are merged one at a time
+# On one core that is about 150-200 Mb/s for k <= 8, 60-100 Mb/s for k = 11
+# and 15-25 Mb/s for k = 21 on random sequence
+#   - the dense table is bounded by np.add.at: 4 ns per k-mer in the cache,
+#     6-14 ns once the table is bigger than the cache (k >= 10)
+#   - the sparse table is bounded by sorting: every k-mer is sorted once on arrival and
+#     again in each merge, about 10 ns each in NumPy
+#   - random sequence is the worst case (every 21-mer new), real genomes repeat k-mers
+#   - kmer_count_parallel.py spreads the counting over several cores
+
+import numpy as np
+
+from fasta import iter_sequence_chunks
+from kmers import BASES, code_dtype, codes_to_kmers, decode_kmer, encode_kmer
+
+
+INVALID = 4
+
+# byte -> 2-bit code, upper and lower case, everything else is INVALID
+BASE_LUT = np.full(256, INVALID, dtype=np.uint8)
+for _code, _base in enumerate(BASES):
+    BASE_LUT[ord(_base)] = _code
+    BASE_LUT[ord(_base.lower())] = _code
+_BASE_TABLE = BASE_LUT.tobytes()
+
+# Largest k counted in a flat 4^k array by default (4^12 = 16M counters)
+DENSE_MAX_K = 12
+
+# Bases turned into k-mer codes (and counted, when dense) at a time
+_BLOCK = 1 << 16
+# k-mers a dense table takes in before its counters are widened to 64 bits
+_DENSE_ROOM = 2 ** 32 - 1
+# How many k-mer codes to collect before folding them into the table (at least)
+_SPARSE_BUFFER = 1 << 24
+# Rows of each table merged at a time
+_MERGE_BLOCK = 1 << 16
+
+
+def encode_bases(sequence):
+    # str/bytes -> uint8 array of codes, INVALID where the base is not ATGC
+    #   - bytes.translate runs the lookup in C, several times faster than indexing BASE_LUT
+    if isinstance(sequence, str):
+        sequence = sequence.encode('ascii')
+    if isinstance(sequence, (bytes, bytearray)):
+        return np.frombuffer(sequence.translate(_BASE_TABLE), dtype=np.uint8)
+    return BASE_LUT[np.frombuffer(sequence, dtype=np.uint8)]
+
+
+def _narrowest(length):
+    # smallest unsigned type holding a window of length bases
+    return np.uint8 if length <= 4 else np.uint16 if length <= 8 else np.uint32 if length <= 16 else np.uint64
+
+
+def _window_codes(codes, k):
+    # Code of every length-k window, built from power-of-two windows
+    #   - log2(k) passes over the chunk instead of k
+    #   - every power-of-two window is kept in the narrowest type that holds it,
+    #     a SIMD register holds 4x more 8-bit codes than 32-bit ones
+    n = len(codes)
+    dtype = np.uint32 if k <= 16 else np.uint64
+    if n < k:
+        return np.zeros(0, dtype=dtype)
+    power = codes
+    power_length = 1
+    result = None
+    result_length = 0
+    remaining = k
+    while True:
+        if remaining & 1:
+            if result is None:
+                result = power.astype(dtype, copy=remaining > 1)
+            else:
+                m = n - result_length - power_length + 1
+                result = result[:m]
+                result <<= dtype(2 * power_length)
+                result |= power[result_length:result_length + m]
+            result_length += power_length
+        remaining >>= 1
+        if not remaining:
+            return result
+        m = n - 2 * power_length + 1
+        wide = _narrowest(2 * power_length)
+        doubled = power[:m].astype(wide)
+        doubled <<= wide(2 * power_length)
+        doubled |= power[power_length:power_length + m]
+        power = doubled
+        power_length *= 2
+
+
+def kmer_codes_in(codes, k, canonical=False, return_positions=False):
+    # All valid k-mer codes of an encoded chunk, in order of position
+    #   - windows that contain an INVALID base are dropped
+    #   - canonical=True keeps min(k-mer, reverse complement)
+    #   - return_positions=True also returns the start of every window kept
+    if len(codes) > 2 * _BLOCK:
+        # block by block (overlapping by k-1 bases): several times faster than one pass
+        # over a chunk too big for the cache
+        starts = range(0, len(codes) - k + 1, _BLOCK)
+        blocks = [_kmer_codes_in(codes[start:start + _BLOCK + k - 1], k, canonical, return_positions)
+                  for start in starts]
+        if not return_positions:
+            return np.concatenate(blocks)
+        return (np.concatenate([kmer_codes for kmer_codes, _ in blocks]),
+                np.concatenate([positions + start for (_, positions), start in zip(blocks, starts)]))
+    return _kmer_codes_in(codes, k, canonical, return_positions)
+
+
+def _kmer_codes_in(codes, k, canonical, return_positions):
+    invalid = codes == INVALID
+    has_invalid = invalid.any()
+    clean = np.where(invalid, np.uint8(0), codes) if has_invalid else codes
+    forward = _window_codes(clean, k)
+    if canonical and len(forward):
+        # complement is code ^ 1 (see kmers.py), read backwards for the reverse strand
+        reverse = _window_codes((clean ^ np.uint8(1))[::-1], k)[::-1]
+        np.minimum(forward, reverse, out=forward)
+    if has_invalid and len(forward):
+        bad = np.concatenate(([0], np.cumsum(invalid, dtype=np.int64)))
+        keep = bad[k:] == bad[:-k]
+        if return_positions:
+            return forward[keep], np.flatnonzero(keep)
+        return forward[keep]
+    if return_positions:
+        return forward, np.arange(len(forward))
+    return forward
+
+
+def unique_counts(codes):
+    # np.unique(codes, return_counts=True) via one sort
+    if not len(codes):
+        return codes, np.zeros(0, dtype=np.uint64)
+    return _count_runs(np.sort(codes))
+
+
+def _count_runs(codes):
+    # sorted codes -> each code once, with the length of its run
+    #   - scanned _MERGE_BLOCK codes at a time (cut where runs start), so the temporaries
+    #     stay in the cache
+    cuts = np.searchsorted(codes, codes[_MERGE_BLOCK::_MERGE_BLOCK])
+    bounds = np.unique(np.concatenate(([0], cuts, [len(codes)])))
+    pieces = []
+    for start, stop in zip(bounds[:-1].tolist(), bounds[1:].tolist()):
+        piece = codes[start:stop]
+        first = np.empty(len(piece), dtype=bool)
+        first[0] = True
+        np.not_equal(piece[1:], piece[:-1], out=first[1:])
+        if first.all():
+            pieces.append((piece, np.ones(len(piece), dtype=np.uint64)))
+        else:
+            starts = np.flatnonzero(first)
+            pieces.append((piece[starts], np.diff(starts, append=len(piece)).astype(np.uint64)))
+    if len(pieces) == 1:
+        return pieces[0]
+    return np.concatenate([piece for piece, _ in pieces]), np.concatenate([counts for _, counts in pieces])
+
+
+def canonical_kmer(kmer):
+    code = encode_kmer(kmer)
+    k = len(kmer)
+    reverse = 0
+    for i in range(k):
+        reverse = (reverse << 2) | (((code >> (2 * i)) & 3) ^ 1)
+    return decode_kmer(min(code, reverse), k)
+
+
+def _merge_runs(runs):
+    # Sum any number of sorted (codes, counts) tables into one
+    nonempty = [run for run in runs if len(run[0])]
+    if len(nonempty) <= 1:
+        return nonempty[0] if nonempty else runs[0]
+    runs = nonempty
+    all_codes = np.concatenate([codes for codes, _ in runs])
+    all_counts = np.concatenate([counts for _, counts in runs])
+    low = min(int(codes[0]) for codes, _ in runs)
+    high = max(int(codes[-1]) for codes, _ in runs)
+    index_bits = max(1, (len(all_codes) - 1).bit_length())
+    if (high - low).bit_length() + index_bits <= 64:
+        # code and index packed into one uint64: sorting the keys is then an argsort,
+        # several times faster than np.argsort (the stable sort merges the sorted runs)
+        keys = all_codes.astype(np.uint64)
+        keys -= np.uint64(low)
+        keys <<= np.uint64(index_bits)
+        keys |= np.arange(len(keys), dtype=np.uint64)
+        keys.sort(kind='stable')
+        order = (keys & np.uint64((1 << index_bits) - 1)).astype(np.intp)
+        keys >>= np.uint64(index_bits)
+        keys += np.uint64(low)
+        all_codes = keys.astype(all_codes.dtype, copy=False)
+    else:
+        order = np.argsort(all_codes, kind='stable')
+        all_codes = all_codes[order]
+    return _sum_equal(all_codes, all_counts[order])
+
+
+def _sum_equal(codes, counts):
+    # sorted codes with repeats -> each code once, with its counts summed
+    first = np.concatenate(([True], codes[1:] != codes[:-1]))
+    starts = np.flatnonzero(first)
+    summed = counts[starts]
+    if len(starts) < len(codes):
+        # np.add.reduceat is slow when most groups have one member, so only repeats are added
+        repeats = np.flatnonzero(~first)
+        np.add.at(summed, np.searchsorted(starts, repeats, side='right') - 1, counts[repeats])
+    return codes[starts], summed
+
+
+def merge_counts(codes_a, counts_a, codes_b, counts_b):
+    # Sum two sorted (codes, counts) tables into one
+    if not len(codes_a):
+        return codes_b, counts_b
+    if not len(codes_b):
+        return codes_a, counts_a
+    if len(codes_a) + len(codes_b) <= 4 * _MERGE_BLOCK:
+        return _merge_runs([(codes_a, counts_a), (codes_b, counts_b)])
+    # big tables: cut both at the same codes and merge piece by piece, each in the cache
+    cuts = np.sort(np.concatenate((codes_a[_MERGE_BLOCK::_MERGE_BLOCK], codes_b[_MERGE_BLOCK::_MERGE_BLOCK])))
+    bounds_a = np.concatenate(([0], np.searchsorted(codes_a, cuts), [len(codes_a)]))
+    bounds_b = np.concatenate(([0], np.searchsorted(codes_b, cuts), [len(codes_b)]))
+    pieces = [_merge_runs([(codes_a[a0:a1], counts_a[a0:a1]), (codes_b[b0:b1], counts_b[b0:b1])])
+              for a0, a1, b0, b1 in zip(bounds_a[:-1], bounds_a[1:], bounds_b[:-1], bounds_b[1:])
+              if a1 > a0 or b1 > b0]
+    return np.concatenate([codes for codes, _ in pieces]), np.concatenate([counts for _, counts in pieces])
+
+
+class KmerCounter:
+
+    def __init__(self, k, canonical=False, dense=None):
+        if not 1 <= k <= 32:
+            raise ValueError('k must be between 1 and 32')
+        self.k = k
+        self.canonical = canonical
+        self.dense = k <= DENSE_MAX_K if dense is None else dense
+        self.bases_read = 0
+        self._tail = np.zeros(0, dtype=np.uint8)
+        # dense: every block of k-mer codes is counted while it is still in the cache
+        #   - 32-bit counters (half the table to miss in) until 2^32 k-mers have gone in
+        # sparse: k-mer codes wait in a buffer and are folded into the table in bulk,
+        #   one sort and merge per _SPARSE_BUFFER k-mers, or per table size once the
+        #   table is bigger, so that the merges do not add up to O(n^2)
+        self._buffer = []
+        self._buffered = 0
+        if self.dense:
+            self._room = _DENSE_ROOM
+            self._counts = np.zeros(4 ** k, dtype=np.uint32)
+        else:
+            self._buffer_limit = _SPARSE_BUFFER
+            self._codes = np.zeros(0, dtype=np.uint32 if k <= 16 else np.uint64)
+            self._counts = np.zeros(0, dtype=np.uint64)
+
+    @classmethod
+    def from_counts(cls, k, codes, counts, canonical=False, dense=None):
+        # counter holding an existing sorted (codes, counts) table
+        counter = cls(k, canonical, dense)
+        if counter.dense:
+            counter._widen(int(counts.sum()))
+            counter._counts[codes.astype(np.int64)] = counts
+        else:
+            counter._codes = codes.astype(counter._codes.dtype)
+            counter._counts = counts.astype(np.uint64)
+        return counter
+
+    # ---Feeding sequence in
+
+    def update(self, chunk, new_record=True):
+        # new_record=False carries the last k-1 bases over from the previous chunk
+        codes = encode_bases(chunk)
+        self.bases_read += len(codes)
+        if not new_record and len(self._tail):
+            codes = np.concatenate((self._tail, codes))
+        self._tail = codes[len(codes) - self.k + 1:] if len(codes) >= self.k else codes
+        if self.dense:
+            for start in range(0, len(codes) - self.k + 1, _BLOCK):
+                kmer_codes = _kmer_codes_in(codes[start:start + _BLOCK + self.k - 1], self.k, self.canonical, False)
+                self._widen(len(kmer_codes))
+                np.add.at(self._counts, kmer_codes, self._counts.dtype.type(1))
+            return self
+        kmer_codes = kmer_codes_in(codes, self.k, self.canonical)
+        if len(kmer_codes):
+            self._buffer.append(kmer_codes)
+            self._buffered += len(kmer_codes)
+            if self._buffered >= self._buffer_limit:
+                self._flush()
+        return self
+
+    def update_chunks(self, chunks):
+        for new_record, chunk in chunks:
+            self.update(chunk, new_record)
+        return self
+
+    def count_file(self, source, chunk_size=None):
+        if chunk_size is None:
+            return self.update_chunks(iter_sequence_chunks(source))
+        return self.update_chunks(iter_sequence_chunks(source, chunk_size))
+
+    def _flush(self):
+        if not self._buffer:
+            return
+        codes = np.concatenate(self._buffer) if len(self._buffer) > 1 else self._buffer[0]
+        self._buffer = []
+        self._buffered = 0
+        # the buffered codes are ours, so they are sorted in place
+        codes.sort()
+        new_codes, new_counts = _count_runs(codes)
+        self._codes, self._counts = merge_counts(self._codes, self._counts, new_codes, new_counts)
+        self._buffer_limit = max(_SPARSE_BUFFER, len(self._codes))
+
+    def _widen(self, added):
+        # switch the dense table to 64-bit counters before any could overflow
+        self._room -= added
+        if self._room < 0 and self._counts.dtype != np.uint64:
+            self._counts = self._counts.astype(np.uint64)
+
+    def merge(self, other):
+        # add the counts of another counter with the same settings
+        if (other.k, other.canonical) != (self.k, self.canonical):
+            raise ValueError('can only merge counters with the same k and canonical setting')
+        self.bases_read += other.bases_read
+        codes, counts = other.codes_and_counts()
+        self._flush()
+        if self.dense:
+            self._widen(int(counts.sum()))
+            self._counts[codes] += counts.astype(self._counts.dtype)
+        else:
+            self._codes, self._counts = merge_counts(self._codes, self._counts, codes.astype(self._codes.dtype), counts)
+        return self
+
+    # ---Getting counts out
+
+    def codes_and_counts(self):
+        # (sorted k-mer codes, counts) of every k-mer seen at least once
+        self._flush()
+        if self.dense:
+            codes = np.flatnonzero(self._counts)
+            return codes.astype(code_dtype(self.k)), self._counts[codes].astype(np.uint64)
+        return self._codes.astype(code_dtype(self.k)), self._counts
+
+    def __getitem__(self, kmer):
+        code = encode_kmer(canonical_kmer(kmer) if self.canonical else kmer)
+        self._flush()
+        if self.dense:
+            return int(self._counts[code])
+        i = np.searchsorted(self._codes, code)
+        if i < len(self._codes) and self._codes[i] == code:
+            return int(self._counts[i])
+        return 0
+
+    def __len__(self):
+        # number of distinct k-mers
+        self._flush()
+        if self.dense:
+            return int(np.count_nonzero(self._counts))
+        return len(self._codes)
+
+    def total(self):
+        self._flush()
+        return int(self._counts.sum())
+
+    def items(self):
+        codes, counts = self.codes_and_counts()
+        for kmer, count in zip(codes_to_kmers(codes, self.k), counts):
+            yield kmer.decode('ascii'), int(count)
+
+    def to_dict(self):
+        # same shape as kmer2count, keys in upper case
+        return dict(self.items())
+
+
+def count_kmers(sequence, k, canonical=False, dense=None):
+    return KmerCounter(k, canonical, dense).update(sequence)
+
+
+def count_kmers_file(source, k, canonical=False, dense=None):
+    # source is a FASTA path (plain or .gz) or an open FASTA file
+    return KmerCounter(k, canonical, dense).count_file(source)
+
+
+if __name__ == '__main__':
+    import sys
+    import time
+
+    # Same answer as the kmer2count loop
+    dna = 'aattggaattggaattg'
+    print(count_kmers(dna, 4).to_dict())
+
+    # Throughput on random sequence
+    size = int(sys.argv[1]) if len(sys.argv) > 1 else 50_000_000
+    rng = np.random.default_rng(0)
+    genome = np.frombuffer(b'ACGT', dtype=np.uint8)[rng.integers(0, 4, size)].tobytes()
+    for k, canonical in [(11, False), (21, False), (21, True)]:
+        counter = KmerCounter(k, canonical)
+        start = time.perf_counter()
+        for offset in range(0, size, 1 << 22):
+            counter.update(genome[offset:offset + (1 << 22)], new_record=offset == 0)
+        counter.codes_and_counts()
+        elapsed = time.perf_counter() - start
+        print('k={} canonical={}: {:.0f} Mb/s, {} distinct'.format(
+            k, canonical, size / elapsed / 1e6, len(counter)))
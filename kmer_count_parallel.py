@@ -0,0 +1,176 @@
+#----------------- K-mer counting on several cores ------------------------#
+
+# The kmer2count loop (and KmerCounter) use one core
+# Here: the input is cut into pieces and counted by a process pool
+#   - each piece carries the last k-1 bases of the previous one, so no k-mer is lost
+#     and none is counted twice
+#   - every worker task returns a partial (codes, counts) table
+#   - partial tables are merged pairwise by the same pool as they come back: a table waits
+#     until another one of the same level (number of batches in it) turns up, like the
+#     carries of a binary counter, so at most one table per level is kept at a time
+#   - only a few tasks are handed out at a time, so the input is read as fast as it is
+#     counted, not ahead of it
+# Memory grows with the number of distinct k-mers, not with the size of the input
+# The result is exactly what the serial KmerCounter gives
+
+import os
+from collections import deque
+from multiprocessing import Pool
+
+import numpy as np
+
+from fasta import iter_sequence_chunks
+from kmer_count import KmerCounter, merge_counts
+
+
+DEFAULT_BATCH_SIZE = 1 << 26  # bases counted by one worker task
+
+
+def iter_overlapping_pieces(chunks, k):
+    # (new_record, chunk) pairs -> independent pieces of sequence
+    #   - a piece repeats the last k-1 bases of the previous piece of the same record
+    #   - pieces too short to hold a k-mer are folded into the next one
+    tail = b''
+    for new_record, chunk in chunks:
+        if isinstance(chunk, str):
+            chunk = chunk.encode('ascii')
+        if new_record:
+            tail = b''
+        piece = tail + chunk if tail else chunk
+        if len(piece) >= k:
+            yield piece
+        tail = piece[len(piece) - k + 1:] if len(piece) >= k else piece
+
+
+def iter_batches(pieces, batch_size):
+    # group pieces into lists of roughly batch_size bases, one list per worker task
+    batch = []
+    batch_bases = 0
+    for piece in pieces:
+        batch.append(piece)
+        batch_bases += len(piece)
+        if batch_bases >= batch_size:
+            yield batch
+            batch = []
+            batch_bases = 0
+    if batch:
+        yield batch
+
+
+def _source_chunks(sources, chunk_size, bases_read):
+    # bases_read is a one-item list, so the total is known once the chunks run out
+    if isinstance(sources, (str, bytes, os.PathLike)) or hasattr(sources, 'read'):
+        sources = [sources]
+    for source in sources:
+        for new_record, chunk in iter_sequence_chunks(source, chunk_size):
+            bases_read[0] += len(chunk)
+            yield new_record, chunk
+
+
+def _count_batch(task):
+    batch, k, canonical, dense = task
+    counter = KmerCounter(k, canonical, dense)
+    for piece in batch:
+        counter.update(piece)
+    return counter.codes_and_counts()
+
+
+def _merge_pair(pair):
+    (codes_a, counts_a), (codes_b, counts_b) = pair
+    return merge_counts(codes_a, counts_a, codes_b, counts_b)
+
+
+def tree_reduce(partials, pool=None):
+    # merge partial tables pairwise until one is left
+    while len(partials) > 1:
+        pairs = [(partials[i], partials[i + 1]) for i in range(0, len(partials) - 1, 2)]
+        leftover = partials[-1:] if len(partials) % 2 else []
+        merged = pool.map(_merge_pair, pairs) if pool is not None and len(pairs) > 1 else list(map(_merge_pair, pairs))
+        partials = merged + leftover
+    return partials[0]
+
+
+def reduce_as_done(tasks, pool=None, window=2):
+    # count every task and merge the partial tables into one (None if there were no tasks)
+    #   - at most window tasks (counts and merges) are out on the pool at any time
+    waiting = {}  # level -> table waiting for a partner
+    in_flight = deque()  # (level, AsyncResult), oldest first
+
+    def submit(function, argument, level):
+        if pool is None:
+            settle(level, function(argument))
+        else:
+            in_flight.append((level, pool.apply_async(function, (argument,))))
+
+    def settle(level, table):
+        if level in waiting:
+            submit(_merge_pair, (waiting.pop(level), table), level + 1)
+        else:
+            waiting[level] = table
+
+    def collect_oldest():
+        level, result = in_flight.popleft()
+        settle(level, result.get())
+
+    for task in tasks:
+        while len(in_flight) >= window:
+            collect_oldest()
+        submit(_count_batch, task, 0)
+    while in_flight:
+        collect_oldest()
+    if not waiting:
+        return None
+    return tree_reduce([waiting[level] for level in sorted(waiting)], pool)
+
+
+def count_kmers_parallel(sources, k, canonical=False, processes=None, dense=None,
+                         batch_size=DEFAULT_BATCH_SIZE, chunk_size=1 << 22):
+    # sources: one FASTA path / open file, or a list of them
+    # processes=1 counts in this process, without a pool
+    processes = processes or os.cpu_count() or 1
+    bases_read = [0]
+    pieces = iter_overlapping_pieces(_source_chunks(sources, chunk_size, bases_read), k)
+    tasks = ((batch, k, canonical, dense) for batch in iter_batches(pieces, batch_size))
+    pool = Pool(processes) if processes > 1 else None
+    try:
+        table = reduce_as_done(tasks, pool, 2 * processes)
+        codes, counts = table if table is not None else KmerCounter(k, canonical, dense).codes_and_counts()
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+    counter = KmerCounter.from_counts(k, codes, counts, canonical, dense)
+    counter.bases_read = bases_read[0]
+    return counter
+
+
+if __name__ == '__main__':
+    import sys
+    import tempfile
+    import time
+
+    # Scaling benchmark: the same random genome counted on 1..N cores
+    #   - a random genome has about one distinct 21-mer per base, so the counts table alone
+    #     is 16 bytes per base: the default 20 Mb fits in well under 2 GB
+    size = int(sys.argv[1]) if len(sys.argv) > 1 else 20_000_000
+    max_processes = int(sys.argv[2]) if len(sys.argv) > 2 else os.cpu_count() or 1
+    k = 21
+    rng = np.random.default_rng(0)
+    genome = np.frombuffer(b'ACGT', dtype=np.uint8)[rng.integers(0, 4, size)].tobytes()
+    path = os.path.join(tempfile.mkdtemp(), 'random.fa')
+    with open(path, 'wb') as handle:
+        for record in range(4):
+            handle.write(b'>record' + str(record).encode() + b'\n')
+            part = genome[record * size // 4:(record + 1) * size // 4]
+            for start in range(0, len(part), 80):
+                handle.write(part[start:start + 80] + b'\n')
+
+    baseline = None
+    for processes in range(1, max_processes + 1):
+        start = time.perf_counter()
+        counter = count_kmers_parallel(path, k, processes=processes, batch_size=size // (8 * processes) + 1)
+        elapsed = time.perf_counter() - start
+        baseline = baseline or elapsed
+        print('{} processes: {:.2f}s, {:.0f} Mb/s, speed-up {:.2f}x, {} distinct'.format(
+            processes, elapsed, size / elapsed / 1e6, baseline / elapsed, len(counter)))
+    os.remove(path)
@@ -0,0 +1,174 @@
+#----------------- Positional k-mer index ------------------------#
+
+# kmer2list keeps every start position as a Python int inside a growing list
+# Here: the same mapping in three flat arrays (CSR layout)
+#   - codes:     sorted k-mer codes that occur at least once
+#   - offsets:   positions of codes[i] are positions[offsets[i]:offsets[i + 1]]
+#   - positions: all start positions, grouped by k-mer and ascending inside each group
+# For small k the codes array is skipped and offsets has one slot per possible k-mer
+#   - looking up a k-mer is then a single array index
+# Counts come straight from the offsets: count = offsets[i + 1] - offsets[i]
+
+import numpy as np
+
+from arrayfile import load_arrays, save_arrays
+from fasta import iter_sequence_chunks
+from kmer_count import DENSE_MAX_K, encode_bases, kmer_codes_in
+from kmers import code_dtype, codes_to_kmers, encode_kmer
+
+
+class KmerIndex:
+
+    def __init__(self, k, offsets, positions, codes=None, record_starts=None):
+        self.k = k
+        self.offsets = offsets
+        self.positions = positions
+        # codes is None for the dense layout
+        self.codes = codes
+        # start of every record in the concatenated coordinates
+        self.record_starts = np.zeros(1, dtype=np.int64) if record_starts is None else record_starts
+
+    # ---Building
+
+    @classmethod
+    def build(cls, sequence, k, dense=None):
+        return cls.build_chunks([(True, sequence)], k, dense)
+
+    @classmethod
+    def build_file(cls, source, k, dense=None):
+        # positions of a multi-FASTA file are counted across all records
+        #   - locate() turns them back into (record number, offset)
+        return cls.build_chunks(iter_sequence_chunks(source), k, dense)
+
+    @classmethod
+    def build_chunks(cls, chunks, k, dense=None):
+        # One pass over the input, then one stable sort by k-mer code
+        dense = k <= DENSE_MAX_K if dense is None else dense
+        all_codes = []
+        all_positions = []
+        record_starts = []
+        tail = np.zeros(0, dtype=np.uint8)
+        seen = 0
+        for new_record, chunk in chunks:
+            codes = encode_bases(chunk)
+            if new_record:
+                record_starts.append(seen)
+                tail = tail[:0]
+            window_start = seen - len(tail)
+            codes = np.concatenate((tail, codes)) if len(tail) else codes
+            tail = codes[len(codes) - k + 1:] if len(codes) >= k else codes
+            seen = window_start + len(codes)
+            kmer_codes, starts = kmer_codes_in(codes, k, return_positions=True)
+            all_codes.append(kmer_codes)
+            all_positions.append(starts + window_start)
+        codes = np.concatenate(all_codes) if all_codes else np.zeros(0, dtype=np.uint64)
+        positions = np.concatenate(all_positions) if all_positions else np.zeros(0, dtype=np.int64)
+        order = np.argsort(codes, kind='stable')
+        codes = codes[order]
+        positions = positions[order].astype(np.uint32 if seen < 2 ** 32 else np.uint64)
+        record_starts = np.array(record_starts or [0], dtype=np.int64)
+        if dense:
+            # the slot range is int64: 4 ** k + 1 does not fit the code dtype (uint8 at k=4, uint32 at k=16)
+            slots = np.arange(4 ** k + 1, dtype=np.int64)
+            offsets = np.searchsorted(codes.astype(np.int64), slots).astype(np.int64)
+            return cls(k, offsets, positions, None, record_starts)
+        starts = np.flatnonzero(np.concatenate(([True], codes[1:] != codes[:-1]))) if len(codes) else order
+        offsets = np.append(starts, len(codes)).astype(np.int64)
+        return cls(k, offsets, positions, codes[starts].astype(code_dtype(k)), record_starts)
+
+    # ---Saving and loading
+
+    def save(self, path):
+        arrays = {'offsets': self.offsets, 'positions': self.positions, 'record_starts': self.record_starts}
+        if self.codes is not None:
+            arrays['codes'] = self.codes
+        save_arrays(path, arrays, {'kind': 'kmer_index', 'k': self.k})
+
+    @classmethod
+    def load(cls, path, mmap=True):
+        # with mmap=True loading is instant and pages are shared between processes
+        arrays, meta = load_arrays(path, mmap)
+        if meta.get('kind') != 'kmer_index':
+            raise ValueError(str(path) + ' is not a k-mer index')
+        return cls(meta['k'], arrays['offsets'], arrays['positions'], arrays.get('codes'), arrays['record_starts'])
+
+    # ---Queries
+
+    def _slot(self, kmer):
+        # row of the CSR table for a k-mer, or None if it never occurs
+        if len(kmer) != self.k:
+            raise ValueError(repr(kmer) + ' is not a k-mer of length ' + str(self.k))
+        code = encode_kmer(kmer)
+        if self.codes is None:
+            return code
+        i = int(np.searchsorted(self.codes, code))
+        if i < len(self.codes) and self.codes[i] == code:
+            return i
+        return None
+
+    def __getitem__(self, kmer):
+        # start positions of a k-mer, same as kmer2list.get(kmer, [])
+        i = self._slot(kmer)
+        if i is None:
+            return self.positions[:0]
+        return self.positions[self.offsets[i]:self.offsets[i + 1]]
+
+    def __contains__(self, kmer):
+        try:
+            return self.count(kmer) > 0
+        except ValueError:
+            return False
+
+    def count(self, kmer):
+        i = self._slot(kmer)
+        if i is None:
+            return 0
+        return int(self.offsets[i + 1] - self.offsets[i])
+
+    def __len__(self):
+        # number of distinct k-mers
+        if self.codes is None:
+            return int(np.count_nonzero(np.diff(self.offsets)))
+        return len(self.codes)
+
+    def codes_and_counts(self):
+        counts = np.diff(self.offsets)
+        if self.codes is None:
+            codes = np.flatnonzero(counts)
+            return codes.astype(code_dtype(self.k)), counts[codes]
+        return self.codes, counts
+
+    def counts(self):
+        # same as {kmer: len(start) for kmer, start in kmer2list.items()}
+        codes, counts = self.codes_and_counts()
+        return {kmer.decode('ascii'): int(count)
+                for kmer, count in zip(codes_to_kmers(codes, self.k), counts)}
+
+    def to_dict(self):
+        # back to the kmer2list dict of lists (only sensible for small inputs)
+        codes, counts = self.codes_and_counts()
+        # dense rows are the codes, as int64 so that rows + 1 does not wrap in the code dtype
+        rows = codes.astype(np.int64) if self.codes is None else range(len(codes))
+        return {kmer.decode('ascii'): self.positions[self.offsets[i]:self.offsets[i + 1]].tolist()
+                for kmer, i in zip(codes_to_kmers(codes, self.k), rows)}
+
+    def locate(self, positions):
+        # concatenated positions -> (record numbers, offsets within the record)
+        positions = np.asarray(positions, dtype=np.int64)
+        records = np.searchsorted(self.record_starts, positions, side='right') - 1
+        return records, positions - self.record_starts[records]
+
+
+if __name__ == '__main__':
+    import os
+    import tempfile
+
+    dna = 'aattggaattggaattg'
+    index = KmerIndex.build(dna, 4)
+    print(index.to_dict())
+    print(index.counts())
+
+    path = os.path.join(tempfile.mkdtemp(), 'example.kidx')
+    index.save(path)
+    loaded = KmerIndex.load(path)
+    print(loaded['AATT'], loaded.count('GGAA'))
@@ -0,0 +1,184 @@
+#----------------- K-mer enumeration ------------------------#
+
+# generate_kmers / generate_kmers_rec build the whole list of 4^k strings
+#   - k=12 is already 16M string objects
+# Here: the k-mer space is treated like a range() of integers instead
+#   - every k-mer is a base-4 number, 2 bits per base
+#   - nothing is built until it is asked for
+
+from itertools import product
+
+import numpy as np
+
+
+# Same base order as generate_kmers, so the i-th k-mer here is the i-th k-mer there
+#   - A=0, T=1, G=2, C=3
+#   - complements differ only in the lowest bit (A<->T is 0<->1, G<->C is 2<->3)
+#     so the complement of a code is code ^ 1
+
+BASES = 'ATGC'
+BASE2CODE = {base: code for code, base in enumerate(BASES)}
+BASE2CODE.update({base.lower(): code for base, code in list(BASE2CODE.items())})
+
+# Suffix length enumerated in one go by iter_kmers (4^8 = 65536 short strings)
+_SUFFIX_LENGTH = 8
+
+
+def encode_kmer(kmer):
+    code = 0
+    for base in kmer:
+        try:
+            code = (code << 2) | BASE2CODE[base]
+        except KeyError:
+            raise ValueError('invalid base ' + repr(base) + ' in k-mer ' + repr(kmer)) from None
+    return code
+
+
+def decode_kmer(code, k):
+    result = []
+    for i in range(k):
+        result.append(BASES[code & 3])
+        code >>= 2
+    return ''.join(reversed(result))
+
+
+def code_dtype(k):
+    # smallest unsigned type that can hold a k-mer of length k
+    if k <= 4:
+        return np.uint8
+    if k <= 8:
+        return np.uint16
+    if k <= 16:
+        return np.uint32
+    if k <= 32:
+        return np.uint64
+    raise ValueError('k-mers longer than 32 do not fit in 64 bits')
+
+
+def kmer_codes(k, start=0, stop=None):
+    # Packed codes are just the ranks, so a range of the space is an arange
+    stop = 4 ** k if stop is None else stop
+    return np.arange(start, stop, dtype=code_dtype(k))
+
+
+def codes_to_kmers(codes, k):
+    # Vectorised decode: array of codes -> array of fixed-width bytes ('S<k>')
+    codes = np.asarray(codes, dtype=np.uint64)
+    shifts = np.arange(2 * (k - 1), -1, -2, dtype=np.uint64)
+    digits = (codes[:, None] >> shifts) & np.uint64(3)
+    letters = np.frombuffer(BASES.encode(), dtype=np.uint8)[digits]
+    return np.ascontiguousarray(letters).view('S' + str(k)).ravel()
+
+
+def iter_kmers(k, start=0, stop=None):
+    # Lazy version of generate_kmers(k)[start:stop]
+    #   - the last few bases come from one cached product() block
+    #   - the leading bases are decoded once per block
+    total = 4 ** k
+    stop = total if stop is None else min(stop, total)
+    if start >= stop:
+        return
+    suffix_length = min(k, _SUFFIX_LENGTH)
+    block = 4 ** suffix_length
+    suffixes = [''.join(p) for p in product(BASES, repeat=suffix_length)]
+    for prefix_code in range(start // block, (stop - 1) // block + 1):
+        prefix = decode_kmer(prefix_code, k - suffix_length)
+        first = prefix_code * block
+        for suffix in suffixes[max(start - first, 0):min(stop - first, block)]:
+            yield prefix + suffix
+
+
+def shard_ranges(total, n_shards):
+    # Split range(total) into n_shards contiguous (start, stop) pieces
+    #   - sizes differ by at most one
+    n_shards = max(1, min(n_shards, total)) if total else 1
+    size, extra = divmod(total, n_shards)
+    result = []
+    start = 0
+    for i in range(n_shards):
+        stop = start + size + (1 if i < extra else 0)
+        result.append((start, stop))
+        start = stop
+    return result
+
+
+# ---The k-mer space as a sequence
+#   - behaves like range(): len(), indexing, slicing, .index(), `in`
+#   - a slice is another KmerSpace, so a shard can be handed to a worker process
+
+class KmerSpace:
+
+    def __init__(self, k, start=0, stop=None):
+        if k < 1:
+            raise ValueError('k must be at least 1')
+        total = 4 ** k
+        self.k = k
+        self.start = max(0, min(start, total))
+        self.stop = total if stop is None else max(self.start, min(stop, total))
+
+    def __repr__(self):
+        return 'KmerSpace(k={}, start={}, stop={})'.format(self.k, self.start, self.stop)
+
+    def __len__(self):
+        return self.stop - self.start
+
+    def __iter__(self):
+        return iter_kmers(self.k, self.start, self.stop)
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            start, stop, step = i.indices(len(self))
+            if step != 1:
+                raise ValueError('KmerSpace slices must be contiguous')
+            return KmerSpace(self.k, self.start + start, self.start + max(start, stop))
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError('KmerSpace index out of range')
+        return decode_kmer(self.start + i, self.k)
+
+    def __contains__(self, kmer):
+        if not isinstance(kmer, str) or len(kmer) != self.k:
+            return False
+        try:
+            return self.start <= encode_kmer(kmer) < self.stop
+        except ValueError:
+            return False
+
+    def __eq__(self, other):
+        if not isinstance(other, KmerSpace):
+            return NotImplemented
+        return (self.k, self.start, self.stop) == (other.k, other.start, other.stop)
+
+    def __reduce__(self):
+        return (KmerSpace, (self.k, self.start, self.stop))
+
+    def index(self, kmer):
+        # rank of a k-mer within this space
+        if len(kmer) != self.k:
+            raise ValueError(repr(kmer) + ' is not a k-mer of length ' + str(self.k))
+        code = encode_kmer(kmer)
+        if not self.start <= code < self.stop:
+            raise ValueError(repr(kmer) + ' is not in ' + repr(self))
+        return code - self.start
+
+    def codes(self):
+        return kmer_codes(self.k, self.start, self.stop)
+
+    def split(self, n_shards):
+        return [KmerSpace(self.k, self.start + start, self.start + stop)
+                for start, stop in shard_ranges(len(self), n_shards)]
+
+
+if __name__ == '__main__':
+
+    # Same order as the list version
+    space = KmerSpace(3)
+    print(list(space)[:8])
+    print(space[5], space.index('AGC'))
+
+    # k=14 without running out of memory: 268M k-mers, only a shard is touched
+    big = KmerSpace(14)
+    print(len(big), big.split(4))
+    shard = big.split(4)[3]
+    print(shard[0], shard[-1], codes_to_kmers(shard.codes()[:3], 14))
@@ -0,0 +1,164 @@
+#----------------- Last common ancestor index ------------------------#
+
+# get_lca rebuilds both ancestor lists on every call and checks `taxon in list`
+#   - fine for the primates, hopeless for millions of reads against NCBI
+# Here: the tree is indexed once, then every query is a few array lookups
+#   - taxon names are swapped for integer ids
+#   - up[j][node] is the ancestor 2^j levels above node (binary lifting)
+#   - a query lifts the deeper taxon to the same depth, then lifts both
+#     while their ancestors still differ: O(log depth) per pair
+#   - every step works on whole arrays, so a batch of pairs costs the same number of steps
+
+import numpy as np
+
+
+class LcaIndex:
+
+    def __init__(self, parent, names):
+        # parent[i] is the id of the parent of node i, roots point to themselves
+        # names[i] is the taxon name of node i
+        self.names = list(names)
+        self.ids = {name: i for i, name in enumerate(self.names)}
+        parent = np.asarray(parent, dtype=np.int64)
+        # one extra node joins the roots, so taxa from different trees have an answer (None)
+        self.virtual_root = len(parent)
+        parent = np.where(parent == np.arange(len(parent)), self.virtual_root, parent)
+        parent = np.append(parent, self.virtual_root)
+        self.up, self.depth = _lifting_table(parent)
+
+    @classmethod
+    def from_child_to_parent(cls, tax_dict):
+        # tax_dict like {'Pongo abelii': 'Hominidae', ...}
+        ids = {}
+        pairs = []
+        for child, parent in tax_dict.items():
+            child_id = ids.setdefault(child, len(ids))
+            parent_id = ids.setdefault(parent, len(ids))
+            pairs.append((child_id, parent_id))
+        parent = np.arange(len(ids), dtype=np.int64)
+        if pairs:
+            pairs = np.array(pairs, dtype=np.int64)
+            parent[pairs[:, 0]] = pairs[:, 1]
+        return cls(parent, ids)
+
+    @classmethod
+    def from_parent_to_children(cls, children_dict):
+        # new_tax_dict like {'Primates': ['Haplorrhini', 'Strepsirrhini'], ...}
+        return cls.from_child_to_parent({child: parent
+                                         for parent, children in children_dict.items()
+                                         for child in children})
+
+    # ---Names and ids
+
+    def to_ids(self, taxa):
+        return np.fromiter((self.ids[taxon] for taxon in taxa), dtype=np.int64)
+
+    def to_names(self, ids):
+        return [None if i == self.virtual_root else self.names[i] for i in np.asarray(ids).tolist()]
+
+    # ---Batch queries on ids
+
+    def lca_ids(self, ids1, ids2):
+        # element-wise LCA of two arrays of ids
+        #   - the result is virtual_root where two taxa share no ancestor
+        u = np.asarray(ids1, dtype=np.int64).copy()
+        v = np.asarray(ids2, dtype=np.int64).copy()
+        swap = self.depth[u] < self.depth[v]
+        u[swap], v[swap] = v[swap], u[swap]
+        diff = self.depth[u] - self.depth[v]
+        for j, up in enumerate(self.up):
+            lift = ((diff >> j) & 1).astype(bool)
+            u[lift] = up[u[lift]]
+        same = u == v
+        for up in reversed(self.up):
+            up_u = up[u]
+            up_v = up[v]
+            move = up_u != up_v
+            u[move] = up_u[move]
+            v[move] = up_v[move]
+        return np.where(same, u, self.up[0][u])
+
+    def lca_groups(self, ids, offsets):
+        # LCA of every group ids[offsets[g]:offsets[g + 1]] (CSR layout)
+        #   - groups are halved in rounds: neighbours are paired up and replaced by their LCA
+        ids = np.asarray(ids, dtype=np.int64)
+        lengths = np.diff(np.asarray(offsets, dtype=np.int64))
+        if np.any(lengths == 0):
+            raise ValueError('every group needs at least one taxon')
+        while len(ids) > len(lengths):
+            starts = np.concatenate(([0], np.cumsum(lengths)[:-1]))
+            rank = np.arange(len(ids)) - np.repeat(starts, lengths)
+            group_length = np.repeat(lengths, lengths)
+            left = np.flatnonzero(rank % 2 == 0)
+            paired = left[rank[left] + 1 < group_length[left]]
+            ids[paired] = self.lca_ids(ids[paired], ids[paired + 1])
+            ids = ids[left]
+            lengths = (lengths + 1) // 2
+        return ids
+
+    # ---Queries on names, same answers as get_lca / get_lca_list
+
+    def lca(self, taxon1, taxon2):
+        return self.to_names(self.lca_ids([self.ids[taxon1]], [self.ids[taxon2]]))[0]
+
+    def lca_list(self, taxa):
+        # unlike get_lca_list, taxa is not emptied
+        ids = self.to_ids(taxa)
+        return self.to_names(self.lca_groups(ids, [0, len(ids)]))[0]
+
+    def lca_batch(self, taxa_lists):
+        # one LCA name per list of taxa
+        lengths = [len(taxa) for taxa in taxa_lists]
+        ids = self.to_ids(taxon for taxa in taxa_lists for taxon in taxa)
+        offsets = np.concatenate(([0], np.cumsum(lengths, dtype=np.int64)))
+        return self.to_names(self.lca_groups(ids, offsets))
+
+
+def _lifting_table(parent):
+    # Pointer jumping: up[j] = up[j - 1][up[j - 1]] until every node reaches its root
+    #   - depth comes out of the same loop, log2(max depth) rounds in all
+    #   - a tree of n nodes settles within ceil(log2(n)) + 1 rounds, so a loop still moving after that is a cycle
+    is_root = parent == np.arange(len(parent))
+    depth = (~is_root).astype(np.int64)
+    up = [parent]
+    ancestor = parent
+    for _ in range(max(len(parent) - 1, 0).bit_length() + 1):
+        jumped = ancestor[ancestor]
+        if np.array_equal(jumped, ancestor):
+            break
+        depth = depth + depth[ancestor]
+        up.append(jumped)
+        ancestor = jumped
+    else:
+        raise ValueError('cycle in parent links')
+    # an even cycle settles too, on nodes that are not roots
+    if not np.all(is_root[ancestor]):
+        raise ValueError('cycle in parent links')
+    return up, depth
+
+
+if __name__ == '__main__':
+
+    tax_dict = {
+        'Pongo abelii': 'Hominidae',
+        'Pan troglodytes': 'Hominidae',
+        'Hominidae': 'Simiiformes',
+        'Simiiformes': 'Haplorhini',
+        'Tarsius tarsier': 'Tarsiiformes',
+        'Tarsiiformes': 'Haplorhini',
+        'Haplorhini': 'Primates',
+        'Loris tardigradus': 'Lorisidae',
+        'Lorisidae': 'Strepsirrhini',
+        'Allocebus trichotis': 'Lemuriformes',
+        'Lemuriformes': 'Strepsirrhini',
+        'Strepsirrhini': 'Primates',
+        'Galago allenii': 'Lorisiformes',
+        'Galago moholi': 'Lorisiformes',
+        'Lorisiformes': 'Strepsirrhini'
+    }
+
+    index = LcaIndex.from_child_to_parent(tax_dict)
+    print(index.lca('Pan troglodytes', 'Tarsius tarsier'))  # Haplorhini
+    print(index.lca('Haplorhini', 'Pan troglodytes'))  # Haplorhini
+    print(index.lca_list(['Pan troglodytes', 'Tarsius tarsier', 'Pongo abelii']))  # Haplorhini
+    print(index.lca_batch([['Pongo abelii', 'Pan troglodytes'], ['Galago moholi', 'Loris tardigradus'], ['Galago moholi']]))
@@ -0,0 +1,309 @@
+#----------------- Reading many files through a bounded pool ------------------------#
+
+# [open('one.txt'), open('two.txt')] opens every file at once and never closes them
+#   - tens of thousands of per-sample files run the process out of file descriptors
+# Here: files are read through a pool that keeps at most max_open of them open
+#   - least recently used handles are closed first; a closed file is reopened later
+#     at the position it had reached
+#   - reads are big blocks (1 MB by default), or slices of an mmap
+#   - in file order, a background thread reads the next blocks ahead of the consumer
+#     (file reads release the GIL), through a bounded queue
+#   - all files come out as one stream of records: (file number, record)
+#     records are lines, or (header, sequence) pairs for FASTA
+#   - a stats object counts descriptors, reopens, bytes, records and throughput
+
+import mmap
+import queue
+import threading
+import time
+from collections import OrderedDict
+
+
+DEFAULT_BLOCK_SIZE = 1 << 20
+
+
+class ReaderStats:
+
+    def __init__(self):
+        self.files = 0
+        self.opened = 0
+        self.reopened = 0
+        self.closed_early = 0  # closed by the pool to stay under max_open
+        self.open_now = 0
+        self.peak_open = 0
+        self.bytes_read = 0
+        self.records = 0
+        self.seconds = 0.0
+
+    @property
+    def megabytes_per_second(self):
+        return self.bytes_read / self.seconds / 1e6 if self.seconds else 0.0
+
+    @property
+    def records_per_second(self):
+        return self.records / self.seconds if self.seconds else 0.0
+
+    def __repr__(self):
+        return ('ReaderStats(files={}, opened={}, reopened={}, closed_early={}, open_now={}, peak_open={}, '
+                'bytes={}, records={}, {:.1f} MB/s, {:.0f} records/s)').format(
+            self.files, self.opened, self.reopened, self.closed_early, self.open_now, self.peak_open,
+            self.bytes_read, self.records, self.megabytes_per_second, self.records_per_second)
+
+
+class HandlePool:
+    # At most max_open files open at once, each remembers where it was
+
+    def __init__(self, max_open=64, block_size=DEFAULT_BLOCK_SIZE, use_mmap=False, stats=None):
+        self.max_open = max(1, max_open)
+        self.block_size = block_size
+        self.use_mmap = use_mmap
+        self.stats = stats if stats is not None else ReaderStats()
+        self._open = OrderedDict()  # path -> open file (or mmap)
+        self._positions = {}  # path -> how far it has been read
+        self._lock = threading.Lock()
+
+    def _handle(self, path):
+        handle = self._open.get(path)
+        if handle is not None:
+            self._open.move_to_end(path)
+            return handle
+        while len(self._open) >= self.max_open:
+            _, oldest = self._open.popitem(last=False)
+            oldest.close()
+            self.stats.open_now -= 1
+            self.stats.closed_early += 1
+        if path in self._positions:
+            self.stats.reopened += 1
+        self.stats.opened += 1
+        raw = open(path, 'rb', buffering=0 if self.use_mmap else self.block_size)
+        if self.use_mmap:
+            # the mmap keeps its own descriptor, the file object can go straight away
+            try:
+                handle = mmap.mmap(raw.fileno(), 0, access=mmap.ACCESS_READ)
+            except ValueError:  # empty file
+                handle = _Empty()
+            raw.close()
+        else:
+            handle = raw
+            handle.seek(self._positions.get(path, 0))
+        self._open[path] = handle
+        self.stats.open_now += 1
+        self.stats.peak_open = max(self.stats.peak_open, self.stats.open_now)
+        return handle
+
+    def read(self, path):
+        # the next block of the file, b'' at the end (the file is then closed)
+        with self._lock:
+            handle = self._handle(path)
+            position = self._positions.get(path, 0)
+            if self.use_mmap:
+                block = handle[position:position + self.block_size]
+            else:
+                block = handle.read(self.block_size)
+            self._positions[path] = position + len(block)
+            self.stats.bytes_read += len(block)
+            if not block:
+                self.close(path)
+            return block
+
+    def close(self, path):
+        handle = self._open.pop(path, None)
+        if handle is not None:
+            handle.close()
+            self.stats.open_now -= 1
+        self._positions.pop(path, None)
+
+    def close_all(self):
+        for path in list(self._open):
+            self.close(path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close_all()
+
+
+class _Empty:
+    # stands in for the mmap of an empty file, which mmap refuses to make
+    def __getitem__(self, index):
+        return b''
+
+    def close(self):
+        pass
+
+
+class _Parser:
+    # turns the blocks of one file into records as they arrive
+    #   - lines: bytes without the newline
+    #   - fasta: (header, sequence) pairs, like fasta.iter_records
+
+    def __init__(self, fmt):
+        self.fasta = fmt == 'fasta'
+        self.rest = b''
+        self.header = None
+        self.pieces = []
+
+    def feed(self, block):
+        lines = (self.rest + block).split(b'\n')
+        self.rest = lines.pop()
+        return self._records(lines)
+
+    def finish(self):
+        lines = [self.rest] if self.rest else []
+        self.rest = b''
+        records = self._records(lines)
+        if self.fasta and self.header is not None:
+            records.append((self.header, b''.join(self.pieces)))
+            self.header = None
+        return records
+
+    def _records(self, lines):
+        lines = [line.rstrip(b'\r') for line in lines]
+        if not self.fasta:
+            return lines
+        records = []
+        for line in lines:
+            if line.startswith(b'>'):
+                if self.header is not None:
+                    records.append((self.header, b''.join(self.pieces)))
+                self.header = line[1:].strip().decode()
+                self.pieces = []
+            elif line.strip():
+                self.pieces.append(line.strip())
+        return records
+
+
+class MultiFileReader:
+
+    def __init__(self, paths, max_open=64, block_size=DEFAULT_BLOCK_SIZE, use_mmap=False, prefetch=8, fmt='lines'):
+        # fmt: 'lines' or 'fasta'
+        # prefetch: blocks the background thread may read ahead (0 = no thread)
+        if fmt not in ('lines', 'fasta'):
+            raise ValueError("fmt must be 'lines' or 'fasta'")
+        self.paths = list(paths)
+        self.prefetch = prefetch
+        self.fmt = fmt
+        self.stats = ReaderStats()
+        self.stats.files = len(self.paths)
+        self.pool = HandlePool(max_open, block_size, use_mmap, self.stats)
+
+    def _blocks(self):
+        # (file number, block) in file order, (file number, None) at the end of each file
+        for i, path in enumerate(self.paths):
+            while True:
+                block = self.pool.read(path)
+                if not block:
+                    break
+                yield i, block
+            yield i, None
+
+    def _prefetched(self):
+        # the same stream, read by a background thread into a bounded queue
+        q = queue.Queue(maxsize=self.prefetch)
+        stop = threading.Event()
+        done = object()
+
+        def put(item):
+            while not stop.is_set():
+                try:
+                    q.put(item, timeout=0.1)
+                    return True
+                except queue.Full:
+                    pass
+            return False
+
+        def produce():
+            try:
+                for item in self._blocks():
+                    if not put(item):
+                        return
+                put(done)
+            except BaseException as error:
+                put(error)
+
+        thread = threading.Thread(target=produce, daemon=True)
+        thread.start()
+        try:
+            while True:
+                item = q.get()
+                if item is done:
+                    return
+                if isinstance(item, BaseException):
+                    raise item
+                yield item
+        finally:
+            stop.set()
+            thread.join()
+
+    def __iter__(self):
+        # (file number, record) for every record of every file, one file after another
+        start = time.perf_counter()
+        try:
+            parser = None
+            for i, block in self._prefetched() if self.prefetch else self._blocks():
+                if parser is None:
+                    parser = _Parser(self.fmt)
+                records = parser.feed(block) if block is not None else parser.finish()
+                if block is None:
+                    parser = None
+                self.stats.records += len(records)
+                for record in records:
+                    yield i, record
+        finally:
+            self.stats.seconds += time.perf_counter() - start
+            self.pool.close_all()
+
+    def interleaved(self):
+        # (file number, record), one block from each file in turn
+        #   - every file is in use at once, the pool still keeps at most max_open descriptors
+        #   - no read-ahead thread here, the order of reads jumps between files
+        start = time.perf_counter()
+        try:
+            parsers = {i: _Parser(self.fmt) for i in range(len(self.paths))}
+            while parsers:
+                for i in list(parsers):
+                    block = self.pool.read(self.paths[i])
+                    if block:
+                        records = parsers[i].feed(block)
+                    else:
+                        records = parsers.pop(i).finish()
+                    self.stats.records += len(records)
+                    for record in records:
+                        yield i, record
+        finally:
+            self.stats.seconds += time.perf_counter() - start
+            self.pool.close_all()
+
+
+if __name__ == '__main__':
+    import os
+    import sys
+    import tempfile
+
+    # Many small per-sample FASTA files
+    n_files = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    directory = tempfile.mkdtemp()
+    paths = []
+    for f in range(n_files):
+        path = os.path.join(directory, 'sample{}.fa'.format(f))
+        with open(path, 'w') as handle:
+            for r in range(50):
+                handle.write('>s{}_r{}\n{}\n'.format(f, r, 'ACGT' * 40))
+        paths.append(path)
+
+    def descriptors():
+        return len(os.listdir('/proc/self/fd')) if os.path.isdir('/proc/self/fd') else -1
+
+    before = descriptors()
+    reader = MultiFileReader(paths, max_open=32, fmt='fasta')
+    count = sum(1 for _ in reader)
+    print('in order:    {} records, {}'.format(count, reader.stats))
+
+    reader = MultiFileReader(paths, max_open=32, block_size=4096, fmt='fasta')
+    most = 0
+    for n, _ in enumerate(reader.interleaved()):
+        if n % 10_000 == 0:
+            most = max(most, descriptors() - before)
+    print('round robin: {} records, {}'.format(n + 1, reader.stats))
+    print('extra descriptors seen while reading: {} (files: {})'.format(most, n_files))
@@ -0,0 +1,242 @@
+#----------------- Loading the NCBI taxonomy ------------------------#
+
+# tax_dict / new_tax_dict were typed in by hand
+# Here: the real thing, from the NCBI taxdump files
+#   - nodes.dmp: tax_id | parent tax_id | rank | ...
+#   - names.dmp: tax_id | name | unique name | name class |  (only 'scientific name' is kept)
+# Both files are parsed as one array of bytes: separators are found with NumPy
+# and numbers are decoded for all lines at once, no split() per line
+# The finished taxonomy is written to a binary cache next to the dump
+#   - later runs memory-map the cache instead of parsing again
+
+import os
+
+import numpy as np
+
+from fasta import open_source
+from taxonomy import Taxonomy
+
+
+_SCIENTIFIC = np.frombuffer(b'scientific name\t', dtype=np.uint8)
+
+
+def _read_all(source):
+    handle, should_close = open_source(source)
+    try:
+        return np.frombuffer(handle.read(), dtype=np.uint8)
+    finally:
+        if should_close:
+            handle.close()
+
+
+def _field_bounds(data, n_fields):
+    # (starts, ends) of the first n_fields fields of every line
+    #   - fields are separated by tab-bar-tab, so field f starts after tab 2f - 1 of its line
+    newlines = np.flatnonzero(data == ord('\n'))
+    line_starts = np.concatenate(([0], newlines + 1))
+    line_starts = line_starts[line_starts < len(data)]
+    tabs = np.flatnonzero(data == ord('\t'))
+    first_tab = np.searchsorted(tabs, line_starts)
+    bounds = []
+    for field in range(n_fields):
+        start = line_starts if field == 0 else tabs[first_tab + 2 * field - 1] + 1
+        bounds.append((start, tabs[first_tab + 2 * field]))
+    return bounds
+
+
+def _parse_ints(data, starts, ends):
+    # decimal digits -> int64, one digit position at a time for all lines at once
+    values = np.zeros(len(starts), dtype=np.int64)
+    lengths = ends - starts
+    for j in range(int(lengths.max()) if len(lengths) else 0):
+        more = lengths > j
+        digits = data[np.minimum(starts + j, len(data) - 1)].astype(np.int64) - ord('0')
+        values = np.where(more, values * 10 + digits, values)
+    return values
+
+
+def _gather(data, starts, ends):
+    # the bytes of several ranges, back to back
+    lengths = ends - starts
+    before = np.concatenate(([0], np.cumsum(lengths)[:-1]))
+    index = np.repeat(starts - before, lengths) + np.arange(int(lengths.sum()))
+    return data[index], lengths
+
+
+def read_nodes_dmp(source):
+    # Returns (tax_ids, parent tax_ids, ranks) as arrays, in file order
+    data = _read_all(source)
+    (id_start, id_end), (parent_start, parent_end), (rank_start, rank_end) = _field_bounds(data, 3)
+    rank_width = max(1, int((rank_end - rank_start).max()) if len(rank_start) else 1)
+    positions = rank_start[:, None] + np.arange(rank_width)
+    ranks = np.where(positions < rank_end[:, None], data[np.minimum(positions, len(data) - 1)], 0)
+    return (_parse_ints(data, id_start, id_end),
+            _parse_ints(data, parent_start, parent_end),
+            np.ascontiguousarray(ranks.astype(np.uint8)).view('S' + str(rank_width)).ravel())
+
+
+def read_names_dmp(source):
+    # Returns (tax_ids, name_blob, name_lengths) for the scientific names, in file order
+    data = _read_all(source)
+    (id_start, id_end), (name_start, name_end), _, (class_start, class_end) = _field_bounds(data, 4)
+    width = len(_SCIENTIFIC)
+    positions = np.minimum(class_start[:, None] + np.arange(width), len(data) - 1)
+    scientific = np.all(data[positions] == _SCIENTIFIC, axis=1)
+    blob, lengths = _gather(data, name_start[scientific], name_end[scientific])
+    return _parse_ints(data, id_start[scientific], id_end[scientific]), blob, lengths
+
+
+def _lookup(sorted_ids, queries):
+    # position of every query in sorted_ids, -1 if absent
+    #   - NCBI tax ids are dense enough for a direct lookup table, which beats searchsorted
+    if not len(sorted_ids):
+        return np.full(len(queries), -1, dtype=np.int64)
+    largest = int(sorted_ids[-1])
+    if 0 <= sorted_ids[0] and largest < 16 * len(sorted_ids) + 1024:
+        table = np.full(largest + 1, -1, dtype=np.int64)
+        table[sorted_ids] = np.arange(len(sorted_ids))
+        inside = (queries >= 0) & (queries <= largest)
+        return np.where(inside, table[np.where(inside, queries, 0)], -1)
+    positions = np.searchsorted(sorted_ids, queries)
+    clipped = np.minimum(positions, len(sorted_ids) - 1)
+    return np.where(sorted_ids[clipped] == queries, clipped, -1)
+
+
+class NcbiTaxonomy(Taxonomy):
+    # A Taxonomy whose node names are the NCBI tax ids (sorted, so id = position)
+    #   - scientific names and ranks sit alongside in flat arrays
+
+    _ARRAYS = Taxonomy._ARRAYS + ('tax_ids', 'rank_codes', 'rank_blob', 'name_blob', 'name_offsets')
+
+    @classmethod
+    def from_dumps(cls, nodes_source, names_source=None):
+        tax_ids, parent_tax_ids, ranks = read_nodes_dmp(nodes_source)
+        order = np.argsort(tax_ids, kind='stable')
+        tax_ids = tax_ids[order]
+        parent_ids = _lookup(tax_ids, parent_tax_ids[order])
+        if np.any(parent_ids < 0):
+            raise ValueError('nodes.dmp names parents that have no line of their own, e.g. '
+                             + str(parent_tax_ids[order][parent_ids < 0][0]))
+        taxonomy = cls(parent_ids, tax_ids.tolist())
+        taxonomy.tax_ids = tax_ids
+
+        rank_names, rank_codes = np.unique(ranks[order], return_inverse=True)
+        taxonomy.rank_codes = rank_codes.astype(np.uint8 if len(rank_names) < 256 else np.uint16)
+        taxonomy.rank_blob = np.frombuffer(b'\n'.join(rank_names.tolist()), dtype=np.uint8)
+
+        # scientific names as one blob plus offsets (in node order), decoded only when asked for
+        taxonomy.name_offsets = np.zeros(len(tax_ids) + 1, dtype=np.int64)
+        taxonomy.name_blob = np.zeros(0, dtype=np.uint8)
+        if names_source is not None:
+            name_tax_ids, blob, lengths = read_names_dmp(names_source)
+            ids = _lookup(tax_ids, name_tax_ids)
+            starts = np.concatenate(([0], np.cumsum(lengths)[:-1]))
+            # first scientific name wins if a tax id has several
+            keep = np.flatnonzero(ids >= 0)
+            keep = keep[np.unique(ids[keep], return_index=True)[1]]
+            taxonomy.name_blob, kept_lengths = _gather(blob, starts[keep], starts[keep] + lengths[keep])
+            node_lengths = np.zeros(len(tax_ids), dtype=np.int64)
+            node_lengths[ids[keep]] = kept_lengths
+            taxonomy.name_offsets[1:] = np.cumsum(node_lengths)
+        taxonomy._reset_lookups()
+        return taxonomy
+
+    @classmethod
+    def load(cls, path, mmap=True):
+        taxonomy = super().load(path, mmap)
+        taxonomy._reset_lookups()
+        return taxonomy
+
+    def _reset_lookups(self):
+        # rank and name tables, decoded on first use
+        self._rank_names = None
+        self._name_ids = None
+
+    # ---Tax ids <-> node ids
+
+    def to_ids(self, tax_ids, strict=True):
+        # vectorised tax id -> node id (-1 for unknown tax ids when strict=False)
+        tax_ids = np.asarray(tax_ids, dtype=np.int64)
+        ids = _lookup(self.tax_ids, tax_ids)
+        if strict and np.any(ids < 0):
+            raise KeyError(int(tax_ids[ids < 0][0]))
+        return ids
+
+    def node(self, tax_id):
+        return int(self.to_ids([tax_id])[0])
+
+    # ---Names and ranks
+
+    def scientific_name(self, tax_id):
+        i = self.node(tax_id)
+        return self.name_blob[self.name_offsets[i]:self.name_offsets[i + 1]].tobytes().decode()
+
+    def rank(self, tax_id):
+        if self._rank_names is None:
+            self._rank_names = self.rank_blob.tobytes().decode().split('\n')
+        return self._rank_names[self.rank_codes[self.node(tax_id)]]
+
+    def tax_id_of(self, scientific_name):
+        # name -> tax id, the lookup table is built on first use
+        if self._name_ids is None:
+            blob = self.name_blob.tobytes().decode()
+            offsets = self.name_offsets.tolist()
+            self._name_ids = {}
+            for i in range(len(offsets) - 1):
+                self._name_ids.setdefault(blob[offsets[i]:offsets[i + 1]], i)
+        return int(self.tax_ids[self._name_ids[scientific_name]])
+
+    def lineage(self, tax_id):
+        # scientific names from the taxon up to the root
+        return [self.scientific_name(t) for t in self.get_ancestors(tax_id)]
+
+
+def load_ncbi_taxonomy(nodes_path, names_path=None, cache_path=None):
+    # Parses the dumps the first time, then reuses the binary cache
+    #   - the cache is rebuilt whenever a dump file is newer than it
+    if cache_path is None:
+        cache_path = os.fspath(nodes_path) + '.cache'
+    sources = [nodes_path] + ([names_path] if names_path is not None else [])
+    if os.path.exists(cache_path) and all(os.path.getmtime(cache_path) >= os.path.getmtime(source) for source in sources):
+        return NcbiTaxonomy.load(cache_path)
+    taxonomy = NcbiTaxonomy.from_dumps(nodes_path, names_path)
+    taxonomy.save(cache_path)
+    return taxonomy
+
+
+def write_synthetic_dump(directory, n_nodes=1000, seed=0):
+    # A small made-up taxdump in NCBI format, for trying the loader out
+    rng = np.random.default_rng(seed)
+    ranks = ['no rank', 'superkingdom', 'phylum', 'class', 'order', 'family', 'genus', 'species']
+    tax_ids = np.concatenate(([1], rng.choice(np.arange(2, 10 * n_nodes), n_nodes - 1, replace=False)))
+    nodes_path = os.path.join(directory, 'nodes.dmp')
+    names_path = os.path.join(directory, 'names.dmp')
+    with open(nodes_path, 'w') as nodes, open(names_path, 'w') as names:
+        for i, tax_id in enumerate(tax_ids.tolist()):
+            parent = 1 if i == 0 else int(tax_ids[rng.integers(0, i)])
+            nodes.write('{}\t|\t{}\t|\t{}\t|\tXX\t|\t0\t|\n'.format(tax_id, parent, ranks[i % len(ranks)]))
+            names.write('{}\t|\tTaxon {}\t|\t\t|\tscientific name\t|\n'.format(tax_id, tax_id))
+            names.write('{}\t|\tOld taxon {}\t|\t\t|\tsynonym\t|\n'.format(tax_id, tax_id))
+    return nodes_path, names_path
+
+
+if __name__ == '__main__':
+    import sys
+    import tempfile
+    import time
+
+    # Round trip on a synthetic dump: parse, cache, reload from the cache
+    n_nodes = int(sys.argv[1]) if len(sys.argv) > 1 else 100_000
+    directory = tempfile.mkdtemp()
+    nodes_path, names_path = write_synthetic_dump(directory, n_nodes)
+
+    start = time.perf_counter()
+    parsed = load_ncbi_taxonomy(nodes_path, names_path)
+    print('parsed {} nodes in {:.2f}s'.format(len(parsed), time.perf_counter() - start))
+
+    start = time.perf_counter()
+    cached = load_ncbi_taxonomy(nodes_path, names_path)
+    print('reloaded from cache in {:.3f}s'.format(time.perf_counter() - start))
+
+    some_tax_id = int(cached.tax_ids[-1])
+    print(cached.lineage(some_tax_id), cached.rank(some_tax_id))
@@ -0,0 +1,232 @@
+#----------------- Finding restriction sites for many enzymes at once ------------------------#
+
+# enzymes maps names to regexes like GG(A|T)CC
+#   - running every regex over the genome is one full pass per enzyme and strand
+# Here: all the patterns are compiled together into one table-driven matcher
+#   - each pattern becomes a list of allowed bases per position (IUPAC codes, [..] and (..|..) work)
+#   - the reverse complement of every pattern is added as well, for the other strand
+#   - every (pattern, strand) gets one bit of a 64-bit word; table[j][base] holds the bits
+#     of the patterns that allow base at offset j
+#   - the bits still set after ANDing table[j][sequence[i + j]] over j are the patterns
+#     that match at position i (bit-parallel Shift-And, with the positions of a
+#     whole chunk done at once instead of one base at a time)
+# Input is streamed in chunks, the last few bases of a chunk are carried into the next
+# Hits come back as arrays: record, enzyme, position, strand (+1 / -1)
+
+from collections import namedtuple
+
+import numpy as np
+
+from fasta import DEFAULT_CHUNK_SIZE, iter_sequence_chunks
+from kmer_count import INVALID, encode_bases
+from kmers import BASES
+
+
+Sites = namedtuple('Sites', ['record', 'enzyme', 'position', 'strand'])
+
+IUPAC = {
+    'A': 'A', 'C': 'C', 'G': 'G', 'T': 'T', 'U': 'T',
+    'R': 'AG', 'Y': 'CT', 'S': 'CG', 'W': 'AT', 'K': 'GT', 'M': 'AC',
+    'B': 'CGT', 'D': 'AGT', 'H': 'ACT', 'V': 'ACG', 'N': 'ACGT', '.': 'ACGT',
+}
+COMPLEMENT = {'A': 'T', 'C': 'G', 'G': 'C', 'T': 'A'}
+
+
+def expand_pattern(pattern):
+    # 'GG(A|T)CC' -> every fixed-length alternative, as a list of allowed-base strings
+    #   -> [['G', 'G', 'AT', 'C', 'C']]
+    alternatives, end = _parse(pattern.upper(), 0)
+    if end != len(pattern):
+        raise ValueError('unbalanced ) in ' + pattern)
+    return [[''.join(sorted(bases)) for bases in alternative] for alternative in alternatives]
+
+
+def _parse(pattern, i):
+    # alternatives of the group that starts at i, and where the group ends
+    groups = [[[]]]  # one list of alternatives per '|' branch
+    while i < len(pattern) and pattern[i] not in ')':
+        char = pattern[i]
+        if char == '|':
+            groups.append([[]])
+            i += 1
+            continue
+        if char == '(':
+            inner, i = _parse(pattern, i + 1)
+            if i >= len(pattern) or pattern[i] != ')':
+                raise ValueError('unbalanced ( in ' + pattern)
+            i += 1
+        elif char == '[':
+            close = pattern.find(']', i)
+            if close < 0:
+                raise ValueError('unbalanced [ in ' + pattern)
+            inner = [[set(''.join(_bases(c, pattern) for c in pattern[i + 1:close]))]]
+            i = close + 1
+        else:
+            inner = [[set(_bases(char, pattern))]]
+            i += 1
+        groups[-1] = [done + more for done in groups[-1] for more in inner]
+    return [alternative for group in groups for alternative in group], i
+
+
+def _bases(char, pattern):
+    if char not in IUPAC:
+        raise ValueError('cannot compile {!r} in {}'.format(char, pattern))
+    return IUPAC[char]
+
+
+def reverse_complement(alternative):
+    return [''.join(sorted(COMPLEMENT[base] for base in bases)) for bases in reversed(alternative)]
+
+
+class SiteScanner:
+
+    def __init__(self, enzymes):
+        # enzymes: {name: pattern}, like the enzymes dict
+        self.names = list(enzymes)
+        self.patterns = []  # (enzyme id, strand, allowed bases per position)
+        for enzyme, pattern in enumerate(enzymes.values()):
+            forward = expand_pattern(pattern)
+            for alternative in forward:
+                self.patterns.append((enzyme, 1, alternative))
+            # palindromic sites (GAATTC) would match twice at the same place, keep one
+            for alternative in forward:
+                reverse = reverse_complement(alternative)
+                if reverse not in forward:
+                    self.patterns.append((enzyme, -1, reverse))
+        self.width = max((len(p[2]) for p in self.patterns), default=1)
+        self.n_words = max(1, (len(self.patterns) + 63) // 64)
+        self.pattern_enzyme = np.array([p[0] for p in self.patterns], dtype=np.int64)
+        self.pattern_strand = np.array([p[1] for p in self.patterns], dtype=np.int8)
+
+        # table[j, code, word]: bits of the patterns that accept code at offset j
+        #   - offsets past the end of a pattern accept everything
+        #   - INVALID (N, gaps, ...) in the sequence is never accepted by a real position
+        self.table = np.zeros((self.width, INVALID + 1, self.n_words), dtype=np.uint64)
+        for p, (_, _, alternative) in enumerate(self.patterns):
+            word, bit = divmod(p, 64)
+            mask = np.uint64(1) << np.uint64(bit)
+            for j in range(self.width):
+                if j >= len(alternative):
+                    self.table[j, :, word] |= mask
+                    continue
+                for base in alternative[j]:
+                    self.table[j, BASES.index(base), word] |= mask
+
+    def _match(self, codes, n_starts):
+        # (start, pattern) of every match that starts in codes[:n_starts]
+        starts, patterns = [], []
+        for word in range(self.n_words):
+            mask = self.table[0, codes[:n_starts], word]
+            for j in range(1, self.width):
+                mask &= self.table[j, codes[j:j + n_starts], word]
+            hit = np.flatnonzero(mask)
+            bits = np.unpackbits(mask[hit].astype('<u8').view(np.uint8).reshape(-1, 8), axis=1, bitorder='little')
+            row, bit = np.nonzero(bits)
+            starts.append(hit[row])
+            patterns.append(64 * word + bit)
+        return np.concatenate(starts), np.concatenate(patterns)
+
+    def scan_chunks(self, chunks):
+        # (new_record, chunk) pairs as from iter_sequence_chunks -> one Sites per chunk
+        #   - positions are 0-based from the start of their record
+        record = -1
+        tail = np.zeros(0, dtype=np.uint8)
+        offset = 0  # position of tail[0] in the record
+        for new_record, chunk in chunks:
+            if new_record:
+                if record >= 0:
+                    yield self._finish(record, tail, offset)
+                record += 1
+                tail = np.zeros(0, dtype=np.uint8)
+                offset = 0
+            codes = np.concatenate((tail, encode_bases(chunk)))
+            # starts whose window runs past the chunk wait for the next one
+            n_starts = max(0, len(codes) - (self.width - 1))
+            yield self._sites(record, codes, n_starts, offset)
+            tail = codes[n_starts:]
+            offset += n_starts
+        if record >= 0:
+            yield self._finish(record, tail, offset)
+
+    def _finish(self, record, tail, offset):
+        # end of a record: pad with INVALID so the shorter patterns can still match at the very end
+        codes = np.concatenate((tail, np.full(self.width - 1, INVALID, dtype=np.uint8)))
+        return self._sites(record, codes, len(tail), offset)
+
+    def _sites(self, record, codes, n_starts, offset):
+        starts, patterns = self._match(codes, n_starts)
+        enzymes, strands = self.pattern_enzyme[patterns], self.pattern_strand[patterns]
+        order = np.lexsort((-strands, enzymes, starts))
+        starts, enzymes, strands = starts[order], enzymes[order], strands[order]
+        # two alternatives of one enzyme can match at the same place, report the site once
+        keep = np.ones(len(starts), dtype=bool)
+        keep[1:] = (np.diff(starts) != 0) | (np.diff(enzymes) != 0) | (np.diff(strands) != 0)
+        return Sites(np.full(int(keep.sum()), record, dtype=np.int64), enzymes[keep],
+                     starts[keep] + offset, strands[keep])
+
+    def scan(self, sequence):
+        # every site in one sequence (str or bytes)
+        return _concatenate(self.scan_chunks([(True, sequence)]))
+
+    def scan_file(self, source, chunk_size=DEFAULT_CHUNK_SIZE):
+        # every site in every record of a FASTA file, streamed chunk by chunk
+        return _concatenate(self.scan_chunks(iter_sequence_chunks(source, chunk_size)))
+
+    def to_list(self, sites):
+        # Sites arrays -> [(enzyme name, position, '+'/'-'), ...]
+        return [(self.names[e], p, '+' if s > 0 else '-')
+                for e, p, s in zip(sites.enzyme.tolist(), sites.position.tolist(), sites.strand.tolist())]
+
+
+def _concatenate(parts):
+    parts = list(parts)
+    if not parts:
+        return Sites(*(np.zeros(0, dtype=dtype) for dtype in (np.int64, np.int64, np.int64, np.int8)))
+    return Sites(*(np.concatenate(column) for column in zip(*parts)))
+
+
+if __name__ == '__main__':
+    import re
+    import sys
+    import time
+
+    enzymes = {
+        'EcoRI': r'GAATTC',
+        'AvaII': r'GG(A|T)CC',
+        'BisI': r'GC[ATCG]GC'
+    }
+    scanner = SiteScanner(enzymes)
+    print(scanner.to_list(scanner.scan('ttGAATTCaGGACCttGCAGCaaGGTCCg')))
+
+    # Throughput against one regex per enzyme and strand
+    more = {'BamHI': 'GGATCC', 'HindIII': 'AAGCTT', 'NotI': 'GCGGCCGC', 'PstI': 'CTGCAG', 'SmaI': 'CCCGGG',
+            'XhoI': 'CTCGAG', 'SacI': 'GAGCTC', 'KpnI': 'GGTACC', 'SalI': 'GTCGAC', 'XbaI': 'TCTAGA',
+            'BglI': 'GCCNNNNNGGC', 'HaeIII': 'GGCC', 'AluI': 'AGCT', 'HinfI': 'GANTC', 'SfiI': 'GGCCNNNNNGGCC',
+            'AccI': 'GTMKAC', 'BsaJI': 'CCNNGG', 'StyI': 'CCWWGG', 'BanI': 'GGYRCC', 'HincII': 'GTYRAC'}
+    enzymes.update(more)
+    size = int(sys.argv[1]) if len(sys.argv) > 1 else 10_000_000
+    rng = np.random.default_rng(0)
+    genome = np.frombuffer(b'ACGT', dtype=np.uint8)[rng.integers(0, 4, size)].tobytes().decode()
+    scanner = SiteScanner(enzymes)
+
+    start = time.perf_counter()
+    sites = scanner.scan(genome)
+    elapsed = time.perf_counter() - start
+    print('{} sites, {:.1f} Mb/s (all enzymes, both strands)'.format(len(sites.position), size / elapsed / 1e6))
+
+    # the regex way: lookahead so overlapping sites are found, a second pass for the other strand
+    def to_regex(alternatives):
+        return '|'.join(''.join('[' + bases + ']' if len(bases) > 1 else bases for bases in a) for a in alternatives)
+
+    start = time.perf_counter()
+    regex_hits = set()
+    for enzyme, pattern in enumerate(enzymes.values()):
+        forward = expand_pattern(pattern)
+        reverse = [reverse_complement(a) for a in forward if reverse_complement(a) not in forward]
+        for strand, alternatives in ((1, forward), (-1, reverse)):
+            if alternatives:
+                for match in re.finditer('(?=' + to_regex(alternatives) + ')', genome):
+                    regex_hits.add((enzyme, match.start(), strand))
+    elapsed = time.perf_counter() - start
+    print('regex per enzyme: {:.1f} Mb/s'.format(size / elapsed / 1e6))
+    assert regex_hits == set(zip(sites.enzyme.tolist(), sites.position.tolist(), sites.strand.tolist()))
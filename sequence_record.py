@@ -0,0 +1,119 @@
+#----------------- A light record type with named fields ------------------------#
+
+# The list of dicts reads well (record['accession']) but every record carries a dict
+# The list of tuples is light, but record[1] says nothing about what it holds
+# Here: SequenceRecord has named fields and __slots__
+#   - no per-instance __dict__, so a record is about the size of a tuple
+#   - record.accession reads like the dict version
+#   - it still unpacks like a tuple: (this_sequence, this_accession, this_code) = record
+# Bulk constructors read FASTA or CSV and make one object per record, nothing else kept
+
+import csv
+import io
+
+from fasta import iter_records, open_source
+
+
+class SequenceRecord:
+    __slots__ = ('sequence', 'accession', 'genetic_code')
+
+    def __init__(self, sequence, accession, genetic_code=1):
+        self.sequence = sequence
+        self.accession = accession
+        self.genetic_code = genetic_code
+
+    def __iter__(self):
+        yield self.sequence
+        yield self.accession
+        yield self.genetic_code
+
+    def __eq__(self, other):
+        if not isinstance(other, SequenceRecord):
+            return NotImplemented
+        return tuple(self) == tuple(other)
+
+    def __hash__(self):
+        return hash(tuple(self))
+
+    def __repr__(self):
+        return 'SequenceRecord(sequence={!r}, accession={!r}, genetic_code={!r})'.format(*self)
+
+
+def records_from_tuples(records):
+    # [(sequence, accession, genetic_code), ...] -> [SequenceRecord, ...]
+    return [SequenceRecord(sequence, accession, code) for sequence, accession, code in records]
+
+
+def records_from_fasta(source, genetic_code=1):
+    # one SequenceRecord per FASTA record
+    #   - the accession is the header up to the first space
+    #   - genetic_code is given for the whole file (FASTA has no place for it)
+    return [SequenceRecord(sequence.decode(), (header.split() or [''])[0], genetic_code)
+            for header, sequence in iter_records(source)]
+
+
+def records_from_csv(source, header=True):
+    # one SequenceRecord per CSV row: sequence, accession, genetic_code
+    #   - with header=True the first row names the columns, in any order
+    #     ('name' is accepted for the sequence, as in the list of dicts)
+    handle, should_close = open_source(source)
+    text = io.TextIOWrapper(handle, newline='')
+    try:
+        rows = csv.reader(text)
+        columns = (0, 1, 2)
+        if header:
+            names = [name.strip().lower() for name in next(rows, [])]
+            names = ['sequence' if name == 'name' else name for name in names]
+            try:
+                columns = tuple(names.index(field) for field in SequenceRecord.__slots__)
+            except ValueError:
+                raise ValueError('the CSV header needs sequence (or name), accession and genetic_code columns')
+        s, a, g = columns
+        return [SequenceRecord(row[s], row[a], int(row[g])) for row in rows if row]
+    finally:
+        # closing the wrapper would also close a file object that belongs to the caller
+        if should_close:
+            text.close()
+        else:
+            text.detach()
+
+
+if __name__ == '__main__':
+    import sys
+    import time
+    import tracemalloc
+    from collections import namedtuple
+
+    records = records_from_tuples([
+        ('actgctagt', 'ABC123', 1),
+        ('ttaggttta', 'XYZ456', 2),
+        ('atgctactg', 'PQR789', 3)
+    ])
+    for record in records:
+        (this_sequence, this_accession, this_code) = record
+        print('accession number: ' + record.accession, 'genetic code: ' + str(this_code))
+
+    # Memory and construction time for a million records
+    #   - the strings are shared by every version, so only the containers are measured
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 1_000_000
+    sequences = ['actgctagt'] * n
+    accessions = ['ACC%07d' % i for i in range(n)]
+    codes = [i % 25 + 1 for i in range(n)]
+    NamedRecord = namedtuple('NamedRecord', SequenceRecord.__slots__)
+    makers = {
+        'dict': lambda: [{'name': s, 'accession': a, 'genetic_code': c} for s, a, c in zip(sequences, accessions, codes)],
+        'tuple': lambda: list(zip(sequences, accessions, codes)),
+        'namedtuple': lambda: [NamedRecord(s, a, c) for s, a, c in zip(sequences, accessions, codes)],
+        'SequenceRecord': lambda: [SequenceRecord(s, a, c) for s, a, c in zip(sequences, accessions, codes)],
+    }
+    for name, make in makers.items():
+        start = time.perf_counter()
+        built = make()
+        elapsed = time.perf_counter() - start
+        del built
+        tracemalloc.start()
+        built = make()
+        size = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+        del built
+        print('{:>15}: {:5.1f} bytes/record, {:.2f}s to build'.format(name, size / n, elapsed))
@@ -0,0 +1,348 @@
+#----------------- MinHash sketches for comparing many genomes ------------------------#
+
+# Comparing two sequences through their kmer2count dicts needs every k-mer of both
+#   - tens of thousands of genomes is hundreds of millions of pairs of huge dicts
+# Here: every genome is boiled down to a small sketch once
+#   - k-mers come from kmer_count (2-bit codes, canonical by default) and are hashed (splitmix64)
+#   - bottom-k MinHash: the `size` smallest distinct hashes; all sketches have the same size,
+#     so a set of them is one (genomes x size) uint64 array (EMPTY pads genomes with fewer k-mers)
+#   - the Jaccard index of two genomes is estimated from the bottom `size` hashes of the union
+#     of their sketches: the fraction found in both (as Mash does)
+#   - Mash distance -1/k * ln(2J / (1 + J)) approximates the per-base mutation rate
+#   - optionally also the minimizer set (smallest hash of every window of `window` k-mers),
+#     a much bigger, position-aware sample, stored as one flat array plus offsets
+# All-vs-all: the pairs are cut into blocks of genomes, every pair of a block is done at once
+# (the two sorted sketches of a pair are merged by one stable sort), blocks go to a process pool
+# Sketches are saved to (and memory-mapped from) one file with arrayfile
+
+import os
+from multiprocessing import Pool
+
+import numpy as np
+
+from arrayfile import load_arrays, save_arrays
+from fasta import DEFAULT_CHUNK_SIZE, iter_sequence_chunks
+from kmer_count import encode_bases, kmer_codes_in
+from kmer_count_parallel import iter_overlapping_pieces
+
+
+KIND = 'sketches'
+EMPTY = np.uint64(2 ** 64 - 1)  # padding of sketches with fewer than `size` hashes
+DEFAULT_K = 21
+DEFAULT_SIZE = 1000
+DEFAULT_SEED = 42
+DEFAULT_BLOCK = 32  # genomes per side of an all-vs-all block
+
+
+def hash_codes(codes, seed=DEFAULT_SEED):
+    # k-mer codes -> 64-bit hashes (splitmix64 of the code, offset by the seed)
+    values = codes.astype(np.uint64) + np.uint64((seed * 0x9e3779b97f4a7c15) % 2 ** 64)
+    values ^= values >> np.uint64(30)
+    values *= np.uint64(0xbf58476d1ce4e5b9)
+    values ^= values >> np.uint64(27)
+    values *= np.uint64(0x94d049bb133111eb)
+    values ^= values >> np.uint64(31)
+    return values
+
+
+def bottom_k(hashes, size):
+    # the `size` smallest distinct values, sorted
+    #   - np.partition first, so only a few more than `size` values are ever sorted
+    kth = 2 * size
+    while kth < len(hashes):
+        smallest = np.unique(np.partition(hashes, kth)[:kth + 1])
+        if len(smallest) >= size:
+            return smallest[:size]
+        kth *= 4  # many repeated k-mers, look further
+    return np.unique(hashes)[:size]
+
+
+def window_minima(hashes, positions, window):
+    # smallest hash of every `window` consecutive k-mers that sit next to each other in the sequence
+    #   - k-mers dropped for N and friends break the run, windows across the gap are skipped
+    if len(hashes) < window:
+        return np.zeros(0, dtype=np.uint64)
+    minima = np.lib.stride_tricks.sliding_window_view(hashes, window).min(axis=1)
+    contiguous = positions[window - 1:] - positions[:len(positions) - window + 1] == window - 1
+    return minima[contiguous]
+
+
+class _SketchBuilder:
+    # one genome, fed piece by piece
+
+    def __init__(self, k, size, canonical, seed, window):
+        self.k = k
+        self.size = size
+        self.canonical = canonical
+        self.seed = seed
+        self.window = window
+        self.bottom = np.zeros(0, dtype=np.uint64)
+        self.minimizers = []
+        self.kmers = 0
+
+    def update(self, piece):
+        codes, positions = kmer_codes_in(encode_bases(piece), self.k, self.canonical, return_positions=True)
+        hashes = hash_codes(codes, self.seed)
+        self.kmers += len(hashes)
+        if self.window:
+            self.minimizers.append(np.unique(window_minima(hashes, positions, self.window)))
+        # once the sketch is full only hashes below its largest can change it
+        if len(self.bottom) >= self.size:
+            hashes = hashes[hashes < self.bottom[-1]]
+        if len(hashes):
+            self.bottom = bottom_k(np.concatenate((self.bottom, hashes)), self.size)
+
+    def result(self):
+        minimizers = np.unique(np.concatenate(self.minimizers)) if self.minimizers else np.zeros(0, dtype=np.uint64)
+        return self.bottom, minimizers if self.window else None
+
+
+def _span(k, window):
+    # bases a piece must share with the previous one, so no k-mer (or window of k-mers) is lost
+    return k + (window - 1 if window else 0)
+
+
+def _sketch_file(task):
+    source, k, size, canonical, seed, window, chunk_size = task
+    builder = _SketchBuilder(k, size, canonical, seed, window)
+    for piece in iter_overlapping_pieces(iter_sequence_chunks(source, chunk_size), _span(k, window)):
+        builder.update(piece)
+    return builder.result()
+
+
+def _sketch_sequence(task):
+    sequence, k, size, canonical, seed, window = task
+    builder = _SketchBuilder(k, size, canonical, seed, window)
+    builder.update(sequence)
+    return builder.result()
+
+
+def jaccard_block(a, b, size):
+    # estimated Jaccard index of every sketch in a (rows) against every sketch in b (rows)
+    #   - a: (p, size), b: (q, size), sorted, EMPTY padded -> (p, q) float64
+    p, q = len(a), len(b)
+    merged = np.concatenate((np.broadcast_to(a[:, None, :], (p, q, size)),
+                             np.broadcast_to(b[None, :, :], (p, q, size))), axis=2).reshape(p * q, 2 * size)
+    # two sorted runs side by side: the stable sort (timsort) just merges them
+    merged.sort(axis=1, kind='stable')
+    valid = merged != EMPTY
+    shared = np.zeros(merged.shape, dtype=bool)
+    shared[:, 1:] = (merged[:, 1:] == merged[:, :-1]) & valid[:, 1:]
+    first = valid & ~shared  # every value of the union once
+    rank = np.cumsum(first, axis=1)  # 1-based rank in the union (a shared copy has its first copy's rank)
+    union = np.minimum(first.sum(axis=1), size)
+    in_both = (shared & (rank <= union[:, None])).sum(axis=1)
+    return (in_both / np.maximum(union, 1)).reshape(p, q)
+
+
+def mash_distance(jaccard, k):
+    # Mash distance from Jaccard index (1 when nothing is shared)
+    jaccard = np.asarray(jaccard, dtype=np.float64)
+    with np.errstate(divide='ignore'):
+        distance = np.log((1 + jaccard) / (2 * jaccard)) / k
+    return np.minimum(distance, 1.0)
+
+
+def minimizer_jaccard(a, b):
+    # exact Jaccard index of two minimizer sets (sorted, distinct)
+    union = len(a) + len(b)
+    shared = len(np.intersect1d(a, b, assume_unique=True))
+    return shared / (union - shared) if union else 0.0
+
+
+_worker_values = None
+
+
+def _init_worker(values, size):
+    global _worker_values
+    _worker_values = (values, size)
+
+
+def _jaccard_task(block):
+    i0, i1, j0, j1 = block
+    values, size = _worker_values
+    return block, jaccard_block(values[i0:i1], values[j0:j1], size)
+
+
+class Sketches:
+
+    def __init__(self, names, values, k=DEFAULT_K, canonical=True, seed=DEFAULT_SEED,
+                 window=None, minimizers=None, minimizer_offsets=None):
+        # values[i] is the sketch of genome names[i]: its smallest hashes, then EMPTY
+        # minimizers[minimizer_offsets[i]:minimizer_offsets[i + 1]] its minimizer set (if window)
+        self.names = list(names)
+        self.values = values
+        self.size = values.shape[1]
+        self.k = k
+        self.canonical = canonical
+        self.seed = seed
+        self.window = window
+        self.minimizers = minimizers
+        self.minimizer_offsets = minimizer_offsets
+
+    # ---Building
+
+    @classmethod
+    def _from_results(cls, names, results, size, k, canonical, seed, window):
+        values = np.full((len(results), size), EMPTY, dtype=np.uint64)
+        sets = []
+        for i, (bottom, minimizers) in enumerate(results):
+            values[i, :len(bottom)] = bottom
+            sets.append(minimizers)
+        if not window:
+            return cls(names, values, k, canonical, seed)
+        offsets = np.zeros(len(sets) + 1, dtype=np.int64)
+        offsets[1:] = np.cumsum([len(s) for s in sets])
+        minimizers = np.concatenate(sets) if sets else np.zeros(0, dtype=np.uint64)
+        return cls(names, values, k, canonical, seed, window, minimizers, offsets)
+
+    @classmethod
+    def from_sequences(cls, sequences, k=DEFAULT_K, size=DEFAULT_SIZE, canonical=True, seed=DEFAULT_SEED,
+                       window=None, processes=1):
+        # sequences: {name: sequence} or (name, sequence) pairs, one genome each
+        items = list(sequences.items() if hasattr(sequences, 'items') else sequences)
+        tasks = [(sequence, k, size, canonical, seed, window) for _, sequence in items]
+        results = _map(_sketch_sequence, tasks, processes)
+        return cls._from_results([name for name, _ in items], results, size, k, canonical, seed, window)
+
+    @classmethod
+    def from_files(cls, paths, k=DEFAULT_K, size=DEFAULT_SIZE, canonical=True, seed=DEFAULT_SEED,
+                   window=None, processes=None, chunk_size=DEFAULT_CHUNK_SIZE):
+        # one genome per FASTA file (all its records together), one file per worker task
+        paths = list(paths)
+        tasks = [(path, k, size, canonical, seed, window, chunk_size) for path in paths]
+        results = _map(_sketch_file, tasks, processes)
+        names = [os.path.basename(str(path)) for path in paths]
+        return cls._from_results(names, results, size, k, canonical, seed, window)
+
+    # ---Saving
+
+    def save(self, path):
+        arrays = {'values': self.values,
+                  'names': np.array([name.encode() for name in self.names] or [b''], dtype=bytes)}
+        if self.window:
+            arrays['minimizers'] = self.minimizers
+            arrays['minimizer_offsets'] = self.minimizer_offsets
+        save_arrays(path, arrays, {'kind': KIND, 'k': self.k, 'canonical': self.canonical, 'seed': self.seed,
+                                   'window': self.window, 'genomes': len(self.names)})
+
+    @classmethod
+    def load(cls, path, mmap=True):
+        arrays, meta = load_arrays(path, mmap)
+        if meta.get('kind') != KIND:
+            raise ValueError(str(path) + ' is not a saved set of sketches')
+        names = [name.decode() for name in arrays['names'][:meta['genomes']].tolist()]
+        return cls(names, arrays['values'], meta['k'], meta['canonical'], meta['seed'], meta['window'],
+                   arrays.get('minimizers'), arrays.get('minimizer_offsets'))
+
+    # ---Looking things up
+
+    def __len__(self):
+        return len(self.names)
+
+    def sketch(self, i):
+        row = self.values[i]
+        return row[row != EMPTY]
+
+    def minimizer_set(self, i):
+        if not self.window:
+            raise ValueError('these sketches were built without minimizers (window=None)')
+        return self.minimizers[self.minimizer_offsets[i]:self.minimizer_offsets[i + 1]]
+
+    def _check(self, other):
+        if (other.k, other.size, other.canonical, other.seed) != (self.k, self.size, self.canonical, self.seed):
+            raise ValueError('sketches built with different k, size, canonical or seed cannot be compared')
+
+    # ---Comparing
+
+    def jaccard(self, i, j, other=None):
+        # estimated Jaccard index of genome i here and genome j (here, or in other)
+        other = self if other is None else other
+        self._check(other)
+        return float(jaccard_block(self.values[i:i + 1], other.values[j:j + 1], self.size)[0, 0])
+
+    def mash_distance(self, i, j, other=None):
+        return float(mash_distance(self.jaccard(i, j, other), self.k))
+
+    def jaccard_matrix(self, processes=None, block_size=DEFAULT_BLOCK):
+        # all-vs-all estimated Jaccard index, (genomes x genomes) float32
+        #   - only blocks on and above the diagonal are computed, then mirrored
+        n = len(self)
+        starts = list(range(0, n, block_size))
+        blocks = [(i, min(i + block_size, n), j, min(j + block_size, n)) for i in starts for j in starts if j >= i]
+        result = np.zeros((n, n), dtype=np.float32)
+        processes = processes or os.cpu_count() or 1
+        values = np.ascontiguousarray(self.values)
+        if processes > 1 and len(blocks) > 1:
+            with Pool(processes, initializer=_init_worker, initargs=(values, self.size)) as pool:
+                done = pool.imap_unordered(_jaccard_task, blocks, chunksize=max(1, len(blocks) // (8 * processes)))
+                for (i0, i1, j0, j1), block in done:
+                    result[i0:i1, j0:j1] = block
+                    result[j0:j1, i0:i1] = block.T
+        else:
+            for i0, i1, j0, j1 in blocks:
+                block = jaccard_block(values[i0:i1], values[j0:j1], self.size)
+                result[i0:i1, j0:j1] = block
+                result[j0:j1, i0:i1] = block.T
+        return result
+
+    def distance_matrix(self, processes=None, block_size=DEFAULT_BLOCK):
+        # all-vs-all Mash distances, (genomes x genomes) float32
+        return mash_distance(self.jaccard_matrix(processes, block_size), self.k).astype(np.float32)
+
+
+def _map(function, tasks, processes):
+    processes = processes or os.cpu_count() or 1
+    if processes > 1 and len(tasks) > 1:
+        with Pool(min(processes, len(tasks))) as pool:
+            return pool.map(function, tasks)
+    return [function(task) for task in tasks]
+
+
+if __name__ == '__main__':
+    import sys
+    import tempfile
+    import time
+
+    # Genomes that are mutated copies of one ancestor: the Mash distance should track the mutation rate
+    n_genomes = int(sys.argv[1]) if len(sys.argv) > 1 else 400
+    length = 200_000
+    rng = np.random.default_rng(0)
+    bases = np.frombuffer(b'ACGT', dtype=np.uint8)
+    ancestor = rng.integers(0, 4, length)
+    rates = np.linspace(0, 0.2, n_genomes)
+    genomes = {}
+    for i, rate in enumerate(rates):
+        genome = ancestor.copy()
+        mutated = rng.random(length) < rate
+        genome[mutated] = (genome[mutated] + rng.integers(1, 4, int(mutated.sum()))) % 4
+        genomes['genome{}'.format(i)] = bases[genome].tobytes()
+
+    start = time.perf_counter()
+    sketches = Sketches.from_sequences(genomes, window=10, processes=None)
+    print('{} genomes sketched in {:.2f}s'.format(n_genomes, time.perf_counter() - start))
+
+    # the estimates against the exact k-mer Jaccard index (what comparing full k-mer dicts gives)
+    def kmer_set(sequence):
+        return set(kmer_codes_in(encode_bases(sequence), DEFAULT_K, canonical=True).tolist())
+
+    exact_first = kmer_set(genomes['genome0'])
+    for i in [1, n_genomes // 4, n_genomes // 2, n_genomes - 1]:
+        other = kmer_set(genomes['genome{}'.format(i)])
+        exact = len(exact_first & other) / len(exact_first | other)
+        print('mutation rate {:.3f}: Jaccard exact {:.4f}, sketch {:.4f}, minimizers {:.4f}, Mash distance {:.4f}'.format(
+            rates[i], exact, sketches.jaccard(0, i),
+            minimizer_jaccard(sketches.minimizer_set(0), sketches.minimizer_set(i)), sketches.mash_distance(0, i)))
+
+    for processes in sorted({1, os.cpu_count() or 1}):
+        start = time.perf_counter()
+        distances = sketches.distance_matrix(processes=processes)
+        elapsed = time.perf_counter() - start
+        print('all-vs-all on {} process(es): {:.2f}s, {:.0f} pairs/s'.format(
+            processes, elapsed, n_genomes * (n_genomes - 1) / 2 / elapsed))
+
+    path = os.path.join(tempfile.mkdtemp(), 'genomes.sketch')
+    sketches.save(path)
+    loaded = Sketches.load(path)
+    assert loaded.names == sketches.names and np.array_equal(loaded.distance_matrix(processes=1), distances)
+    print('saved {} genomes in {:.0f} KB'.format(len(loaded), os.path.getsize(path) / 1024))
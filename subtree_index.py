@@ -0,0 +1,243 @@
+#----------------- Subtree queries with nested intervals ------------------------#
+
+# get_children / get_children_rec walk the whole subtree on every call
+#   - "is X under Y" should not need a traversal at all
+# Here: every taxon gets an interval [left, right] (a nested set)
+#   - the interval of a child sits strictly inside the interval of its parent
+#   - X is under Y  <=>  left[Y] <= left[X] and right[X] <= right[Y]
+#   - sorting taxa by left puts every subtree in one contiguous slice
+# The numbers are spread out with big gaps, so a new taxon usually fits
+# into the gap of its parent without touching anybody else
+#   - when a gap runs out, only the smallest enclosing subtree with room to spare
+#     is renumbered, the rest of the tree keeps its numbers
+#   - "room to spare" means about gap numbers per member for a small subtree, so a
+#     renumbered subtree can take many more inserts before it runs out again
+# The taxa sorted by left are kept up to date as the tree grows: an insert goes into its
+# sorted place, a renumbering keeps the order of the subtree it renumbers
+
+import numpy as np
+
+from taxonomy import Taxonomy
+
+
+# Distance between neighbouring numbers after a (re)numbering
+DEFAULT_GAP = 1 << 20
+# A subtree is renumbered in place only if it has at least this much room per number
+_MIN_SPACING = 8
+
+
+class SubtreeIndex:
+
+    def __init__(self, taxonomy=None, gap=DEFAULT_GAP):
+        # node 0 is a virtual root above all real roots, so a forest is one tree
+        self.names = [None]
+        self.ids = {}
+        self.gap = gap
+        self._n = 1
+        capacity = 16
+        self.parent = np.zeros(capacity, dtype=np.int64)
+        self.left = np.zeros(capacity, dtype=np.int64)
+        self.right = np.zeros(capacity, dtype=np.int64)
+        # tail[i]: largest number used inside the interval of i (its last child's right)
+        self.tail = np.zeros(capacity, dtype=np.int64)
+        self._order = None
+        self.relabels = 0
+        if taxonomy is not None:
+            self._load(taxonomy)
+        else:
+            self.right[0] = gap
+
+    @classmethod
+    def from_parent_to_children(cls, children_dict, gap=DEFAULT_GAP):
+        return cls(Taxonomy.from_parent_to_children(children_dict), gap)
+
+    @classmethod
+    def from_child_to_parent(cls, tax_dict, gap=DEFAULT_GAP):
+        return cls(Taxonomy.from_child_to_parent(tax_dict), gap)
+
+    def _load(self, taxonomy):
+        # Numbers straight from the pre-order numbers of a Taxonomy
+        #   - in the bracket sequence of a depth-first walk, node i opens at 2 * pre - depth
+        #     and closes 2 * size - 1 steps later
+        n = len(taxonomy)
+        self._grow(n + 1)
+        self.names.extend(taxonomy.names)
+        self.ids = {name: i + 1 for i, name in enumerate(taxonomy.names)}
+        self._n = n + 1
+        parent = np.where(taxonomy.is_root, -1, taxonomy.parent) + 1
+        opens = 2 * taxonomy.pre - taxonomy.depth + 1
+        self.parent[1:n + 1] = parent
+        self.left[1:n + 1] = opens * self.gap
+        self.right[1:n + 1] = (opens + 2 * taxonomy.size - 1) * self.gap
+        self.left[0] = 0
+        self.right[0] = (2 * n + 1) * self.gap
+        self._reset_tails(np.arange(n + 1))
+
+    # ---Growing the tree
+
+    def add(self, taxon, parent=None):
+        # adds a new leaf under parent (or as a new root), without a rebuild
+        if taxon in self.ids:
+            raise ValueError(repr(taxon) + ' is already in the index')
+        parent_id = 0 if parent is None else self.ids[parent]
+        if self.right[parent_id] - self.tail[parent_id] < 4:
+            self._make_room(parent_id)
+        # the new leaf takes the first half of the free space, the second half stays free
+        # for the next sibling
+        free = self.right[parent_id] - self.tail[parent_id]
+        node = self._n
+        self._grow(node + 1)
+        self._n += 1
+        self.names.append(taxon)
+        self.ids[taxon] = node
+        self.parent[node] = parent_id
+        self.left[node] = self.tail[parent_id] + 1
+        self.right[node] = self.tail[parent_id] + free // 2
+        self.tail[node] = self.left[node]
+        self.tail[parent_id] = self.right[node]
+        if self._order is not None:
+            # the new left is bigger than every left in the parent's subtree and smaller than
+            # every left after it, so it goes straight into its sorted place
+            order, lefts = self._order
+            i = int(np.searchsorted(lefts, self.left[node]))
+            self._order = (np.insert(order, i, node), np.insert(lefts, i, self.left[node]))
+        return node
+
+    def _make_room(self, node):
+        # Renumber the smallest enclosing subtree that has room for its members
+        #   - ancestors are checked a stretch at a time (each stretch twice as long as the
+        #     one before), so a long chain of new taxa is not climbed one searchsorted per level
+        order, lefts = self._sorted()
+        stretch = 64
+        while True:
+            path = [node]
+            while path[-1] != 0 and len(path) < stretch:
+                path.append(int(self.parent[path[-1]]))
+            path = np.array(path)
+            sizes = np.searchsorted(lefts, self.right[path], side='right') - np.searchsorted(lefts, self.left[path])
+            if path[-1] == 0:
+                sizes[-1] = self._n
+            room = (self.right[path] - self.left[path]) >= self._room_needed(sizes)
+            if room.any():
+                node = int(path[np.argmax(room)])
+                break
+            if path[-1] == 0:
+                # the whole tree is full: stretch the root interval
+                node = 0
+                self.right[0] = self.left[0] + max(self.gap, _MIN_SPACING) * 2 * (self._n + 1)
+                break
+            node = int(self.parent[path[-1]])
+            stretch *= 2
+        self._renumber(node, self._subtree_ids(node))
+
+    def _room_needed(self, n_members):
+        # span a subtree needs before it is renumbered in place
+        #   - small subtrees: about gap numbers per member, so the renumbering is worth it
+        #   - big ones: at least _MIN_SPACING per bracket, so one insert never renumbers the tree
+        return 2 * (n_members + 1) * np.maximum(_MIN_SPACING, self.gap // n_members)
+
+    def _renumber(self, node, members):
+        # spread the brackets of node's subtree evenly, node keeps its own numbers
+        inner = members[1:]
+        bounds = np.concatenate((self.left[inner], self.right[inner]))
+        order = np.argsort(bounds, kind='stable')
+        spacing = (self.right[node] - self.left[node]) // (len(bounds) + 2)
+        new_bounds = np.empty_like(bounds)
+        new_bounds[order] = self.left[node] + spacing * np.arange(1, len(bounds) + 1)
+        self.left[inner] = new_bounds[:len(inner)]
+        self.right[inner] = new_bounds[len(inner):]
+        self._reset_tails(members)
+        self.relabels += 1
+        if self._order is not None:
+            # the subtree keeps its slice of the sorted order and its order inside it,
+            # only the numbers change
+            order, lefts = self._order
+            start = 0 if node == 0 else int(np.searchsorted(lefts, self.left[node]))
+            stop = len(order) if node == 0 else start + len(members)
+            lefts[start:stop] = self.left[order[start:stop]]
+
+    def _reset_tails(self, nodes):
+        self.tail[nodes] = self.left[nodes]
+        children = nodes[self.parent[nodes] != nodes]
+        children = children[children != 0]
+        np.maximum.at(self.tail, self.parent[children], self.right[children])
+
+    def _grow(self, size):
+        if size <= len(self.parent):
+            return
+        capacity = max(size, 2 * len(self.parent))
+        for name in ('parent', 'left', 'right', 'tail'):
+            old = getattr(self, name)
+            new = np.zeros(capacity, dtype=old.dtype)
+            new[:len(old)] = old
+            setattr(self, name, new)
+
+    # ---Queries
+
+    def __len__(self):
+        return self._n - 1
+
+    def __contains__(self, taxon):
+        return taxon in self.ids
+
+    def _sorted(self):
+        # node ids by left, rebuilt lazily after the tree changed
+        if self._order is None:
+            order = np.argsort(self.left[1:self._n], kind='stable') + 1
+            self._order = (order, self.left[order])
+        return self._order
+
+    def _subtree_ids(self, node):
+        if node == 0:
+            return np.arange(self._n)
+        order, lefts = self._sorted()
+        start = np.searchsorted(lefts, self.left[node], side='left')
+        stop = np.searchsorted(lefts, self.right[node], side='right')
+        return order[start:stop]
+
+    def is_descendant(self, taxon, ancestor):
+        # is taxon in the subtree of ancestor (a taxon counts as its own descendant)
+        node = self.ids[taxon]
+        above = self.ids[ancestor]
+        return bool(self.left[above] <= self.left[node] and self.right[node] <= self.right[above])
+
+    def is_descendant_ids(self, nodes, ancestors):
+        # element-wise version on arrays of ids
+        nodes = np.asarray(nodes)
+        ancestors = np.asarray(ancestors)
+        return (self.left[ancestors] <= self.left[nodes]) & (self.right[nodes] <= self.right[ancestors])
+
+    def descendant_ids(self, taxon):
+        return self._subtree_ids(self.ids[taxon])
+
+    def get_children(self, taxon):
+        # like get_children_rec: the taxon and everything below it, depth-first
+        return [self.names[i] for i in self.descendant_ids(taxon).tolist()]
+
+    def count_descendants(self, taxon):
+        return len(self.descendant_ids(taxon)) - 1
+
+
+if __name__ == '__main__':
+
+    new_tax_dict = {
+        'Primates': ['Haplorrhini', 'Strepsirrhini'],
+        'Tarsiiformes': ['Tarsius tarsier'],
+        'Haplorrhini': ['Tarsiiformes', 'Simiiformes'],
+        'Simiiformes': ['Hominoidea'],
+        'Lorisidae': ['Loris tardigradus'],
+        'Lemuriformes': ['Allocebus trichotis'],
+        'Lorisiformes': ['Galago alleni', 'Galago moholi'],
+        'Hominoidea': ['Pongo abelii', 'Pan troglodytes'],
+        'Strepsirrhini': ['Lorisidae', 'Lemuriformes', 'Lorisiformes']
+    }
+
+    index = SubtreeIndex.from_parent_to_children(new_tax_dict)
+    print(index.get_children('Strepsirrhini'))
+    print(index.is_descendant('Galago moholi', 'Strepsirrhini'))  # True
+    print(index.is_descendant('Pongo abelii', 'Strepsirrhini'))  # False
+
+    # new taxa slot into the gaps, no rebuild
+    index.add('Homo', 'Hominoidea')
+    index.add('Homo sapiens', 'Homo')
+    print(index.get_children('Hominoidea'), index.relabels)
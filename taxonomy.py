@@ -0,0 +1,294 @@
+#----------------- Array-backed taxonomy ------------------------#
+
+# tax_dict (child -> parent) and new_tax_dict (parent -> list of children)
+# key everything by full taxon names
+#   - every step of get_ancestors / get_children hashes a long string
+#   - every node costs a dict entry, and a list object for its children
+# Here: names are swapped for dense integer ids once, and the tree lives in arrays
+#   - parent[i]                               parent of node i (roots point to themselves)
+#   - children[child_offsets[i]:child_offsets[i + 1]]  children of node i (CSR)
+#   - depth[i]                                number of steps up to the root
+#   - pre[i], post[i]                         pre-order and post-order numbers
+#   - size[i]                                 number of nodes in the subtree of i
+# A subtree is one contiguous run of pre-order numbers: pre[i] up to pre[i] + size[i]
+
+from collections.abc import Mapping
+
+import numpy as np
+
+from arrayfile import load_arrays, save_arrays
+
+
+class Taxonomy:
+
+    # everything save() writes and load() maps back, besides the names
+    _ARRAYS = ('parent', 'is_root', 'roots', 'children', 'child_offsets', 'depth', 'size', 'pre', 'post', 'by_pre')
+
+    def __init__(self, parent, names, sibling_order=None):
+        # sibling_order: non-root ids in the order children should be listed (default: by id)
+        self.names = list(names)
+        self._ids = None
+        self._lca_index = None
+        parent = np.asarray(parent, dtype=np.int64)
+        if len(parent) != len(self.names):
+            raise ValueError('need exactly one name per node')
+        self.parent = parent
+        n = len(parent)
+        nodes = np.arange(n)
+        self.is_root = parent == nodes
+        self.roots = np.flatnonzero(self.is_root)
+
+        # children in CSR layout, in the order they were added
+        non_roots = np.flatnonzero(~self.is_root) if sibling_order is None else np.asarray(sibling_order, dtype=np.int64)
+        self.children = non_roots[np.argsort(parent[non_roots], kind='stable')]
+        self.child_offsets = np.searchsorted(parent[self.children], np.arange(n + 1)).astype(np.int64)
+
+        self.depth = _path_sums(parent, (~self.is_root).astype(np.int64))
+        if len(self.depth) and np.any(self.depth < 0):
+            raise ValueError('the parent links contain a cycle')
+        self.size = _subtree_sizes(parent, self.depth)
+
+        # pre-order number = pre-order number of the parent + 1 + sizes of the earlier siblings
+        weight = np.zeros(n, dtype=np.int64)
+        sibling_sizes = self.size[self.children]
+        before = np.concatenate(([0], np.cumsum(sibling_sizes)[:-1]))
+        first_child = self.child_offsets[parent[self.children]]
+        weight[self.children] = 1 + before - before[first_child]
+        root_sizes = self.size[self.roots]
+        weight[self.roots] = np.concatenate(([0], np.cumsum(root_sizes)[:-1]))
+        self.pre = _path_sums(parent, weight)
+        self.post = self.pre - self.depth + self.size - 1
+        self.by_pre = np.empty(n, dtype=np.int64)
+        self.by_pre[self.pre] = nodes
+
+    # ---Building from the dict forms
+
+    @classmethod
+    def from_child_to_parent(cls, tax_dict):
+        # tax_dict like {'Pongo abelii': 'Hominidae', ...}
+        ids = {}
+        pairs = []
+        for child, parent in tax_dict.items():
+            pairs.append((ids.setdefault(child, len(ids)), ids.setdefault(parent, len(ids))))
+        return cls(_parent_array(len(ids), pairs), ids)
+
+    @classmethod
+    def from_parent_to_children(cls, children_dict):
+        # new_tax_dict like {'Primates': ['Haplorrhini', 'Strepsirrhini'], ...}
+        ids = {}
+        pairs = []
+        for parent, children in children_dict.items():
+            parent_id = ids.setdefault(parent, len(ids))
+            for child in children:
+                pairs.append((ids.setdefault(child, len(ids)), parent_id))
+        return cls(_parent_array(len(ids), pairs), ids, [child for child, parent in pairs])
+
+    # ---Saving and loading
+    #   - load() maps the arrays straight back, nothing is recomputed
+
+    def save(self, path):
+        arrays = {name: getattr(self, name) for name in self._ARRAYS}
+        if all(isinstance(name, (int, np.integer)) for name in self.names):
+            arrays['names'] = np.array(self.names, dtype=np.int64)
+            names_kind = 'int'
+        else:
+            # one blob of text, one name per line
+            arrays['names'] = np.frombuffer('\n'.join(map(str, self.names)).encode(), dtype=np.uint8)
+            names_kind = 'str'
+        save_arrays(path, arrays, {'kind': 'taxonomy', 'names': names_kind})
+
+    @classmethod
+    def load(cls, path, mmap=True):
+        arrays, meta = load_arrays(path, mmap)
+        if meta.get('kind') != 'taxonomy':
+            raise ValueError(str(path) + ' is not a saved taxonomy')
+        taxonomy = cls.__new__(cls)
+        for name in cls._ARRAYS:
+            setattr(taxonomy, name, arrays[name])
+        if meta['names'] == 'int':
+            taxonomy.names = arrays['names'].tolist()
+        else:
+            text = arrays['names'].tobytes().decode()
+            taxonomy.names = text.split('\n') if text or len(taxonomy.parent) else []
+        taxonomy._ids = None
+        taxonomy._lca_index = None
+        return taxonomy
+
+    @property
+    def ids(self):
+        # name -> id, built on first use
+        if self._ids is None:
+            self._ids = {name: i for i, name in enumerate(self.names)}
+        return self._ids
+
+    def __len__(self):
+        return len(self.names)
+
+    def __contains__(self, taxon):
+        return taxon in self.ids
+
+    # ---Both dict forms back, as read-only views
+    #   - the lesson functions only call .get(), so they run unchanged on these
+
+    def child_to_parent(self):
+        return ParentView(self)
+
+    def parent_to_children(self):
+        return ChildrenView(self)
+
+    # ---Traversal on ids
+
+    def ancestor_ids(self, node):
+        # node, its parent, ... up to the root
+        result = [node]
+        parent = self.parent
+        while parent[node] != node:
+            node = int(parent[node])
+            result.append(node)
+        return result
+
+    def children_ids(self, node):
+        return self.children[self.child_offsets[node]:self.child_offsets[node + 1]]
+
+    def descendant_ids(self, node):
+        # the whole subtree, node first, in pre-order (no traversal needed)
+        start = self.pre[node]
+        return self.by_pre[start:start + self.size[node]]
+
+    def is_descendant(self, nodes, ancestors):
+        # element-wise "is nodes[i] in the subtree of ancestors[i]", two comparisons each
+        nodes = np.asarray(nodes)
+        ancestors = np.asarray(ancestors)
+        return (self.pre[ancestors] <= self.pre[nodes]) & (self.pre[nodes] < self.pre[ancestors] + self.size[ancestors])
+
+    # ---Same questions as the lesson functions, on names
+
+    def get_ancestors(self, taxon):
+        # like get_ancestors: [taxon, parent, ..., root]
+        return [self.names[i] for i in self.ancestor_ids(self.ids[taxon])]
+
+    def get_children(self, taxon):
+        # like get_children_rec: the taxon and everything below it
+        return [self.names[i] for i in self.descendant_ids(self.ids[taxon]).tolist()]
+
+    def get_lca(self, taxon1, taxon2):
+        return self.lca_index().lca(taxon1, taxon2)
+
+    def lca_index(self):
+        # built on first use, see lca.py
+        if self._lca_index is None:
+            from lca import LcaIndex
+            self._lca_index = LcaIndex(self.parent, self.names)
+        return self._lca_index
+
+
+class ParentView(Mapping):
+    # behaves like tax_dict: child name -> parent name, roots are not keys
+
+    def __init__(self, taxonomy):
+        self.taxonomy = taxonomy
+
+    def __getitem__(self, taxon):
+        tax = self.taxonomy
+        node = tax.ids[taxon]
+        if tax.is_root[node]:
+            raise KeyError(taxon)
+        return tax.names[tax.parent[node]]
+
+    def __iter__(self):
+        names = self.taxonomy.names
+        return (names[i] for i in np.flatnonzero(~self.taxonomy.is_root).tolist())
+
+    def __len__(self):
+        return len(self.taxonomy) - len(self.taxonomy.roots)
+
+
+class ChildrenView(Mapping):
+    # behaves like new_tax_dict: parent name -> list of child names, leaves are not keys
+
+    def __init__(self, taxonomy):
+        self.taxonomy = taxonomy
+
+    def __getitem__(self, taxon):
+        tax = self.taxonomy
+        children = tax.children_ids(tax.ids[taxon])
+        if not len(children):
+            raise KeyError(taxon)
+        return [tax.names[i] for i in children.tolist()]
+
+    def __iter__(self):
+        names = self.taxonomy.names
+        return (names[i] for i in np.flatnonzero(np.diff(self.taxonomy.child_offsets)).tolist())
+
+    def __len__(self):
+        return int(np.count_nonzero(np.diff(self.taxonomy.child_offsets)))
+
+
+def _parent_array(n, pairs):
+    parent = np.arange(n, dtype=np.int64)
+    if pairs:
+        pairs = np.array(pairs, dtype=np.int64)
+        parent[pairs[:, 0]] = pairs[:, 1]
+    return parent
+
+
+def _path_sums(parent, weight):
+    # Sum of weight over every node from i up to its root (pointer jumping)
+    #   - log2(max depth) rounds of whole-array operations
+    #   - nodes caught in a cycle come back as -1
+    n = len(parent)
+    is_root = parent == np.arange(n)
+    total = np.where(is_root, 0, weight)
+    ancestor = parent.copy()
+    for _ in range(max(n, 1).bit_length() + 1):
+        jumped = ancestor[ancestor]
+        if np.array_equal(jumped, ancestor):
+            return total + weight[ancestor]
+        total = total + total[ancestor]
+        ancestor = jumped
+    total = total + weight[ancestor]
+    total[~is_root[ancestor]] = -1
+    return total
+
+
+def _subtree_sizes(parent, depth):
+    # bottom-up, one depth level at a time
+    size = np.ones(len(parent), dtype=np.int64)
+    if not len(parent):
+        return size
+    order = np.argsort(depth, kind='stable')
+    level_starts = np.searchsorted(depth[order], np.arange(depth.max() + 2))
+    for level in range(depth.max(), 0, -1):
+        nodes = order[level_starts[level]:level_starts[level + 1]]
+        np.add.at(size, parent[nodes], size[nodes])
+    return size
+
+
+if __name__ == '__main__':
+
+    new_tax_dict = {
+        'Primates': ['Haplorrhini', 'Strepsirrhini'],
+        'Tarsiiformes': ['Tarsius tarsier'],
+        'Haplorrhini': ['Tarsiiformes', 'Simiiformes'],
+        'Simiiformes': ['Hominoidea'],
+        'Lorisidae': ['Loris tardigradus'],
+        'Lemuriformes': ['Allocebus trichotis'],
+        'Lorisiformes': ['Galago alleni', 'Galago moholi'],
+        'Hominoidea': ['Pongo abelii', 'Pan troglodytes'],
+        'Strepsirrhini': ['Lorisidae', 'Lemuriformes', 'Lorisiformes']
+    }
+
+    taxonomy = Taxonomy.from_parent_to_children(new_tax_dict)
+    print(taxonomy.get_children('Strepsirrhini'))
+    print(taxonomy.get_ancestors('Pongo abelii'))
+    print(taxonomy.get_lca('Pan troglodytes', 'Tarsius tarsier'))
+
+    # the lesson's get_children only needs .get(), so it runs on the view unchanged
+    tax_view = taxonomy.parent_to_children()
+    stack = ['Strepsirrhini']
+    result = []
+    while stack:
+        current = stack.pop()
+        stack.extend(tax_view.get(current, []))
+        result.append(current)
+    print(result)
@@ -0,0 +1,50 @@
+#----------------- Tests for the positional k-mer index ------------------------#
+
+# Both layouts (dense offsets, sorted codes) against a dict of lists built one window at a time
+
+import numpy as np
+import pytest
+
+from kmer_index import KmerIndex
+
+
+def _kmer2list(sequence, k):
+    # the kmer2list loop, skipping windows with anything but ATGC
+    sequence = sequence.upper()
+    positions = {}
+    for i in range(len(sequence) - k + 1):
+        kmer = sequence[i:i + k]
+        if set(kmer) <= set('ATGC'):
+            positions.setdefault(kmer, []).append(i)
+    return positions
+
+
+@pytest.mark.parametrize('dense', [True, False])
+@pytest.mark.parametrize('k', [1, 4, 7, 8, 9])
+def test_matches_kmer2list(k, dense):
+    rng = np.random.default_rng(k)
+    sequence = ''.join(rng.choice(list('ACGTacgtN'), 2000))
+    index = KmerIndex.build(sequence, k, dense)
+    expected = _kmer2list(sequence, k)
+    assert index.to_dict() == expected
+    assert index.counts() == {kmer: len(starts) for kmer, starts in expected.items()}
+    assert len(index) == len(expected)
+
+
+@pytest.mark.parametrize('k', [4, 8])
+def test_last_dense_kmer(k):
+    # the largest code fills its dtype (uint8 at k=4, uint16 at k=8): its row + 1 used to wrap around
+    index = KmerIndex.build('C' * (k + 1), k, dense=True)
+    assert index.to_dict() == {'C' * k: [0, 1]}
+    assert index.count('C' * k) == 2
+
+
+def test_save_and_load(tmp_path):
+    for dense in (True, False):
+        index = KmerIndex.build('aattggaattggaattg', 4, dense)
+        path = tmp_path / 'example{}.kidx'.format(int(dense))
+        index.save(path)
+        loaded = KmerIndex.load(path)
+        assert loaded.to_dict() == index.to_dict()
+        assert loaded['AATT'].tolist() == [0, 6, 12]
+        assert loaded.count('GGAA') == 2
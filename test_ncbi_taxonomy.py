@@ -0,0 +1,110 @@
+#----------------- Tests for the NCBI taxonomy loader ------------------------#
+
+# The vectorised parser is checked against a plain split() of every dump line,
+# and the binary cache against a fresh parse
+
+import os
+
+import numpy as np
+import pytest
+
+from ncbi_taxonomy import NcbiTaxonomy, load_ncbi_taxonomy, write_synthetic_dump
+
+
+def _parse_lines(nodes_path, names_path):
+    # {tax id: (parent tax id, rank)} and {tax id: first scientific name}, one line at a time
+    nodes = {}
+    with open(nodes_path) as handle:
+        for line in handle:
+            fields = line.rstrip('\t|\n').split('\t|\t')
+            nodes[int(fields[0])] = (int(fields[1]), fields[2])
+    names = {}
+    with open(names_path) as handle:
+        for line in handle:
+            fields = line.rstrip('\t|\n').split('\t|\t')
+            if fields[3] == 'scientific name':
+                names.setdefault(int(fields[0]), fields[1])
+    return nodes, names
+
+
+def _check_against_lines(taxonomy, nodes, names):
+    assert sorted(taxonomy.names) == sorted(nodes)
+    assert dict(taxonomy.child_to_parent()) == {child: parent for child, (parent, _) in nodes.items() if child != parent}
+    for tax_id, (_, rank) in nodes.items():
+        assert taxonomy.rank(tax_id) == rank
+        assert taxonomy.scientific_name(tax_id) == names[tax_id]
+        assert taxonomy.tax_id_of(names[tax_id]) == tax_id
+
+
+@pytest.fixture
+def dump(tmp_path):
+    return write_synthetic_dump(os.fspath(tmp_path), n_nodes=500)
+
+
+def test_parse_matches_line_by_line(dump):
+    nodes_path, names_path = dump
+    _check_against_lines(NcbiTaxonomy.from_dumps(nodes_path, names_path), *_parse_lines(nodes_path, names_path))
+
+
+def test_lineage_follows_parents(dump):
+    nodes_path, names_path = dump
+    nodes, names = _parse_lines(nodes_path, names_path)
+    taxonomy = NcbiTaxonomy.from_dumps(nodes_path, names_path)
+    tax_id = int(taxonomy.tax_ids[-1])
+    expected = [tax_id]
+    while nodes[expected[-1]][0] != expected[-1]:
+        expected.append(nodes[expected[-1]][0])
+    assert taxonomy.get_ancestors(tax_id) == expected
+    assert taxonomy.lineage(tax_id) == [names[t] for t in expected]
+
+
+def test_reload_from_cache(dump, monkeypatch):
+    nodes_path, names_path = dump
+    cache_path = nodes_path + '.cache'
+    parsed = load_ncbi_taxonomy(nodes_path, names_path)
+    assert os.path.exists(cache_path)
+
+    # a fresh cache must be loaded, not parsed again
+    def no_parse(*args):
+        raise AssertionError('parsed the dumps although the cache is up to date')
+    monkeypatch.setattr(NcbiTaxonomy, 'from_dumps', classmethod(no_parse))
+    cached = load_ncbi_taxonomy(nodes_path, names_path)
+
+    assert cached.names == parsed.names
+    for name in NcbiTaxonomy._ARRAYS:
+        assert np.array_equal(getattr(cached, name), getattr(parsed, name)), name
+    _check_against_lines(cached, *_parse_lines(nodes_path, names_path))
+
+
+def test_stale_cache_is_rebuilt(dump, tmp_path):
+    nodes_path, names_path = dump
+    cache_path = nodes_path + '.cache'
+    old = load_ncbi_taxonomy(nodes_path, names_path)
+
+    # a different dump in the same place, written after the cache
+    write_synthetic_dump(os.fspath(tmp_path), n_nodes=300, seed=1)
+    cache_time = os.path.getmtime(cache_path)
+    for path in (nodes_path, names_path):
+        os.utime(path, (cache_time + 10, cache_time + 10))
+
+    fresh = load_ncbi_taxonomy(nodes_path, names_path)
+    assert len(fresh) == 300 != len(old)
+    _check_against_lines(fresh, *_parse_lines(nodes_path, names_path))
+    # and the cache itself now holds the new dump
+    _check_against_lines(NcbiTaxonomy.load(cache_path), *_parse_lines(nodes_path, names_path))
+
+
+def test_stale_names_dump_alone(dump):
+    # only names.dmp changed: the cache is stale too
+    nodes_path, names_path = dump
+    cache_path = nodes_path + '.cache'
+    load_ncbi_taxonomy(nodes_path, names_path)
+    with open(names_path) as handle:
+        lines = handle.read().replace('\tTaxon ', '\tRenamed ')
+    with open(names_path, 'w') as handle:
+        handle.write(lines)
+    cache_time = os.path.getmtime(cache_path)
+    os.utime(names_path, (cache_time + 10, cache_time + 10))
+
+    taxonomy = load_ncbi_taxonomy(nodes_path, names_path)
+    assert taxonomy.scientific_name(1) == 'Renamed 1'
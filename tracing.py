@@ -0,0 +1,285 @@
+#----------------- Tracing recursive calls without print ------------------------#
+
+# get_ancestors_rec(taxon, depth) and get_lca_list_visual debug by printing with a spacer
+#   - the prints are paid for on every call and have to be deleted to switch them off
+# Here: the functions stay as they are, a Tracer watches them from outside
+#   - while a Tracer is on it is hooked in with sys.setprofile and records every call
+#     of the functions it was given: depth, arguments (the node visited), result, time
+#   - while it is off nothing is hooked in at all, so the functions run at full speed
+#   - afterwards the record can be shown three ways:
+#       print_tree()    an indented call tree, like the spacer prints
+#       summary()       calls, total and own time per function
+#       write_folded()  one line per call stack with its own time, the input
+#                       flamegraph.pl and speedscope.app take
+# Only the thread that starts the tracer is traced; starting a second tracer pauses the first
+
+import reprlib
+import sys
+import time
+from collections import namedtuple
+
+
+FunctionSummary = namedtuple('FunctionSummary', ['function', 'calls', 'total_seconds', 'own_seconds'])
+
+_repr = reprlib.Repr()
+_repr.maxstring = 40
+_repr.maxother = 40
+_repr.maxlist = _repr.maxtuple = _repr.maxset = _repr.maxdict = 6
+
+
+class Call:
+    # one traced call; calls are kept in the order they started (the call tree, top-down)
+    __slots__ = ('function', 'depth', 'args', 'result', 'start', 'seconds', 'parent')
+
+    def __init__(self, function, depth, args, start, parent):
+        self.function = function
+        self.depth = depth
+        self.args = args  # repr of the arguments when the call started
+        self.result = None  # repr of the return value
+        self.start = start
+        self.seconds = None  # None while the call is running
+        self.parent = parent  # index of the calling traced call, -1 at the top
+
+    def __repr__(self):
+        return 'Call({}({}), depth={}, seconds={})'.format(self.function, self.args, self.depth, self.seconds)
+
+
+def _code(function):
+    # the code object behind a function, method, staticmethod or decorated function
+    function = getattr(function, '__func__', function)
+    function = getattr(function, '__wrapped__', function)
+    code = getattr(function, '__code__', function)
+    if not hasattr(code, 'co_code'):
+        raise TypeError('cannot trace {!r}'.format(function))
+    return code
+
+
+class Tracer:
+
+    def __init__(self, *functions, results=True):
+        # functions: the ones to record; none given records every Python function
+        # results: keep the repr of what each call returns
+        self.codes = {_code(function) for function in functions}
+        self.results = results
+        self.calls = []
+        self._stack = []  # indexes of the traced calls still running
+        self._frames = []  # and their frames
+        self._previous = None
+
+    # ---------- switching on and off ---------- #
+
+    def start(self):
+        self._previous = sys.getprofile()
+        sys.setprofile(self._profile)
+        return self
+
+    def stop(self):
+        sys.setprofile(self._previous)
+        self._previous = None
+        # calls cut off by stop() get the time they had so far
+        now = time.perf_counter()
+        for index in self._stack:
+            self.calls[index].seconds = now - self.calls[index].start
+        self._stack = []
+        self._frames = []
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def clear(self):
+        self.calls = []
+        self._stack = []
+        self._frames = []
+
+    def _profile(self, frame, event, arg):
+        if event == 'call':
+            code = frame.f_code
+            if code in _OWN_CODES or self.codes and code not in self.codes:
+                return
+            parent = self._stack[-1] if self._stack else -1
+            self._stack.append(len(self.calls))
+            self._frames.append(frame)
+            self.calls.append(Call(getattr(code, 'co_qualname', code.co_name), len(self._stack) - 1,
+                                   _arguments(frame, code), time.perf_counter(), parent))
+        elif event == 'return' and self._frames and frame is self._frames[-1]:
+            self._frames.pop()
+            call = self.calls[self._stack.pop()]
+            call.seconds = time.perf_counter() - call.start
+            if self.results:
+                call.result = _repr.repr(arg)
+
+    # ---------- looking at what was recorded ---------- #
+
+    def print_tree(self, file=None, indent=4, max_calls=None):
+        # the indented call tree: one line per call, children under their parent
+        file = file if file is not None else sys.stdout
+        for call in self.calls[:max_calls]:
+            line = '{}{}({})'.format(' ' * indent * call.depth, call.function, call.args)
+            if call.result is not None:
+                line += ' -> ' + call.result
+            if call.seconds is not None:
+                line += '  [{:.3f} ms]'.format(call.seconds * 1e3)
+            print(line, file=file)
+
+    def summary(self):
+        # FunctionSummary per function, most own time first
+        #   - total_seconds counts a recursive function once per outermost call
+        #   - own_seconds leaves out the time spent in traced calls below it
+        calls = {}
+        total = {}
+        own = {}
+        path = []  # functions of the calls above the current one
+        running = {}  # how many times each function is on that path
+        for call in self.calls:
+            while len(path) > call.depth:
+                running[path.pop()] -= 1
+            seconds = call.seconds or 0.0
+            calls[call.function] = calls.get(call.function, 0) + 1
+            own[call.function] = own.get(call.function, 0.0) + seconds
+            if call.parent >= 0:
+                parent = self.calls[call.parent]
+                own[parent.function] = own.get(parent.function, 0.0) - seconds
+            if not running.get(call.function):
+                total[call.function] = total.get(call.function, 0.0) + seconds
+            path.append(call.function)
+            running[call.function] = running.get(call.function, 0) + 1
+        rows = [FunctionSummary(function, calls[function], total.get(function, 0.0), own[function])
+                for function in calls]
+        return sorted(rows, key=lambda row: -row.own_seconds)
+
+    def print_summary(self, file=None):
+        file = file if file is not None else sys.stdout
+        print('{:<40} {:>9} {:>12} {:>12}'.format('function', 'calls', 'total ms', 'own ms'), file=file)
+        for row in self.summary():
+            print('{:<40} {:>9} {:>12.3f} {:>12.3f}'.format(
+                row.function, row.calls, row.total_seconds * 1e3, row.own_seconds * 1e3), file=file)
+
+    def folded_stacks(self):
+        # {'outer;inner;innermost': own microseconds}, stacks merged
+        own = [call.seconds or 0.0 for call in self.calls]
+        for call in self.calls:
+            if call.parent >= 0:
+                own[call.parent] -= call.seconds or 0.0
+        stacks = []
+        folded = {}
+        for call, seconds in zip(self.calls, own):
+            stack = (stacks[call.parent] + ';' if call.parent >= 0 else '') + call.function
+            stacks.append(stack)
+            folded[stack] = folded.get(stack, 0.0) + seconds * 1e6
+        return folded
+
+    def write_folded(self, path):
+        # flame graph input: 'a;b;c 123' per line (flamegraph.pl out.folded > out.svg, or speedscope.app)
+        with open(path, 'w') as handle:
+            for stack, microseconds in self.folded_stacks().items():
+                handle.write('{} {}\n'.format(stack, max(0, int(round(microseconds)))))
+
+
+def _arguments(frame, code):
+    # repr of the positional arguments, self/cls left out
+    names = code.co_varnames[:code.co_argcount]
+    if names and names[0] in ('self', 'cls'):
+        names = names[1:]
+    values = frame.f_locals
+    return ', '.join(_repr.repr(values[name]) for name in names if name in values)
+
+
+# the tracer's own methods that run while it is switched on
+_OWN_CODES = {Tracer.stop.__code__, Tracer.__exit__.__code__}
+
+
+def trace(function, *args, **kwargs):
+    # call function(*args) with a Tracer on it -> (result, tracer)
+    with Tracer(function) as tracer:
+        result = function(*args, **kwargs)
+    return result, tracer
+
+
+if __name__ == '__main__':
+    import os
+    import tempfile
+
+    tax_dict = {
+        'Pongo abelii': 'Hominidae',
+        'Pan troglodytes': 'Hominidae',
+        'Hominidae': 'Simiiformes',
+        'Simiiformes': 'Haplorrhini',
+        'Tarsius tarsier': 'Tarsiiformes',
+        'Tarsiiformes': 'Haplorrhini',
+        'Haplorrhini': 'Primates',
+        'Galago alleni': 'Lorisiformes',
+        'Lorisiformes': 'Strepsirrhini',
+        'Strepsirrhini': 'Primates',
+    }
+
+    def get_ancestors_rec(taxon):
+        if taxon == 'Primates':
+            return []
+        parent = tax_dict.get(taxon)
+        return [parent] + get_ancestors_rec(parent)
+
+    def get_ancestors(taxon):
+        result = [taxon]
+        while taxon != 'Primates':
+            taxon = tax_dict.get(taxon)
+            result.append(taxon)
+        return result
+
+    def get_lca(taxon1, taxon2):
+        taxon1_ancestors = get_ancestors(taxon1)
+        for taxon in get_ancestors(taxon2):
+            if taxon in taxon1_ancestors:
+                return taxon
+
+    def get_lca_list(taxa):
+        taxon1 = taxa[-1]
+        for taxon2 in taxa[:-1]:
+            taxon1 = get_lca(taxon1, taxon2)
+        return taxon1
+
+    # what the spacer prints showed, without a print in the function
+    _, tracer = trace(get_ancestors_rec, 'Galago alleni')
+    tracer.print_tree()
+
+    with Tracer(get_lca_list, get_lca, get_ancestors) as tracer:
+        get_lca_list(['Pan troglodytes', 'Tarsius tarsier', 'Pongo abelii'])
+    tracer.print_tree()
+    tracer.print_summary()
+    path = os.path.join(tempfile.mkdtemp(), 'lca.folded')
+    tracer.write_folded(path)
+    print(open(path).read())
+
+    # cost: nothing while off, the print version pays on every call
+    from benchmarks import synthetic_taxonomy
+    tax_dict, _ = synthetic_taxonomy(2000, 200, 4)
+    taxa = list(tax_dict)[:500]
+
+    def get_ancestors_print(taxon, depth):
+        spacer = ' ' * depth
+        print(spacer + 'Getting the ancestor for ' + taxon)
+        if taxon == 'Primates':
+            return []
+        parent = tax_dict.get(taxon)
+        print(spacer + 'The parent is ' + parent)
+        return [parent] + get_ancestors_print(parent, depth + 4)
+
+    def timed(run):
+        start = time.perf_counter()
+        run()
+        return time.perf_counter() - start
+
+    plain = timed(lambda: [get_ancestors_rec(taxon) for taxon in taxa])
+    with open(os.devnull, 'w') as devnull:
+        stdout, sys.stdout = sys.stdout, devnull
+        try:
+            printing = timed(lambda: [get_ancestors_print(taxon, 0) for taxon in taxa])
+        finally:
+            sys.stdout = stdout
+    with Tracer(get_ancestors_rec) as tracer:
+        traced = timed(lambda: [get_ancestors_rec(taxon) for taxon in taxa])
+    after = timed(lambda: [get_ancestors_rec(taxon) for taxon in taxa])
+    print('tracer off: {:.3f}s, print to /dev/null: {:.3f}s, tracer on: {:.3f}s ({} calls), off again: {:.3f}s'.format(
+        plain, printing, traced, len(tracer.calls), after))
@@ -0,0 +1,131 @@
+#----------------- Tree and k-mer routines as a library ------------------------#
+
+# The routines from 1_Recursion_and_Trees.py, importable without running a lesson
+#   - the tree is passed in instead of read from the global tax_dict / new_tax_dict
+#   - nothing prints, nothing changes the lists passed in
+#   - any root works: a taxon with no parent (or that is its own parent) ends a lineage,
+#     not just 'Primates'
+# Importing this module only defines functions (a fraction of a millisecond)
+#   - the array-backed versions (Taxonomy, LcaIndex, AncestorCache, ...) are attributes of
+#     this module too, but their modules (and NumPy) are only imported when first used
+#   - python benchmarks.py startup checks the import time against a budget
+
+
+# ---------- k-mers ---------- #
+
+def generate_kmers(length):
+    result = ['']
+    for _ in range(length):
+        result = [kmer + base for kmer in result for base in 'ATGC']
+    return result
+
+
+def generate_kmers_rec(length):
+    if length == 1:
+        return ['A', 'T', 'G', 'C']
+    return [seq + base for seq in generate_kmers_rec(length - 1) for base in 'ATGC']
+
+
+# ---------- child -> parent trees ---------- #
+
+def get_parent(tax_dict, taxon):
+    # None at a root
+    parent = tax_dict.get(taxon)
+    return None if parent == taxon else parent
+
+
+def get_ancestors(tax_dict, taxon):
+    # [taxon, parent, ..., root]
+    result = [taxon]
+    parent = get_parent(tax_dict, taxon)
+    while parent is not None:
+        result.append(parent)
+        parent = get_parent(tax_dict, parent)
+        if len(result) > len(tax_dict) + 1:
+            raise ValueError('the parent links above ' + repr(taxon) + ' contain a cycle')
+    return result
+
+
+def get_ancestors_rec(tax_dict, taxon):
+    # [parent, ..., root]: everything above the taxon
+    #   - one call per level, so lineages deeper than the recursion limit fail
+    parent = get_parent(tax_dict, taxon)
+    if parent is None:
+        return []
+    return [parent] + get_ancestors_rec(tax_dict, parent)
+
+
+def get_lca(tax_dict, taxon1, taxon2):
+    # last common ancestor of two taxa (a taxon counts as its own ancestor), None if there is none
+    taxon1_ancestors = set(get_ancestors(tax_dict, taxon1))
+    for taxon in get_ancestors(tax_dict, taxon2):
+        if taxon in taxon1_ancestors:
+            return taxon
+    return None
+
+
+def get_lca_list(tax_dict, taxa):
+    # last common ancestor of any number of taxa
+    taxa = list(taxa)
+    lca = taxa.pop()
+    while taxa and lca is not None:
+        lca = get_lca(tax_dict, lca, taxa.pop())
+    return lca
+
+
+def get_lca_rec(tax_dict, taxa):
+    if len(taxa) == 1:
+        return taxa[0]
+    if len(taxa) == 2:
+        return get_lca(tax_dict, taxa[0], taxa[1])
+    lca_rest = get_lca_rec(tax_dict, taxa[:-1])
+    return None if lca_rest is None else get_lca(tax_dict, taxa[-1], lca_rest)
+
+
+# ---------- parent -> children trees ---------- #
+
+def get_children(children_dict, taxon):
+    # the taxon and everything below it
+    result = []
+    stack = [taxon]
+    while stack:
+        current_taxon = stack.pop()
+        stack.extend(children_dict.get(current_taxon, []))
+        result.append(current_taxon)
+    return result
+
+
+def get_children_rec(children_dict, taxon):
+    result = [taxon]
+    for child in children_dict.get(taxon, []):
+        result.extend(get_children_rec(children_dict, child))
+    return result
+
+
+# ---------- the scaled-up versions, imported on first use ---------- #
+
+_LAZY = {
+    'KmerSpace': 'kmers',
+    'count_kmers': 'kmer_count',
+    'count_kmers_file': 'kmer_count',
+    'Taxonomy': 'taxonomy',
+    'LcaIndex': 'lca',
+    'AncestorCache': 'ancestor_cache',
+    'SubtreeIndex': 'subtree_index',
+    'load_ncbi_taxonomy': 'ncbi_taxonomy',
+    'LcaClassifier': 'classify',
+}
+
+
+def __getattr__(name):
+    module = _LAZY.get(name)
+    if module is None:
+        raise AttributeError('module {!r} has no attribute {!r}'.format(__name__, name))
+    import importlib
+    value = getattr(importlib.import_module(module), name)
+    globals()[name] = value  # the next lookup does not come through here
+    return value
+
+
+def __dir__():
+    return sorted(list(globals()) + list(_LAZY))